@@ -0,0 +1,108 @@
+#
+import glob
+import os
+import time
+import h5py as h5
+from pathos.multiprocessing import Pool, cpu_count
+from rsbeams.rsdata.switchyard import Switchyard, supported_codes
+from rsbeams.rsdata.genesis import default_chunk_rows
+
+_extensions = {'elegant': '.sdds', 'genesis': '.dist', 'genesis4': '.h5', 'opal': '.h5', 'openpmd': '.h5'}
+
+
+def _detect_format(file_path):
+    """Guess the code format of a particle file from its contents."""
+    if h5.is_hdf5(file_path):
+        with h5.File(file_path, 'r') as f:
+            if 'openPMD' in f.attrs:
+                return 'openpmd'
+            if any([key.startswith('Step#') for key in f.keys()]):
+                return 'opal'
+        return 'genesis'
+    with open(file_path, 'rb') as f:
+        if f.read(5) == b'SDDS1':
+            return 'elegant'
+    return 'genesis'
+
+
+def _output_path(input_path, output_format, output_dir):
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    directory = output_dir or os.path.dirname(input_path)
+    return os.path.join(directory, stem + '.{}{}'.format(output_format, _extensions[output_format]))
+
+
+def _convert_one(job):
+    input_path, input_format, output_path, output_format, chunk_rows = job
+    start = time.time()
+    Switchyard.convert(input_path, input_format, output_path, output_format, chunk_rows=chunk_rows)
+    return input_path, output_path, time.time() - start, os.path.getsize(input_path)
+
+
+def _report(input_path, output_path, seconds, size):
+    print('{} -> {}: {:.2f} s, {:.1f} MB/s'.format(input_path, output_path, seconds,
+                                                 size / 1e6 / max(seconds, 1e-9)), flush=True)
+    return size
+
+
+# Public Functions
+
+def convert(pattern, output_format, input_format=None, output_dir=None, workers=None, chunk_rows=default_chunk_rows,
+            force=False):
+    """Convert all particle files matching a glob pattern, in parallel, with Switchyard.
+
+    Outputs newer than their input are skipped unless `force` is set.
+
+    Args:
+        pattern (str): glob of input files, e.g. 'run*/*.sdds' (quote it in the shell)
+        output_format (str): one of elegant, genesis, genesis4, opal, openpmd
+        input_format (str): code format of the inputs; detected per file if not given
+        output_dir (str): directory for outputs; defaults to each input's directory
+        workers (int): number of worker processes; defaults to the number of CPUs
+        chunk_rows (int): particles held in memory at a time by each worker
+        force (bool): convert even if the output is up to date
+    """
+    if output_format not in _extensions:
+        raise ValueError("output_format must be one of {}".format(', '.join(_extensions)))
+    if input_format is not None and input_format not in supported_codes:
+        raise ValueError("input_format must be one of {}".format(', '.join(supported_codes)))
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    jobs = []
+    skipped = 0
+    output_suffix = '.{}{}'.format(output_format, _extensions[output_format])
+    for input_path in sorted(glob.glob(pattern)):
+        # Outputs of an earlier run can match the same pattern
+        if input_path.endswith(output_suffix):
+            continue
+        output_path = _output_path(input_path, output_format, output_dir)
+        if not force and os.path.exists(output_path) and \
+                os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+            skipped += 1
+            continue
+        jobs.append((input_path, input_format or _detect_format(input_path), output_path, output_format,
+                     int(chunk_rows)))
+
+    if not jobs:
+        print('No files to convert ({} up to date)'.format(skipped))
+        return
+
+    workers = min(int(workers or cpu_count()), len(jobs))
+    start = time.time()
+    total_bytes = 0
+    # Each file is reported as soon as it is converted, in completion order
+    if workers > 1:
+        pool = Pool(workers)
+        try:
+            for result in pool.imap_unordered(_convert_one, jobs):
+                total_bytes += _report(*result)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in jobs:
+            total_bytes += _report(*_convert_one(job))
+    wall = time.time() - start
+
+    print('Converted {} files ({} up to date) with {} workers in {:.2f} s: {:.1f} MB/s'.format(
+        len(jobs), skipped, workers, wall, total_bytes / 1e6 / max(wall, 1e-9)))
@@ -325,6 +325,52 @@ class readSDDS:
 
         Returns:
 
+        """
+        for page, parameter_data, column_data in self._iter_page_data(pages):
+            if parameter_data:
+                self._parameters.add(parameter_data)
+            if column_data:
+                self._columns.add(column_data)
+        if self._parameters:
+            self._parameters.concat()
+        if self._columns:
+            self._columns.concat()
+
+    def iter_pages(self, pages=None):
+        """
+        Read the file one page at a time. Unlike `read`, page data is not accumulated on the readSDDS
+        instance, so only one page is held in memory at a time (the file itself is still held if buffer=True).
+
+        Args:
+            pages: If None then all pages are read. Otherwise an iterable of page numbers to read, indexed to 0.
+                Only these pages are yielded; the others are skipped without reading their column data.
+
+        Yields:
+            (page, parameters, columns): page number, structured array of the page's parameter values (None if
+            there are no parameters) and structured array of the page's column rows (None if there are no
+            columns or no rows).
+        """
+        if pages is not None:
+            pages = list(pages)
+        for page, parameter_data, column_data in self._iter_page_data(pages):
+            if pages is not None and page not in pages:
+                continue
+            parameters, columns = None, None
+            if parameter_data:
+                parameters = self._merge_page(self._parameters, parameter_data)[0]
+            if column_data:
+                columns = self._merge_page(self._columns, column_data)
+            yield page, parameters, columns
+
+    def _merge_page(self, struct_data, page_data):
+        page = StructData(struct_data.data_type, self.max_string_length)
+        page.add(page_data)
+        return page._data[0]
+
+    def _iter_page_data(self, pages=None):
+        """
+        Walk the pages of the file, yielding (page, parameter_data, column_data) raw reads. parameter_data is None
+        for pages that were not requested and column_data is None for pages whose columns were skipped.
         """
         # Always start after the header
         if not self.buffer:
@@ -353,21 +399,18 @@ class readSDDS:
 
         for page in pages:
             if not isinstance(user_pages, GeneratorType) and page > np.max(user_pages):
-                print(page, user_pages)
-                print('stopping here')
                 break
 
             if self._check_file_end(position):
-                # TODO: Get the logic right here. Should not trigger unless user requests a bad page.
-                if page in user_pages:
+                # Only a page the user asked for by number is missing; reading all pages always ends here
+                if not isinstance(user_pages, GeneratorType) and page in user_pages:
                     print('Could not read page {}'.format(page))
                 break
 
             # parameters are always read because we need to know if column_rows changes between pages
             parameter_data, position = self._get_parameter_data(self._parameter_keys, position)
-            # save data if needed
-            if parameter_data and (page in user_pages):
-                self._parameters.add(parameter_data)
+            # return data if needed
+            page_parameters = parameter_data if parameter_data and (page in user_pages) else None
 
             if len(self.data['&column']) == 0:
                 row_count = 0
@@ -377,17 +420,19 @@ class readSDDS:
                 row_count = self._get_ascii_row_count(position)
 
             if row_count is 0:
+                yield page, page_parameters, None
                 continue
+            column_data = None
             if (isinstance(user_pages, GeneratorType) or (page in user_pages)) or self._variable_length_records:
                 column_data, position = self._get_column_data(self._column_keys, position, row_count)
-                self._columns.add(column_data)
             else:
                 # still need to update position what would have been read
-                position += np.dtype(self._column_keys[0]).itemsize * row_count
-        if self._parameters:
-            self._parameters.concat()
-        if self._columns:
-            self._columns.concat()
+                skip = np.dtype(self._column_keys[0]).itemsize * row_count
+                if self.buffer:
+                    position += skip
+                else:
+                    self.openf.seek(skip, 1)
+            yield page, page_parameters, column_data
 
     def _get_parameter_data(self, data_keys, position):
         data_arrays = [[]]
@@ -604,6 +649,51 @@ class writeSDDS:
 
         outputFile.write('&data mode={}, &end\n'.format(self.dataMode).encode())
 
+    def _get_column_block(self):
+        """
+        If every column is, in order, a column view of one C-contiguous 2D array then return that array so it
+        can be written directly instead of being restacked with `np.column_stack`. Otherwise return None.
+        """
+        if len(self.columns) < 2:
+            return None
+        block = self.columns[0]['colData'].base
+        if not isinstance(block, np.ndarray) or block.ndim != 2 or not block.flags.c_contiguous \
+                or block.shape[1] != len(self.columns):
+            return None
+        for i, column in enumerate(self.columns):
+            data = column['colData']
+            if data.base is not block or data.shape != (block.shape[0],) or data.strides != (block.strides[0],) \
+                    or data.__array_interface__['data'][0] != block.ctypes.data + i * block.itemsize:
+                return None
+
+        return block
+
+    def _write_page_start(self, outputFile, row_count):
+        # Begin header writeout
+        self._write_header(outputFile)
+
+        # Write row count. Write 0 if no rows.
+        if self.dataMode == 'binary':
+            # Row count precedes parameter entries in a binary file
+            outputFile.write(pack('I', row_count))
+
+        # Write Parameters
+        for parameter in self.parameters:
+            # Pass if fixed_value used (parData will be None)
+            if parameter['parData']:
+                if self.dataMode == 'ascii':
+                        outputFile.write('{}\n'.format(parameter['parData']).encode())
+                if self.dataMode == 'binary':
+                        outputFile.write(pack('={}'.format(self.key_indentity[parameter['parType']]),
+                                              parameter['parData']))
+
+        # Write row count. Write 0 if no rows.
+        if self.dataMode == 'ascii':
+            # Row count follows parameter entries in an ascii file
+            # Should not appear in ascii if 0
+            if row_count:
+                outputFile.write('{}\n'.format(row_count).encode())
+
     def save_sdds(self, fileName, dataMode='ascii'):
         """
         Saves the parameters and columns to file. Parameters and columns are written to the file in the order
@@ -621,7 +711,10 @@ class writeSDDS:
         outputFile = open(fileName, 'wb')
 
         # Verify Column Data Integrity
-        if len(self.columns) > 1:
+        column_block = self._get_column_block()
+        if column_block is not None:
+            column_data = column_block
+        elif len(self.columns) > 1:
             try:
                 column_data = np.column_stack([columns['colData'] for columns in self.columns])
             except ValueError:
@@ -632,30 +725,7 @@ class writeSDDS:
         else:
             column_data = np.empty([0])
 
-        # Begin header writeout
-        self._write_header(outputFile)
-
-        # Write row count. Write 0 if no rows.
-        if self.dataMode == 'binary':
-            # Row count precedes parameter entries in a binary file
-            outputFile.write(pack('I', column_data.shape[0]))
-
-        # Write Parameters
-        for parameter in self.parameters:
-            # Pass if fixed_value used (parData will be None)
-            if parameter['parData']:
-                if self.dataMode == 'ascii':
-                        outputFile.write('{}\n'.format(parameter['parData']).encode())
-                if self.dataMode == 'binary':
-                        outputFile.write(pack('={}'.format(self.key_indentity[parameter['parType']]),
-                                              parameter['parData']))
-
-        # Write row count. Write 0 if no rows.
-        if self.dataMode == 'ascii':
-            # Row count follows parameter entries in an ascii file
-            # Should not appear in ascii if 0
-            if column_data.shape[0]:
-                outputFile.write('{}\n'.format(column_data.shape[0]).encode())
+        self._write_page_start(outputFile, column_data.shape[0])
 
         # Write Columns
         if self.dataMode == 'ascii':
@@ -667,3 +737,60 @@ class writeSDDS:
             print("NOT A DEFINED DATA TYPE")
 
         outputFile.close()
+
+    def open_stream(self, fileName, row_count, dataMode='binary'):
+        """
+        Start writing a single page whose column data is supplied in blocks of rows, so the full columns never
+        need to be held in memory. Columns are defined with `create_column` as usual (colData may be None) and
+        the header, row count and parameters are written immediately. Rows are then appended with `write_rows`
+        and the file is finished with `close_stream`.
+
+        Parameters
+        ----------
+        fileName: str
+            Name of the file to be written.
+        row_count: int
+            Total number of rows that will be written.
+        dataMode: Either 'ascii' or 'binary'
+            Write mode for the file.
+        """
+        self.dataMode = dataMode
+        self._stream = open(fileName, 'wb')
+        self._stream_rows = (row_count, 0)
+        self._write_page_start(self._stream, row_count)
+
+    def write_rows(self, rows):
+        """
+        Append a block of rows to a page opened with `open_stream`.
+
+        Parameters
+        ----------
+        rows: ndarray
+            (n, number of columns) array. Columns must be in the order they were created.
+
+        Raises
+        ------
+        ValueError
+            If the rows would go past the row count declared in `open_stream`.
+        """
+        declared, written = self._stream_rows
+        if written + rows.shape[0] > declared:
+            raise ValueError('{} rows declared but {} rows written'.format(declared, written + rows.shape[0]))
+        if self.dataMode == 'ascii':
+            np.savetxt(self._stream, rows)
+        else:
+            np.ascontiguousarray(rows).tofile(self._stream)
+        self._stream_rows = (self._stream_rows[0], self._stream_rows[1] + rows.shape[0])
+
+    def close_stream(self):
+        """
+        Finish a page opened with `open_stream`.
+
+        Raises
+        ------
+        ValueError
+            If fewer rows were written than declared in `open_stream`, so the header row count is wrong.
+        """
+        self._stream.close()
+        if self._stream_rows[0] != self._stream_rows[1]:
+            raise ValueError('{} rows declared but {} rows written'.format(*self._stream_rows))
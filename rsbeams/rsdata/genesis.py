@@ -0,0 +1,302 @@
+import re
+from itertools import islice
+import numpy as np
+import h5py as h5
+from scipy.constants import c
+from rsbeams.rsdata.streaming import check_rows_written, write_columns, iter_columns
+
+# Genesis 1.3 ASCII distribution columns and Genesis 4 HDF5 distribution datasets, in Species column order
+genesis_columns = ['X', 'PX', 'Y', 'PY', 'T', 'P']
+genesis4_datasets = ['x', 'px', 'y', 'py', 't', 'p']
+# Rows formatted, parsed or written per block
+default_chunk_rows = 2**16
+# Genesis 4 particle dumps store each slice as a group named slice<index>
+_slice_pattern = re.compile(r'^slice(\d+)$')
+
+
+class GenesisDistributionWriter:
+    """
+    Streaming writer for Genesis 1.3 ASCII distribution files.
+    The header is written on initialization and rows are then appended block by block with `write`, so the
+    particle data never has to be held in memory (or copied) in full.
+
+    File format (per documentation):
+        ? VERSION = <version>
+        ? CHARGE = <total charge in C>
+        ? SIZE = <number of particles>
+        ? COLUMNS X PX Y PY T P
+        followed by one particle per line.
+    """
+
+    def __init__(self, file_name, size, total_charge, version='2.0', fmt='%.17g'):
+        """
+        Open `file_name` and write the header.
+        :param file_name: (str) Name of the file to write to.
+        :param size: (int) Total number of particles that will be written.
+        :param total_charge: (float) Total bunch charge in C.
+        :param version: (str) Version string written to the header.
+        :param fmt: (str) printf-style format used for each value. The default is lossless for doubles.
+        """
+        self.file_name = file_name
+        self.size = size
+        self.rows_written = 0
+        self._row_format = ' '.join([fmt] * len(genesis_columns)) + '\n'
+        self.openf = open(file_name, 'w')
+        self.openf.write('? VERSION = {}\n'.format(version))
+        self.openf.write('? CHARGE = {}\n'.format(total_charge))
+        self.openf.write('? SIZE = {}\n'.format(size))
+        self.openf.write('? COLUMNS {}\n'.format(' '.join(genesis_columns)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, block):
+        """
+        Append a block of particles.
+        :param block: (ndarray) (n, 6) array of X, PX, Y, PY, T, P in Genesis units.
+        """
+        # One string operation per block is several times faster than np.savetxt or pandas.to_csv
+        rows = block.tolist()
+        self.openf.write(''.join(map(self._row_format.__mod__, map(tuple, rows))))
+        self.rows_written += len(rows)
+
+    def close(self):
+        """Close the file. Raises ValueError if the rows written differ from the declared SIZE."""
+        self.openf.close()
+        check_rows_written(self.file_name, self.size, self.rows_written)
+
+
+class Genesis4Writer:
+    """
+    Streaming writer for Genesis 4 HDF5 particle distributions (as read by &importdistribution).
+    Datasets x, px, y, py, t and p are preallocated with `size` rows and filled block by block with `write`.
+    """
+
+    def __init__(self, file_name, size, total_charge, chunk_rows=default_chunk_rows):
+        """
+        Create `file_name` and allocate the particle datasets.
+        :param file_name: (str) Name of the file to write to.
+        :param size: (int) Total number of particles that will be written.
+        :param total_charge: (float) Total bunch charge in C.
+        :param chunk_rows: (int) HDF5 chunk length of the datasets.
+        """
+        self.file_name = file_name
+        self.size = size
+        self.rows_written = 0
+        self.h5file = h5.File(file_name, 'w')
+        self.h5file.create_dataset('charge', data=total_charge)
+        chunks = (min(chunk_rows, size),) if size else None
+        self._datasets = [self.h5file.create_dataset(name, shape=(size,), dtype=np.float64, chunks=chunks)
+                          for name in genesis4_datasets]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, block):
+        """
+        Write the next block of particles.
+        :param block: (ndarray) (n, 6) array of x, px, y, py, t, p in Genesis units.
+        """
+        self.rows_written = write_columns(self._datasets, block, self.rows_written)
+
+    def close(self):
+        """Close the file. Raises ValueError if fewer rows than allocated were written."""
+        self.h5file.close()
+        check_rows_written(self.file_name, self.size, self.rows_written)
+
+
+class GenesisDistributionReader:
+    """
+    Reader for Genesis 1.3 ASCII distribution files.
+    Only the `?` header lines are read on initialization. Particle rows are parsed in blocks and returned
+    as X, PX, Y, PY, T, P regardless of the column names used in the file (XPRIME, YPRIME, Z and GAMMA are
+    converted).
+    """
+
+    def __init__(self, file_name):
+        """
+        Open a Genesis distribution file and parse its header.
+        :param file_name: (str) Name of the file to read.
+        """
+        self.file_name = file_name
+        self.header = {}
+        self.openf = open(file_name, 'r')
+        while True:
+            data_start = self.openf.tell()
+            line = self.openf.readline()
+            if not line.startswith('?'):
+                break
+            line = line.lstrip('? ').strip()
+            if '=' in line:
+                key, value = line.split('=', 1)
+            else:
+                key, value = line.split(None, 1)
+            self.header[key.strip().upper()] = value.strip()
+        self._data_start = data_start
+        self.columns = self.header.get('COLUMNS', ' '.join(genesis_columns)).upper().split()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.openf.close()
+
+    def particle_count(self):
+        """Number of particles declared by the SIZE header line, or None if it is not present."""
+        try:
+            return int(self.header['SIZE'])
+        except KeyError:
+            return None
+
+    def total_charge(self):
+        try:
+            return float(self.header['CHARGE'])
+        except KeyError:
+            return None
+
+    def iter_chunks(self, chunk_rows=default_chunk_rows):
+        """
+        Iterate over the particle rows in blocks.
+        :param chunk_rows: (int) Rows per block.
+        :return: Generator of (n, 6) ndarrays of X, PX, Y, PY, T, P
+        """
+        self.openf.seek(self._data_start)
+        while True:
+            lines = list(islice(self.openf, chunk_rows))
+            if not lines:
+                break
+            block = np.fromstring(''.join(lines), dtype=float, sep=' ').reshape(-1, len(self.columns))
+            yield self._standardize(block)
+
+    def read(self):
+        """
+        Read all particle rows.
+        :return: (ndarray) (N, 6) array of X, PX, Y, PY, T, P
+        """
+        self.openf.seek(self._data_start)
+        data = np.fromstring(self.openf.read(), dtype=float, sep=' ').reshape(-1, len(self.columns))
+
+        return self._standardize(data)
+
+    def _standardize(self, data):
+        if self.columns == genesis_columns:
+            return data
+        columns = {name: data[:, i] for i, name in enumerate(self.columns)}
+        block = np.empty((data.shape[0], 6))
+        block[:, 0] = columns['X']
+        block[:, 2] = columns['Y']
+        if 'P' in columns:
+            block[:, 5] = columns['P']
+        else:
+            block[:, 5] = np.sqrt(columns['GAMMA']**2 - 1.)
+        for i, (momentum, angle) in zip([1, 3], [('PX', 'XPRIME'), ('PY', 'YPRIME')]):
+            if momentum in columns:
+                block[:, i] = columns[momentum]
+            else:
+                np.multiply(columns[angle], block[:, 5], out=block[:, i])
+        if 'T' in columns:
+            block[:, 4] = columns['T']
+        else:
+            # The head of the bunch (larger Z) arrives first
+            np.divide(columns['Z'], -c, out=block[:, 4])
+
+        return block
+
+
+class Genesis4Reader:
+    """
+    Reader for Genesis 4 HDF5 particle files. Handles both the distribution format (datasets x, px, y, py,
+    t, p as written by Genesis4Writer) and the particle dump format (one group per slice holding x, px, y,
+    py, theta and gamma). Data is read in hyperslabs and returned as x, px, y, py, t, p.
+    """
+
+    def __init__(self, file_name):
+        """
+        Open a Genesis 4 HDF5 file.
+        :param file_name: (str) Name of the file to read.
+        """
+        self.file_name = file_name
+        self.h5file = h5.File(file_name, 'r')
+        self.is_dump = 'slicecount' in self.h5file
+        slices = []
+        if self.is_dump:
+            for name in self.h5file.keys():
+                match = _slice_pattern.match(name)
+                if match and isinstance(self.h5file[name], h5.Group):
+                    slices.append((int(match.group(1)), name))
+        self.slices = sorted(slices)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.h5file.close()
+
+    def particle_count(self):
+        if self.is_dump:
+            return sum([self.h5file[name]['x'].shape[0] for _, name in self.slices])
+        return self.h5file['x'].shape[0]
+
+    def total_charge(self):
+        if self.is_dump:
+            # Each slice carries its current; the charge of a slice is current * slice spacing / c
+            spacing = self.h5file['slicespacing'][()]
+            current = [np.sum(self.h5file[name]['current'][()]) for _, name in self.slices]
+            return float(np.sum(current) * spacing / c)
+        if 'charge' in self.h5file:
+            return float(self.h5file['charge'][()])
+        return None
+
+    def iter_chunks(self, chunk_rows=default_chunk_rows):
+        """
+        Iterate over the particles in blocks. Particle dumps are read one slice at a time.
+        :param chunk_rows: (int) Rows per block.
+        :return: Generator of (n, 6) ndarrays of x, px, y, py, t, p
+        """
+        if self.is_dump:
+            for index, name in self.slices:
+                for block in self._iter_slice(index, self.h5file[name], chunk_rows):
+                    yield block
+        else:
+            for block in iter_columns([self.h5file[name] for name in genesis4_datasets], chunk_rows):
+                yield block
+
+    def read(self):
+        """
+        Read all particles.
+        :return: (ndarray) (N, 6) array of x, px, y, py, t, p
+        """
+        data = np.empty((self.particle_count(), 6))
+        start = 0
+        for block in self.iter_chunks():
+            data[start:start + block.shape[0]] = block
+            start += block.shape[0]
+
+        return data
+
+    def _iter_slice(self, index, group, chunk_rows):
+        spacing = self.h5file['slicespacing'][()]
+        wavelength = self.h5file['slicelength'][()]
+        size = group['x'].shape[0]
+        for start in range(0, size, chunk_rows):
+            stop = min(start + chunk_rows, size)
+            block = np.empty((stop - start, 6))
+            for i, name in enumerate(['x', 'px', 'y', 'py']):
+                block[:, i] = group[name][start:stop]
+            # Position in the bunch from the slice index and the ponderomotive phase within the slice
+            z = (index - 1) * spacing + group['theta'][start:stop] / (2. * np.pi) * wavelength
+            np.divide(z, -c, out=block[:, 4])
+            block[:, 5] = np.sqrt(group['gamma'][start:stop]**2 - 1.)
+            yield block
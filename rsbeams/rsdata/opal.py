@@ -0,0 +1,220 @@
+import re
+import numpy as np
+import h5py as h5
+from rsbeams.rsdata.streaming import check_rows_written, write_columns, read_columns, iter_columns
+
+# OPAL H5Part output stores each dump as a group named Step#<k>
+_step_pattern = re.compile(r'^Step#(\d+)$')
+# Coordinate datasets in the order used by Species
+opal_coordinates = ['x', 'px', 'y', 'py', 'z', 'pz']
+# Target number of rows read per hyperslab when the datasets are not chunked
+default_chunk_rows = 2**20
+
+
+class OpalReader:
+    """
+    Lazy reader for OPAL H5Part particle output.
+    The file is held open and only step metadata is read on initialization. Particle data is read in
+    hyperslabs aligned to the HDF5 chunk layout so that large, multi-step files can be processed with
+    bounded memory.
+
+    Usage:
+        with OpalReader('run.h5') as reader:
+            for step in reader.steps:
+                for block in reader.iter_chunks(step):
+                    ...
+    """
+
+    def __init__(self, file_name):
+        """
+        Open an OPAL H5Part file and index the steps it contains.
+        :param file_name: (str) Name of the OPAL HDF5 file.
+        """
+        self.file_name = file_name
+        self.h5file = h5.File(file_name, 'r')
+        steps = []
+        for name in self.h5file.keys():
+            match = _step_pattern.match(name)
+            if match:
+                steps.append(int(match.group(1)))
+        self.steps = sorted(steps)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.steps)
+
+    def close(self):
+        self.h5file.close()
+
+    def _get_step(self, step_number=None):
+        if step_number is None:
+            step_number = self.steps[-1]
+        try:
+            return self.h5file['Step#{}'.format(step_number)]
+        except KeyError:
+            raise KeyError("Step#{} not found in {}".format(step_number, self.file_name))
+
+    def particle_count(self, step_number=None):
+        """
+        Number of macroparticles in a step.
+        :param step_number: (int) Step to query. Defaults to the last step in the file.
+        :return: (int)
+        """
+        return self._get_step(step_number)['z'].shape[0]
+
+    def attributes(self, step_number=None):
+        """
+        Step attributes (CHARGE, SPOS, TIME, etc.) as a dict.
+        :param step_number: (int) Step to query. Defaults to the last step in the file.
+        :return: (dict)
+        """
+        return dict(self._get_step(step_number).attrs)
+
+    def total_charge(self, step_number=None):
+        return self._get_step(step_number).attrs['CHARGE']
+
+    def datasets(self, step_number=None):
+        """
+        Names of the per-particle datasets in a step, e.g. the coordinates, 'q' (macroparticle charge) and 'id'.
+        :param step_number: (int) Step to query. Defaults to the last step in the file.
+        :return: (list)
+        """
+        step = self._get_step(step_number)
+        return [name for name in step.keys() if isinstance(step[name], h5.Dataset)]
+
+    def read_dataset(self, name, step_number=None, start=0, stop=None):
+        """
+        Read rows of a single per-particle dataset.
+        :param name: (str) Dataset name, e.g. 'q' or 'id'.
+        :param step_number: (int) Step to read. Defaults to the last step in the file.
+        :param start: (int) First row to read.
+        :param stop: (int) Row to stop before. Defaults to the end of the dataset.
+        :return: (ndarray)
+        """
+        return self._get_step(step_number)[name][start:stop]
+
+    def chunk_rows(self, step_number=None, target_rows=default_chunk_rows):
+        """
+        Number of rows to read per hyperslab. If the coordinate datasets are chunked this is the largest
+        multiple of the chunk length not exceeding `target_rows` (and at least one chunk).
+        :param step_number: (int) Step to query. Defaults to the last step in the file.
+        :param target_rows: (int) Approximate number of rows wanted per read.
+        :return: (int)
+        """
+        chunks = self._get_step(step_number)['z'].chunks
+        if not chunks:
+            return target_rows
+        return max(target_rows // chunks[0], 1) * chunks[0]
+
+    def iter_chunks(self, step_number=None, chunk_rows=None):
+        """
+        Iterate over the particle data of one step in row blocks.
+        Each block is a new (n, 6) array with columns ordered x, px, y, py, z, pz.
+        :param step_number: (int) Step to read. Defaults to the last step in the file.
+        :param chunk_rows: (int) Rows per block. Defaults to a multiple of the HDF5 chunk length.
+        :return: Generator of ndarrays
+        """
+        step = self._get_step(step_number)
+        if not chunk_rows:
+            chunk_rows = self.chunk_rows(step_number)
+        for block in iter_columns([step[coord] for coord in opal_coordinates], chunk_rows):
+            yield block
+
+    def read_step(self, step_number=None, out=None):
+        """
+        Read all particle data in one step.
+        :param step_number: (int) Step to read. Defaults to the last step in the file.
+        :param out: (ndarray) Optional (N, 6) array to fill.
+        :return: (ndarray) (N, 6) array with columns ordered x, px, y, py, z, pz.
+        """
+        step = self._get_step(step_number)
+        mp_count = step['z'].shape[0]
+        if out is None:
+            out = np.empty((mp_count, 6))
+        if out.shape != (mp_count, 6):
+            raise ValueError("out must have shape ({}, 6), not {}".format(mp_count, out.shape))
+        datasets = [step[coord] for coord in opal_coordinates]
+        chunk_rows = self.chunk_rows(step_number)
+        staging = np.empty((6, min(chunk_rows, mp_count)))
+        for start in range(0, mp_count, chunk_rows):
+            read_columns(datasets, out[start:], start, min(start + chunk_rows, mp_count), staging)
+
+        return out
+
+    def iter_steps(self, chunk_rows=None):
+        """
+        Iterate over every step in the file, yielding the step number and a block generator for that step.
+        Only one block is held in memory at a time if the block generators are consumed in order.
+        :param chunk_rows: (int) Rows per block. Defaults to a multiple of the HDF5 chunk length.
+        :return: Generator of (int, generator) tuples
+        """
+        for step_number in self.steps:
+            yield step_number, self.iter_chunks(step_number, chunk_rows=chunk_rows)
+
+
+class OpalWriter:
+    """
+    Streaming writer for one step of OPAL H5Part particle data.
+    Coordinate datasets are preallocated with `size` rows, chunked (and optionally compressed) so that
+    parallel readers can fetch independent hyperslabs, and then filled block by block with `write`.
+    Per-particle charge ('q') and ID ('id') datasets are allocated only if requested.
+    """
+
+    def __init__(self, file_name, size, total_charge, step_number=0, chunk_rows=2**16,
+                 compression=None, compression_opts=None, mode='w', charges=False, ids=False):
+        """
+        Create the Step#<step_number> group in `file_name` and allocate its datasets.
+        :param file_name: (str) Name of the file to write to.
+        :param size: (int) Total number of particles that will be written.
+        :param total_charge: (float) Total bunch charge in C. Stored as the CHARGE attribute of the step.
+        :param step_number: (int) Step to write.
+        :param chunk_rows: (int) HDF5 chunk length of the datasets.
+        :param compression: (str) Optional HDF5 compression filter, e.g. 'gzip' or 'lzf'.
+        :param compression_opts: Options for the compression filter, e.g. the gzip level.
+        :param mode: (str) h5py file mode. Use 'a' to add a step to an existing file.
+        :param charges: (bool) Allocate the per-particle charge dataset 'q'.
+        :param ids: (bool) Allocate the particle ID dataset 'id'.
+        """
+        self.file_name = file_name
+        self.size = size
+        self.rows_written = 0
+        self.h5file = h5.File(file_name, mode)
+        step = self.h5file.create_group('Step#{}'.format(step_number))
+        step.attrs['CHARGE'] = total_charge
+        dataset_options = {'shape': (size,), 'chunks': (min(chunk_rows, size),) if size else None,
+                           'compression': compression, 'compression_opts': compression_opts}
+        self._datasets = [step.create_dataset(coord, dtype=np.float64, **dataset_options)
+                          for coord in opal_coordinates]
+        self._charges = step.create_dataset('q', dtype=np.float64, **dataset_options) if charges else None
+        self._ids = step.create_dataset('id', dtype=np.int64, **dataset_options) if ids else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, block, charges=None, ids=None):
+        """
+        Write the next block of particles.
+        :param block: (ndarray) (n, 6) array with columns ordered x, px, y, py, z, pz.
+        :param charges: (ndarray) (n,) macroparticle charges in C. Required if the writer allocated 'q'.
+        :param ids: (ndarray) (n,) particle IDs. Required if the writer allocated 'id'.
+        """
+        start = self.rows_written
+        stop = write_columns(self._datasets, block, start)
+        if self._charges is not None:
+            self._charges[start:stop] = charges
+        if self._ids is not None:
+            self._ids[start:stop] = ids
+        self.rows_written = stop
+
+    def close(self):
+        """Close the file. Raises ValueError if fewer rows than allocated were written."""
+        self.h5file.close()
+        check_rows_written(self.file_name, self.size, self.rows_written)
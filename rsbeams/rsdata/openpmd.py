@@ -0,0 +1,395 @@
+import numpy as np
+import h5py as h5
+from scipy.constants import c, e
+from rsbeams.rsdata.streaming import check_rows_written
+
+# openPMD unitDimension exponents: (length, mass, time, current, temperature, amount, luminous intensity)
+_unit_dimensions = {'position': (1., 0., 0., 0., 0., 0., 0.),
+                    'positionOffset': (1., 0., 0., 0., 0., 0., 0.),
+                    'momentum': (1., 1., -1., 0., 0., 0., 0.),
+                    'charge': (0., 0., 1., 1., 0., 0., 0.),
+                    'mass': (0., 1., 0., 0., 0., 0., 0.),
+                    'weighting': (0., 0., 0., 0., 0., 0., 0.),
+                    'id': (0., 0., 0., 0., 0., 0., 0.)}
+# Power of the weighting a record scales with when converted between real particles and macroparticles
+_weighting_powers = {'position': 0., 'positionOffset': 0., 'momentum': 1., 'charge': 1., 'mass': 1.,
+                     'weighting': 1., 'id': 0.}
+default_chunk_rows = 2**16
+
+
+def _mc(mass):
+    # mass in eV/c^2 -> m*c in kg m/s
+    return mass * e / c
+
+
+class OpenPMDReader:
+    """
+    Reader for particle data in openPMD HDF5 files.
+    Record components are read one at a time in hyperslabs, scaled by their unitSI and converted to Species
+    conventions (x, ux, y, uy, ct, pt) with momenta in units of m*c. pt carries the sign of the longitudinal
+    momentum. Constant record components (stored as `value`/`shape` attributes) are supported, and records
+    flagged `macroWeighted` are divided by weighting**weightingPower to give the values of one real particle.
+    """
+
+    def __init__(self, file_name):
+        """
+        Open an openPMD file.
+        :param file_name: (str) Name of the file to read.
+        """
+        self.file_name = file_name
+        self.h5file = h5.File(file_name, 'r')
+        base_path = self._attribute(self.h5file, 'basePath', '/data/%T/')
+        self._particles_path = self._attribute(self.h5file, 'particlesPath', 'particles/')
+        self._data_path = base_path.split('%T')[0]
+        self.iterations = sorted([int(it) for it in self.h5file[self._data_path].keys()])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.h5file.close()
+
+    @staticmethod
+    def _attribute(obj, name, default=None):
+        value = obj.attrs.get(name, default)
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def _get_species(self, iteration=None, species=None):
+        if iteration is None:
+            iteration = self.iterations[-1]
+        particles = self.h5file['{}{}/{}'.format(self._data_path, iteration, self._particles_path)]
+        if species is None:
+            species = sorted(particles.keys())[0]
+        return particles[species]
+
+    def species(self, iteration=None):
+        """
+        Names of the particle species in an iteration.
+        :param iteration: (int) Iteration to query. Defaults to the last iteration in the file.
+        :return: (list)
+        """
+        if iteration is None:
+            iteration = self.iterations[-1]
+        return sorted(self.h5file['{}{}/{}'.format(self._data_path, iteration, self._particles_path)].keys())
+
+    def particle_count(self, iteration=None, species=None):
+        return self._component_shape(self._get_species(iteration, species)['position/x'])
+
+    def mass(self, iteration=None, species=None):
+        """Rest mass of the species in eV/c^2. Electrons are assumed if there is no mass record."""
+        group = self._get_species(iteration, species)
+        if 'mass' not in group:
+            return 0.511e6
+        return self._first_value(group, 'mass') * c**2 / e
+
+    def charge(self, iteration=None, species=None):
+        """Charge of the species in units of e. Electrons are assumed if there is no charge record."""
+        group = self._get_species(iteration, species)
+        if 'charge' not in group:
+            return -1
+        return self._first_value(group, 'charge') / e
+
+    def total_charge(self, iteration=None, species=None, chunk_rows=default_chunk_rows):
+        """
+        Total charge of the species in C, from the per-particle charge and weighting records.
+        The records are reduced in hyperslabs, one component at a time.
+        """
+        group = self._get_species(iteration, species)
+        if 'charge' not in group:
+            return None
+        size = self.particle_count(iteration, species)
+        # Each macroparticle holds weighting real particles, weighting**weightingPower of which are already in a
+        # macroWeighted charge
+        power = 1. - self._weighting_power(group['charge'])
+        weighting = group.get('weighting') if power else None
+        charge = np.abs(self._sum_component(group['charge'], size, chunk_rows, weighting, power))
+        return float(charge)
+
+    def scalar_records(self, iteration=None, species=None):
+        """
+        Names of the scalar records (e.g. weighting, charge, id) stored per particle rather than as constants.
+        :return: (list)
+        """
+        group = self._get_species(iteration, species)
+        return sorted([name for name in group.keys() if isinstance(group[name], h5.Dataset)])
+
+    def read_record(self, name, iteration=None, species=None, start=0, stop=None):
+        """
+        Read rows of a scalar record stored per particle, scaled to SI by its unitSI and, if it is macroWeighted,
+        to the value of one real particle.
+        :param name: (str) Record name, e.g. 'weighting' or 'id'.
+        :param start: (int) First row to read.
+        :param stop: (int) Row to stop before. Defaults to the end of the record.
+        :return: (ndarray)
+        """
+        group = self._get_species(iteration, species)
+        component = group[name]
+        values = component[start:stop]
+        unit = component.attrs.get('unitSI', 1.)
+        if unit != 1.:
+            values = values * unit
+        # The weighting itself is macroWeighted by definition and is returned as stored
+        if name != 'weighting':
+            stop = start + values.shape[0]
+            scale = self._real_particle_scale(group, component, start, stop)
+            if scale is not None:
+                values = values * scale
+        return values
+
+    def iter_chunks(self, iteration=None, species=None, chunk_rows=default_chunk_rows):
+        """
+        Iterate over the particles of one species in blocks.
+        :param iteration: (int) Iteration to read. Defaults to the last iteration in the file.
+        :param species: (str) Species to read. Defaults to the first species in the iteration.
+        :param chunk_rows: (int) Rows per block.
+        :return: Generator of (n, 6) ndarrays of x, ux, y, uy, ct, pt
+        """
+        group = self._get_species(iteration, species)
+        size = self.particle_count(iteration, species)
+        mc = _mc(self.mass(iteration, species))
+        for start in range(0, size, chunk_rows):
+            stop = min(start + chunk_rows, size)
+            block = np.empty((stop - start, 6))
+            self._fill_block(group, block, start, stop, mc)
+            yield block
+
+    def read(self, iteration=None, species=None, chunk_rows=default_chunk_rows):
+        """
+        Read all particles of one species.
+        :return: (ndarray) (N, 6) array of x, ux, y, uy, ct, pt
+        """
+        data = np.empty((self.particle_count(iteration, species), 6))
+        start = 0
+        for block in self.iter_chunks(iteration, species, chunk_rows):
+            data[start:start + block.shape[0]] = block
+            start += block.shape[0]
+
+        return data
+
+    def _fill_block(self, group, block, start, stop, mc):
+        rows = stop - start
+        staging = np.empty(rows)
+        position_scale = self._real_particle_scale(group, group['position'], start, stop)
+        offset_scale = None
+        if 'positionOffset' in group:
+            offset_scale = self._real_particle_scale(group, group['positionOffset'], start, stop)
+        for column, axis in [(0, 'x'), (2, 'y'), (4, 'z')]:
+            self._read_component(group['position/' + axis], start, stop, block[:, column])
+            if position_scale is not None:
+                block[:, column] *= position_scale
+            if 'positionOffset' in group:
+                self._read_component(group['positionOffset/' + axis], start, stop, staging)
+                if offset_scale is not None:
+                    staging *= offset_scale
+                block[:, column] += staging
+        # Longitudinal position is stored as time of flight: the head of the bunch (larger z) arrives first
+        block[:, 4] *= -1.
+        self._read_component(group['momentum/x'], start, stop, block[:, 1])
+        self._read_component(group['momentum/y'], start, stop, block[:, 3])
+        self._read_component(group['momentum/z'], start, stop, block[:, 5])
+        momentum_scale = self._real_particle_scale(group, group['momentum'], start, stop)
+        for column in [1, 3, 5]:
+            block[:, column] /= mc
+            if momentum_scale is not None:
+                block[:, column] *= momentum_scale
+        # Total momentum, signed by the direction of travel
+        block[:, 5] = np.copysign(np.sqrt(block[:, 1]**2 + block[:, 3]**2 + block[:, 5]**2), block[:, 5])
+
+    @staticmethod
+    def _weighting_power(record):
+        # Power of the weighting a macroWeighted record has been multiplied by, 0 for per-real-particle values
+        if record.attrs.get('macroWeighted', 0) != 1:
+            return 0.
+        return float(record.attrs.get('weightingPower', 0.))
+
+    def _real_particle_scale(self, group, record, start, stop):
+        # Factor converting rows of a macroWeighted record to one real particle, None if no conversion is needed
+        power = self._weighting_power(record)
+        if not power or 'weighting' not in group:
+            return None
+        weighting = np.empty(stop - start)
+        self._read_component(group['weighting'], start, stop, weighting)
+        return weighting**-power
+
+    def _read_component(self, component, start, stop, out):
+        unit = component.attrs.get('unitSI', 1.)
+        if isinstance(component, h5.Group):
+            # Constant record component
+            out[:] = component.attrs['value'] * unit
+        else:
+            out[:] = component[start:stop]
+            out *= unit
+
+    def _first_value(self, group, name):
+        component = group[name]
+        if isinstance(component, h5.Group):
+            value = component.attrs['value']
+        else:
+            value = component[0]
+        value = value * component.attrs.get('unitSI', 1.)
+        scale = self._real_particle_scale(group, component, 0, 1)
+        if scale is not None:
+            value = value * scale[0]
+        return value
+
+    def _component_shape(self, component):
+        if isinstance(component, h5.Group):
+            return int(component.attrs['shape'][0])
+        return component.shape[0]
+
+    def _sum_component(self, component, size, chunk_rows, weighting=None, power=1.):
+        # Sum of the component times weighting**power
+        total = 0.
+        values = np.empty(min(chunk_rows, size))
+        weights = np.empty(min(chunk_rows, size))
+        for start in range(0, size, chunk_rows):
+            stop = min(start + chunk_rows, size)
+            self._read_component(component, start, stop, values[:stop - start])
+            if weighting is not None:
+                self._read_component(weighting, start, stop, weights[:stop - start])
+                if power != 1.:
+                    weights[:stop - start] **= power
+                total += np.dot(values[:stop - start], weights[:stop - start])
+            else:
+                total += np.sum(values[:stop - start])
+        return total
+
+
+class OpenPMDWriter:
+    """
+    Streaming writer for one particle species in an openPMD (1.1.0, group based) HDF5 file.
+    Coordinate record components are preallocated as chunked datasets and filled block by block with `write`,
+    converting one component at a time from Species conventions. Charge and mass are stored as constant record
+    components, as is the weighting unless per-particle weights are requested. Particle IDs are optional.
+    """
+
+    def __init__(self, file_name, size, total_charge, mass=0.511e6, charge=-1, iteration=0,
+                 species='electrons', chunk_rows=default_chunk_rows, compression=None, compression_opts=None,
+                 weights=False, ids=False):
+        """
+        Create `file_name` and allocate the particle records.
+        :param file_name: (str) Name of the file to write to.
+        :param size: (int) Total number of macroparticles that will be written.
+        :param total_charge: (float) Total bunch charge in C.
+        :param mass: (float) Particle rest mass in eV/c^2. Required, openPMD species always have a mass record.
+        :param charge: (float) Particle charge in units of e. Required, openPMD species always have a charge
+            record.
+        :param iteration: (int) Iteration the data is written under.
+        :param species: (str) Name of the particle species.
+        :param chunk_rows: (int) HDF5 chunk length of the datasets.
+        :param compression: (str) Optional HDF5 compression filter, e.g. 'gzip' or 'lzf'.
+        :param compression_opts: Options for the compression filter.
+        :param weights: (bool) Store the weighting per particle. Otherwise a uniform weighting is derived from
+            `total_charge`.
+        :param ids: (bool) Allocate the particle 'id' record.
+        """
+        if charge is None or mass is None:
+            raise ValueError("The particle charge and mass are needed to write openPMD, got charge={} and "
+                             "mass={}".format(charge, mass))
+        self.file_name = file_name
+        self.size = size
+        self.rows_written = 0
+        self._mc = _mc(mass)
+        self.h5file = h5.File(file_name, 'w')
+        self._write_root_attributes()
+        it = self.h5file.create_group('data/{}'.format(iteration))
+        it.attrs['time'] = 0.
+        it.attrs['dt'] = 1.
+        it.attrs['timeUnitSI'] = 1.
+        self.group = it.create_group('particles/{}'.format(species))
+
+        dataset_options = {'shape': (size,), 'dtype': np.float64, 'chunks': (min(chunk_rows, size),) if size else None,
+                           'compression': compression, 'compression_opts': compression_opts}
+        self._components = {}
+        for record, unit_si in [('position', 1.), ('momentum', self._mc)]:
+            rec = self._create_record(record)
+            for axis in ['x', 'y', 'z']:
+                self._components[record + '/' + axis] = rec.create_dataset(axis, **dataset_options)
+                self._components[record + '/' + axis].attrs['unitSI'] = unit_si
+        rec = self._create_record('positionOffset')
+        for axis in ['x', 'y', 'z']:
+            self._create_constant(rec.create_group(axis), 0., 1.)
+        self._create_constant(self._create_record('charge'), charge, e)
+        self._create_constant(self._create_record('mass'), mass, e / c**2)
+        if weights:
+            self._components['weighting'] = self._create_record('weighting', **dataset_options)
+            self._components['weighting'].attrs['unitSI'] = 1.
+        else:
+            weight = abs(total_charge / (size * charge * e)) if size and total_charge else 1.
+            self._create_constant(self._create_record('weighting'), weight, 1.)
+        if ids:
+            options = dict(dataset_options, dtype=np.uint64)
+            self._components['id'] = self._create_record('id', **options)
+            self._components['id'].attrs['unitSI'] = 1.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write_root_attributes(self):
+        attrs = self.h5file.attrs
+        attrs['openPMD'] = np.bytes_('1.1.0')
+        attrs['openPMDextension'] = np.uint32(0)
+        attrs['basePath'] = np.bytes_('/data/%T/')
+        attrs['particlesPath'] = np.bytes_('particles/')
+        attrs['iterationEncoding'] = np.bytes_('groupBased')
+        attrs['iterationFormat'] = np.bytes_('/data/%T/')
+        attrs['software'] = np.bytes_('rsbeams')
+
+    def _create_record(self, name, **dataset_options):
+        # Scalar records stored per particle are datasets, everything else is a group of components
+        if dataset_options:
+            record = self.group.create_dataset(name, **dataset_options)
+        else:
+            record = self.group.create_group(name)
+        record.attrs['unitDimension'] = np.array(_unit_dimensions[name])
+        record.attrs['timeOffset'] = 0.
+        # Values are per real particle, not per macroparticle (except the weighting itself)
+        record.attrs['macroWeighted'] = np.uint32(name == 'weighting')
+        record.attrs['weightingPower'] = _weighting_powers[name]
+        return record
+
+    def _create_constant(self, component, value, unit_si):
+        component.attrs['value'] = value
+        component.attrs['shape'] = np.array([self.size], dtype=np.uint64)
+        component.attrs['unitSI'] = unit_si
+
+    def write(self, block, weights=None, ids=None):
+        """
+        Write the next block of particles.
+        :param block: (ndarray) (n, 6) array of x, ux, y, uy, ct, pt in Species conventions. The sign of pt is
+            taken as the sign of the longitudinal momentum.
+        :param weights: (ndarray) (n,) weighting. Required if the writer stores per-particle weights.
+        :param ids: (ndarray) (n,) particle IDs. Required if the writer allocated the 'id' record.
+        """
+        start, stop = self.rows_written, self.rows_written + block.shape[0]
+        staging = np.empty(block.shape[0])
+        for name, column in [('position/x', 0), ('position/y', 2), ('momentum/x', 1), ('momentum/y', 3)]:
+            staging[:] = block[:, column]
+            self._components[name].write_direct(staging, None, np.s_[start:stop])
+        # Time of flight is stored as longitudinal position: the head of the bunch (smaller ct) leads
+        np.negative(block[:, 4], out=staging)
+        self._components['position/z'].write_direct(staging, None, np.s_[start:stop])
+        np.subtract(block[:, 5]**2, block[:, 1]**2 + block[:, 3]**2, out=staging)
+        # Rounding can leave the transverse momentum slightly above the total
+        np.maximum(staging, 0., out=staging)
+        np.sqrt(staging, out=staging)
+        np.copysign(staging, block[:, 5], out=staging)
+        self._components['momentum/z'].write_direct(staging, None, np.s_[start:stop])
+        if 'weighting' in self._components:
+            self._components['weighting'][start:stop] = weights
+        if 'id' in self._components:
+            self._components['id'][start:stop] = ids
+        self.rows_written = stop
+
+    def close(self):
+        """Close the file. Raises ValueError if fewer rows than allocated were written."""
+        self.h5file.close()
+        check_rows_written(self.file_name, self.size, self.rows_written)
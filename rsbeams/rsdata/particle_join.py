@@ -0,0 +1,102 @@
+from collections import namedtuple
+import numpy as np
+from rsbeams.rsdata.SDDS import readSDDS
+
+# Result of matching one set of particle IDs against a reference:
+#   reference_index -- (M,) rows of the matched particles in the reference page
+#   index           -- (M,) rows of the same particles in the other page, so that
+#                      ids[index] == reference_ids[reference_index]
+#   survived        -- sorted IDs present in both pages
+#   lost            -- sorted reference IDs missing from the other page
+#   unmatched       -- sorted IDs in the other page that are not in the reference
+ParticleJoin = namedtuple('ParticleJoin', ['reference_index', 'index', 'survived', 'lost', 'unmatched'])
+
+
+class ParticleIndex:
+    """
+    Sorted index over the particle IDs of a reference page (e.g. the first watch point or the input beam).
+    The IDs are sorted once, after which any number of other pages can be joined against the reference in
+    O(M log N) with no Python-level set operations.
+
+    Usage:
+        index = ParticleIndex(start['particleID'])
+        match = index.join(end['particleID'])
+        dx = end['x'][match.index] - start['x'][match.reference_index]
+    """
+
+    def __init__(self, ids):
+        """
+        :param ids: (ndarray) (N,) unique integer particle IDs of the reference page.
+        """
+        self.ids = np.asarray(ids)
+        self._order = np.argsort(self.ids, kind='stable')
+        self._sorted = self.ids[self._order]
+        if np.any(self._sorted[1:] == self._sorted[:-1]):
+            raise ValueError("Reference particle IDs must be unique")
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def locate(self, ids):
+        """
+        Rows of `ids` in the reference page.
+        :param ids: (ndarray) (M,) particle IDs.
+        :return: (ndarray) (M,) reference rows, -1 where an ID is not in the reference.
+        """
+        ids = np.asarray(ids)
+        if len(self) == 0:
+            return np.full(ids.shape[0], -1, dtype=np.intp)
+        position = np.searchsorted(self._sorted, ids)
+        np.minimum(position, len(self) - 1, out=position)
+        found = self._sorted[position] == ids
+        return np.where(found, self._order[position], -1)
+
+    def join(self, ids):
+        """
+        Match particle IDs from another page against the reference.
+        :param ids: (ndarray) (M,) particle IDs of the other page.
+        :return: ParticleJoin, with index arrays ordered by position in the other page.
+        """
+        ids = np.asarray(ids)
+        reference_rows = self.locate(ids)
+        matched = reference_rows >= 0
+        index = np.flatnonzero(matched)
+        reference_index = reference_rows[index]
+
+        survived = np.zeros(len(self), dtype=bool)
+        survived[reference_index] = True
+        lost = np.sort(self.ids[~survived])
+        unmatched = np.sort(ids[~matched])
+
+        return ParticleJoin(reference_index, index, np.sort(self.ids[survived]), lost, unmatched)
+
+
+def iter_page_joins(reference, other, reference_page=0, pages=None, id_column='particleID'):
+    """
+    Join every page of an SDDS file against one reference page, reading the other file a page at a time.
+    :param reference: (str or readSDDS) File holding the reference page.
+    :param other: (str or readSDDS) File whose pages are joined against the reference, e.g. a multipage watch
+        point. May be the same file as `reference`.
+    :param reference_page: (int) Page of `reference` to index.
+    :param pages: Optional iterable of page numbers of `other` to join. Defaults to all pages.
+    :param id_column: (str) Name of the particle ID column.
+    :return: Generator of (page, columns, ParticleJoin) where `columns` is the structured column array of the page.
+    """
+    if not isinstance(reference, readSDDS):
+        reference = readSDDS(reference, buffer=False)
+    if not isinstance(other, readSDDS):
+        other = readSDDS(other, buffer=False)
+
+    index = None
+    for _, _, columns in reference.iter_pages(pages=[reference_page]):
+        if columns is not None:
+            index = ParticleIndex(columns[id_column])
+    if index is None:
+        raise ValueError("Page {} of the reference file has no particle data".format(reference_page))
+
+    for page, _, columns in other.iter_pages(pages=pages):
+        if columns is None:
+            # A page with no particles left has lost every reference particle
+            yield page, columns, index.join(np.empty(0, dtype=index.ids.dtype))
+        else:
+            yield page, columns, index.join(columns[id_column])
@@ -0,0 +1,66 @@
+import numpy as np
+
+# Helpers shared by the block-streaming particle file readers and writers
+
+
+def check_rows_written(file_name, size, rows_written):
+    """
+    Writers declare their particle count before any data is written (in a header, or by preallocating datasets),
+    so a file finished with a different number of rows is inconsistent.
+    :param file_name: (str) Name of the file written.
+    :param size: (int) Number of particles declared.
+    :param rows_written: (int) Number of rows actually written.
+    :raises ValueError: If the counts differ.
+    """
+    if rows_written != size:
+        raise ValueError('{} declares {} particles but {} rows were written'.format(file_name, size, rows_written))
+
+
+def write_columns(datasets, block, start):
+    """
+    Write a block of particles into one-dimensional per-coordinate datasets, e.g. HDF5 hyperslabs.
+    :param datasets: (list) h5py datasets, one per column of `block`.
+    :param block: (ndarray) (n, len(datasets)) array of particles.
+    :param start: (int) Row of the datasets the block starts at.
+    :return: (int) Row after the last one written.
+    """
+    stop = start + block.shape[0]
+    # HDF5 is very slow to gather from strided memory, so write from a transposed copy of the block
+    columns = np.ascontiguousarray(block.T)
+    for i, dataset in enumerate(datasets):
+        dataset.write_direct(columns[i], None, np.s_[start:stop])
+
+    return stop
+
+
+def read_columns(datasets, block, start, stop, staging):
+    """
+    Read rows `start` to `stop` of one-dimensional per-coordinate datasets into the first rows of `block`.
+    :param datasets: (list) h5py datasets, one per column of `block`.
+    :param block: (ndarray) (n, len(datasets)) array to fill, with n >= stop - start.
+    :param start: (int) First row to read.
+    :param stop: (int) Row after the last one to read.
+    :param staging: (ndarray) (len(datasets), m) scratch array, with m >= stop - start.
+    """
+    # HDF5 is very slow to scatter into strided memory, so each coordinate is read into a contiguous
+    #  staging row and the rows are transposed into the block in one copy
+    rows = stop - start
+    for i, dataset in enumerate(datasets):
+        dataset.read_direct(staging[i], np.s_[start:stop], np.s_[0:rows])
+    block[:rows] = staging[:, :rows].T
+
+
+def iter_columns(datasets, chunk_rows):
+    """
+    Iterate over one-dimensional per-coordinate datasets in row blocks.
+    :param datasets: (list) h5py datasets of equal length.
+    :param chunk_rows: (int) Rows per block.
+    :return: Generator of new (n, len(datasets)) ndarrays
+    """
+    size = datasets[0].shape[0]
+    staging = np.empty((len(datasets), min(chunk_rows, size)))
+    for start in range(0, size, chunk_rows):
+        stop = min(start + chunk_rows, size)
+        block = np.empty((stop - start, len(datasets)))
+        read_columns(datasets, block, start, stop, staging)
+        yield block
@@ -1,14 +1,271 @@
 # Import the relevant data formats
 
-import pandas as pd
+import warnings
 import numpy as np
 import h5py as h5
 from scipy import constants
 from rsbeams.rsptcls.species import Species
 from subprocess import Popen, PIPE
+from itertools import islice
 from rsbeams.rsdata.SDDS import writeSDDS
+from rsbeams.rsdata.opal import OpalReader, OpalWriter
+from rsbeams.rsdata.genesis import GenesisDistributionReader, GenesisDistributionWriter, Genesis4Reader, \
+    Genesis4Writer, default_chunk_rows
+from rsbeams.rsdata.openpmd import OpenPMDReader, OpenPMDWriter
 
-supported_codes = ['genesis', 'elegant', 'opal']
+supported_codes = ['genesis', 'elegant', 'opal', 'openpmd']
+
+
+class ParticleStream:
+    """
+    Block-wise source of particle data as Species, used for out-of-core conversion.
+    Holds the metadata writers need before any data is written and may be iterated more than once.
+    """
+
+    def __init__(self, size, total_charge, iter_blocks, charge=-1, mass=0.511e6, close=None, weights=False,
+                 ids=False):
+        """
+        :param size: (int) Total number of particles.
+        :param total_charge: (float) Total bunch charge in C.
+        :param iter_blocks: Callable returning a generator of Species blocks.
+        :param charge: (float) Particle charge in units of e.
+        :param mass: (float) Particle mass in eV/c^2.
+        :param close: Optional callable releasing the underlying file.
+        :param weights: (bool) Blocks carry per-particle weights.
+        :param ids: (bool) Blocks carry particle IDs.
+        """
+        self.size = size
+        self.total_charge = total_charge
+        self.charge = charge
+        self.mass = mass
+        self.weights = weights
+        self.ids = ids
+        self._iter_blocks = iter_blocks
+        self._close = close
+
+    def __iter__(self):
+        return self._iter_blocks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._close:
+            self._close()
+
+    def average_ct(self):
+        """Average of ct over all particles, computed in one pass over the blocks."""
+        total = 0.
+        for block in self:
+            total += np.sum(block.ct)
+        return total / self.size
+
+
+def _weights_dropped(file_name, code):
+    warnings.warn('{} files do not support per-particle weights, {} is written with uniform weights'.format(
+        code, file_name))
+
+
+def _has_varying_weights(weights):
+    return weights is not None and np.ptp(weights) > 0.
+
+
+def _check_weights(file_name, code):
+    # Streams only see their weights a block at a time: the returned callable is given every block written and
+    # warns once, as soon as the weights seen so far are not all equal
+    seen = {'first': None, 'warned': False}
+
+    def check(species):
+        if seen['warned'] or species.weights is None or len(species) == 0:
+            return
+        if seen['first'] is None:
+            seen['first'] = species.weights[0]
+        if _has_varying_weights(species.weights) or species.weights[0] != seen['first']:
+            seen['warned'] = True
+            _weights_dropped(file_name, code)
+
+    return check
+
+
+def _elegant_columns(file_name):
+    get_columns = Popen('sddsquery -columnList {file}'.format(file=file_name), stdout=PIPE, stderr=PIPE, shell=True)
+    columns, err = get_columns.communicate()
+    if err:
+        raise IOError(err)
+    return columns.decode().split()
+
+
+def _stream_elegant(file_name, chunk_rows):
+    # Rows are piped from sdds2stream and parsed a block at a time
+    get_rows = Popen('sdds2stream -rows=bare,total {file}'.format(file=file_name), stdout=PIPE, stderr=PIPE, shell=True)
+    row_data, err = get_rows.communicate()
+    if err:
+        raise IOError(err)
+    get_charge_data = Popen('sdds2stream -par=Charge {file}'.format(file=file_name), stdout=PIPE, stderr=PIPE,
+                            shell=True)
+    charge_data, err = get_charge_data.communicate()
+    if err:
+        raise IOError(err)
+    charge_data = np.fromstring(charge_data, dtype=float, count=1, sep=' \n')[0]
+    columns = ['x', 'xp', 'y', 'yp', 't', 'p']
+    has_ids = 'particleID' in _elegant_columns(file_name)
+    if has_ids:
+        columns.append('particleID')
+
+    def iter_blocks():
+        get_particle_data = Popen('sdds2stream -col={cols} {file}'.format(cols=','.join(columns), file=file_name),
+                                  stdout=PIPE, shell=True)
+        while True:
+            lines = list(islice(get_particle_data.stdout, chunk_rows))
+            if not lines:
+                break
+            block = np.fromstring(b''.join(lines).decode(), dtype=float, sep=' ').reshape(-1, len(columns))
+            species = Species(block[:, :6], charge=-1, mass=0.511e6,
+                              ids=block[:, 6] if has_ids else None)
+            species.convert_from_elegant()
+            yield species
+        get_particle_data.communicate()
+
+    return ParticleStream(int(row_data.split()[0]), charge_data, iter_blocks, ids=has_ids)
+
+
+def _opal_extras(reader, step_number, start, stop):
+    # Per-particle charges in C become weights (physical electrons per macroparticle)
+    datasets = reader.datasets(step_number)
+    weights, ids = None, None
+    if 'q' in datasets:
+        weights = np.abs(reader.read_dataset('q', step_number, start, stop)) / constants.e
+    if 'id' in datasets:
+        ids = reader.read_dataset('id', step_number, start, stop)
+    return weights, ids
+
+
+def _stream_opal(file_name, chunk_rows, step_number=None):
+    reader = OpalReader(file_name)
+    datasets = reader.datasets(step_number)
+
+    def iter_blocks():
+        start = 0
+        for block in reader.iter_chunks(step_number, chunk_rows=chunk_rows):
+            stop = start + block.shape[0]
+            weights, ids = _opal_extras(reader, step_number, start, stop)
+            yield Species(block, charge=-1, mass=0.511e6, weights=weights, ids=ids)
+            start = stop
+
+    return ParticleStream(reader.particle_count(step_number), reader.total_charge(step_number), iter_blocks,
+                          close=reader.close, weights='q' in datasets, ids='id' in datasets)
+
+
+def _stream_genesis(file_name, chunk_rows):
+    if h5.is_hdf5(file_name):
+        reader = Genesis4Reader(file_name)
+    else:
+        reader = GenesisDistributionReader(file_name)
+
+    def iter_blocks():
+        for block in reader.iter_chunks(chunk_rows):
+            species = Species(block, charge=-1, mass=0.511e6)
+            species.convert_from_genesis()
+            yield species
+
+    size = reader.particle_count()
+    if size is None:
+        size = sum([block.shape[0] for block in reader.iter_chunks(chunk_rows)])
+
+    return ParticleStream(size, reader.total_charge(), iter_blocks, close=reader.close)
+
+
+def _openpmd_extras(reader, records, iteration, particle_species, start, stop):
+    weights, ids = None, None
+    if 'weighting' in records:
+        weights = reader.read_record('weighting', iteration, particle_species, start, stop)
+    if 'id' in records:
+        ids = reader.read_record('id', iteration, particle_species, start, stop)
+    return weights, ids
+
+
+def _stream_openpmd(file_name, chunk_rows, iteration=None, particle_species=None):
+    reader = OpenPMDReader(file_name)
+    records = reader.scalar_records(iteration, particle_species)
+    charge = reader.charge(iteration, particle_species)
+    mass = reader.mass(iteration, particle_species)
+
+    def iter_blocks():
+        start = 0
+        for block in reader.iter_chunks(iteration, particle_species, chunk_rows=chunk_rows):
+            stop = start + block.shape[0]
+            weights, ids = _openpmd_extras(reader, records, iteration, particle_species, start, stop)
+            yield Species(block, charge=charge, mass=mass, weights=weights, ids=ids)
+            start = stop
+
+    return ParticleStream(reader.particle_count(iteration, particle_species),
+                          reader.total_charge(iteration, particle_species), iter_blocks, charge=charge, mass=mass,
+                          close=reader.close, weights='weighting' in records, ids='id' in records)
+
+
+def _sink_elegant(file_name, stream, buffer):
+    check_weights = _check_weights(file_name, 'elegant')
+    file_out = writeSDDS()
+    file_out.create_parameter('Charge', stream.total_charge, 'double', parUnits='C')
+    for name, units in [('x', 'm'), ('xp', ''), ('y', 'm'), ('yp', ''), ('t', 's'), ('p', 'm$be$nc')]:
+        file_out.create_column(name, None, 'double', colUnits=units)
+    if stream.ids:
+        # Binary pages are written as one homogeneous block, so IDs are stored as (exact) doubles
+        file_out.create_column('particleID', None, 'double')
+        buffer = np.empty((buffer.shape[0], 7))
+    file_out.open_stream(file_name, stream.size, dataMode='binary')
+
+    def write(species):
+        check_weights(species)
+        rows = buffer[:len(species)]
+        species.to_elegant(out=rows[:, :6])
+        if stream.ids:
+            rows[:, 6] = species.ids
+        file_out.write_rows(rows)
+
+    return write, file_out.close_stream
+
+
+def _sink_genesis(file_name, stream, buffer, writer_class=GenesisDistributionWriter, **kwargs):
+    check_weights = _check_weights(file_name, 'Genesis')
+    # T is written relative to the average arrival time, which takes an extra pass over the input
+    t_offset = stream.average_ct() / constants.c
+    writer = writer_class(file_name, stream.size, stream.total_charge, **kwargs)
+
+    def write(species):
+        check_weights(species)
+        writer.write(species.to_genesis(out=buffer[:len(species)], t_offset=t_offset))
+
+    return write, writer.close
+
+
+def _sink_genesis4(file_name, stream, buffer, **kwargs):
+    return _sink_genesis(file_name, stream, buffer, writer_class=Genesis4Writer, **kwargs)
+
+
+def _sink_opal(file_name, stream, buffer, **kwargs):
+    writer = OpalWriter(file_name, stream.size, stream.total_charge, charges=stream.weights, ids=stream.ids,
+                        **kwargs)
+
+    def write(species):
+        charges = species.macroparticle_charges() if stream.weights else None
+        writer.write(species.coordinates, charges=charges, ids=species.ids)
+
+    return write, writer.close
+
+
+def _sink_openpmd(file_name, stream, buffer, **kwargs):
+    writer = OpenPMDWriter(file_name, stream.size, stream.total_charge, mass=stream.mass, charge=stream.charge,
+                           weights=stream.weights, ids=stream.ids, **kwargs)
+
+    return lambda species: writer.write(species.coordinates, weights=species.weights, ids=species.ids), \
+        writer.close
+
+
+_stream_readers = {'elegant': _stream_elegant, 'opal': _stream_opal, 'genesis': _stream_genesis,
+                   'openpmd': _stream_openpmd}
+_stream_writers = {'elegant': _sink_elegant, 'genesis': _sink_genesis, 'genesis4': _sink_genesis4,
+                   'opal': _sink_opal, 'openpmd': _sink_openpmd}
 
 
 class Switchyard:
@@ -29,8 +286,10 @@ class Switchyard:
         self.species = {}
         assert input_format in self.supported_codes, "{} is not supported".format(input_format)
         self.input_format = input_format
-        self._readers = {'elegant': self.read_elegant, 'opal': self.read_opal}
-        self._writers = {'elegant': self.write_elegant, 'genesis': self.write_genesis}
+        self._readers = {'elegant': self.read_elegant, 'opal': self.read_opal, 'genesis': self.read_genesis,
+                         'openpmd': self.read_openpmd}
+        self._writers = {'elegant': self.write_elegant, 'genesis': self.write_genesis,
+                         'genesis4': self.write_genesis4, 'opal': self.write_opal, 'openpmd': self.write_openpmd}
 
         self._get_reader()(file_name=input_file)
     
@@ -45,6 +304,12 @@ class Switchyard:
         
         return self.supported_codes
 
+    def _get_species_name(self, species_name):
+        # Default names are numbered in the order species are read
+        if species_name == 'Species':
+            return species_name+'_'+str(len(self.species.keys()))
+        return species_name
+
     def _get_reader(self, file_format=None):
         if not file_format:
             file_format = self.input_format
@@ -62,8 +327,13 @@ class Switchyard:
         # y' -- vertical angle, rad
         # t  -- time of flight, sec
         # p  -- longitudinal momentum, mc
+        # particleID is read too when the file has it
 
-        read_particle_data = 'sdds2stream -col=x,xp,y,yp,t,p {file}'.format(file=file_name)
+        columns = ['x', 'xp', 'y', 'yp', 't', 'p']
+        has_ids = 'particleID' in _elegant_columns(file_name)
+        if has_ids:
+            columns.append('particleID')
+        read_particle_data = 'sdds2stream -col={cols} {file}'.format(cols=','.join(columns), file=file_name)
         read_charge = 'sdds2stream -par=Charge {file}'.format(file=file_name)
         get_particle_data = Popen(read_particle_data, stdout=PIPE, stderr=PIPE, shell=True)
         get_charge_data = Popen(read_charge, stdout=PIPE, stderr=PIPE, shell=True)
@@ -71,18 +341,16 @@ class Switchyard:
         if err:
             return err
         else:
-            particle_data = np.fromstring(particle_data, dtype=float, count=-1, sep=' \n').reshape(-1, 6)
+            particle_data = np.fromstring(particle_data, dtype=float, count=-1, sep=' \n').reshape(-1, len(columns))
         charge_data, err = get_charge_data.communicate()
         if err:
             return err
         else:
             charge_data = np.fromstring(charge_data, dtype=float, count=1, sep=' \n')[0]
             
-        if species_name == 'Species':
-            spec_name = species_name+'_'+str(len(self.species.keys()))
-        else:
-            spec_name = species_name
-        self.species[spec_name] = Species(particle_data, charge=-1, mass=0.511e6, total_charge=charge_data)
+        spec_name = self._get_species_name(species_name)
+        self.species[spec_name] = Species(particle_data[:, :6], charge=-1, mass=0.511e6, total_charge=charge_data,
+                                          ids=particle_data[:, 6] if has_ids else None)
         self.species[spec_name].convert_from_elegant()
 
         return 0
@@ -90,6 +358,7 @@ class Switchyard:
     def read_opal(self, file_name, step_number=None, species_name = 'Species'):
         """Read in a file from OPAL output.
         :file_name: name of file to read from
+        :step_number: step to read, defaults to the last step in the file
         """
         
         # opal coordinates are as follows:
@@ -99,34 +368,26 @@ class Switchyard:
         # yp -- vertical momentum, beta*gamma
         # z  -- Position relative to ? (some sort of reference), m
         # p  -- total momentum, beta*gamma
+        # q  -- macroparticle charge, C (read as weights)
+        # id -- particle ID
         # TODO: We really need to be able to pull from screens too but we'll settle for standard distribution output for now
-        # TODO: We don't currently handle particle specific weight/charge in Species
-        
-        with h5.File(file_name, 'r') as pcdata:
-            if not step_number:
-                step_number = len(pcdata) - 1
-            loc = 'Step#{}'.format(step_number)
-            mp_count = pcdata[loc+'/z'].shape[0]
-            particle_data = np.empty((mp_count, 6))
-            for i, coord in enumerate(['x', 'px', 'y', 'py', 'z', 'pz']):
-                print(loc+'/'+coord)
-                particle_data[:, i] = pcdata[loc+'/'+coord]
-            total_charge = pcdata[loc].attrs['CHARGE']
-        
-        # TODO: This needs to be a function --- it is used many times
-        #  probably just make a species instantiation function
-        if species_name == 'Species':
-            spec_name = species_name+'_'+str(len(self.species.keys()))
-        else:
-            spec_name = species_name
+        
+        with OpalReader(file_name) as reader:
+            particle_data = reader.read_step(step_number)
+            total_charge = reader.total_charge(step_number)
+            weights, ids = _opal_extras(reader, step_number, 0, None)
+        
+        spec_name = self._get_species_name(species_name)
 
         # TODO: This shouldn't be specific to electrons
-        self.species[spec_name] = Species(particle_data, charge=-1, mass=0.511e6, total_charge=total_charge)
+        self.species[spec_name] = Species(particle_data, charge=-1, mass=0.511e6, total_charge=total_charge,
+                                          weights=weights, ids=ids)
         
         return 0
 
-    def read_genesis(self, file_name):
+    def read_genesis(self, file_name, species_name='Species'):
         """Read in a file from genesis output.
+        Genesis 1.3 ASCII distribution files and Genesis 4 HDF5 distribution or particle dump files are supported.
         :file_name: name of file to read from
         """
         
@@ -138,7 +399,47 @@ class Switchyard:
         # th -- theta, the ponderomotive phase at fixed z
         # t  -- time of arrival at fixed z, sec
         # gamma -- particle gamma
-
+        # the readers convert theta, gamma and the alternate ASCII columns to x, px, y, py, t, p
+        
+        if h5.is_hdf5(file_name):
+            reader = Genesis4Reader(file_name)
+        else:
+            reader = GenesisDistributionReader(file_name)
+        with reader:
+            particle_data = reader.read()
+            total_charge = reader.total_charge()
+        
+        spec_name = self._get_species_name(species_name)
+        self.species[spec_name] = Species(particle_data, charge=-1, mass=0.511e6, total_charge=total_charge)
+        self.species[spec_name].convert_from_genesis()
+        
+        return 0
+    
+    def read_openpmd(self, file_name, iteration=None, particle_species=None, species_name='Species'):
+        """Read in particle data from an openPMD file.
+        :file_name: name of file to read from
+        :iteration: iteration to read, defaults to the last iteration in the file
+        :particle_species: name of the openPMD particle species, defaults to the first species in the iteration
+        """
+        
+        # openPMD records are converted to Species conventions by the reader:
+        # position x, y       -- m
+        # position z          -- m, stored as ct = -z
+        # momentum x, y, z    -- converted to beta gamma using the species mass; pt is the total momentum
+        # weighting, id       -- read when stored per particle
+        
+        with OpenPMDReader(file_name) as reader:
+            particle_data = reader.read(iteration, particle_species)
+            charge = reader.charge(iteration, particle_species)
+            mass = reader.mass(iteration, particle_species)
+            total_charge = reader.total_charge(iteration, particle_species)
+            records = reader.scalar_records(iteration, particle_species)
+            weights, ids = _openpmd_extras(reader, records, iteration, particle_species, 0, None)
+        
+        spec_name = self._get_species_name(species_name)
+        self.species[spec_name] = Species(particle_data, charge=charge, mass=mass, total_charge=total_charge,
+                                          weights=weights, ids=ids)
+        
         return 0
     
     def write_elegant(self, file_name, species_name):
@@ -146,13 +447,13 @@ class Switchyard:
         :file_name: name of file to write to
         """
         
-        # TODO Split out conversion function so we have converters and writers
-        x = self.species[species_name].x
-        y = self.species[species_name].y
-        xp = self.species[species_name].ux / self.species[species_name].pt
-        yp = self.species[species_name].uy / self.species[species_name].pt
-        t = self.species[species_name].ct / constants.c
-        p = self.species[species_name].pt
+        species = self.species[species_name]
+        if _has_varying_weights(species.weights):
+            _weights_dropped(file_name, 'elegant')
+        # All columns are views of the one converted array, which writeSDDS serializes without restacking
+        particle_data = np.empty((len(species), 6 if species.ids is None else 7))
+        species.to_elegant(out=particle_data[:, :6])
+        x, xp, y, yp, t, p = particle_data.T[:6]
         
         file_out = writeSDDS()
         file_out.create_parameter('Charge', self.species[species_name].total_charge, 'double', parUnits='C')
@@ -162,20 +463,59 @@ class Switchyard:
         file_out.create_column('yp', yp, 'double', colUnits='')
         file_out.create_column('t', t, 'double', colUnits='s')
         file_out.create_column('p', p, 'double', colUnits='m$be$nc')
+        if species.ids is not None:
+            # Binary pages are written as one homogeneous block, so IDs are stored as (exact) doubles
+            particle_data[:, 6] = species.ids
+            file_out.create_column('particleID', particle_data.T[6], 'double')
         file_out.save_sdds(file_name, dataMode='binary')
         
         return 0
 
-    def write_opal(self, file_name):
+    def write_opal(self, file_name, species_name, chunk_rows=2**16, compression=None, compression_opts=None):
         """Write a file to OPAL-readable format.
         :file_name: name of file to write to
+        :chunk_rows: HDF5 chunk length, also the number of particles written at a time
+        :compression: optional HDF5 compression filter ('gzip', 'lzf')
+        :compression_opts: options for the compression filter
         """
         
+        # Species coordinates are stored in the same order and units read_opal uses
+        species = self.species[species_name]
+        has_weights = species.weights is not None
+        with OpalWriter(file_name, len(species), species.total_charge, chunk_rows=chunk_rows,
+                        compression=compression, compression_opts=compression_opts, charges=has_weights,
+                        ids=species.ids is not None) as writer:
+            for block in species.iter_blocks(chunk_rows):
+                writer.write(block.coordinates, charges=block.macroparticle_charges() if has_weights else None,
+                             ids=block.ids)
+        
         return 0
 
-    def write_genesis(self, file_name, species_name, version='2.0'):
+    def write_openpmd(self, file_name, species_name, particle_species='electrons', iteration=0,
+                      chunk_rows=default_chunk_rows, compression=None, compression_opts=None):
+        """Write particle data to an openPMD file.
+        :file_name: name of file to write to
+        :particle_species: name given to the openPMD particle species
+        :iteration: iteration the data is written under
+        :chunk_rows: HDF5 chunk length, also the number of particles written at a time
+        :compression: optional HDF5 compression filter ('gzip', 'lzf')
+        :compression_opts: options for the compression filter
+        """
+        
+        species = self.species[species_name]
+        with OpenPMDWriter(file_name, len(species), species.total_charge, mass=species.mass, charge=species.charge,
+                           iteration=iteration, species=particle_species, chunk_rows=chunk_rows,
+                           compression=compression, compression_opts=compression_opts,
+                           weights=species.weights is not None, ids=species.ids is not None) as writer:
+            for block in species.iter_blocks(chunk_rows):
+                writer.write(block.coordinates, weights=block.weights, ids=block.ids)
+        
+        return 0
+
+    def write_genesis(self, file_name, species_name, version='2.0', chunk_rows=default_chunk_rows):
         """Write a file to genesis-readable format.
         :file_name: name of file to write to
+        :chunk_rows: number of particles converted and formatted at a time
         """
         
         # Genesis reads in external files as ASCII with the column format (per documentation):
@@ -191,33 +531,63 @@ class Switchyard:
         # ? COLUMNS X PX Y PY T P
         # and the first line of data has to be the number of input particles
         
-        X  = self.species[species_name].x
-        PX = self.species[species_name].ux
-        Y  = self.species[species_name].y
-        PY = self.species[species_name].uy
-        T  = self.species[species_name].ct / constants.c
-        T = T - np.average(T)
-        P  = self.species[species_name].pt
-        
-        vers_str = '? VERSION = '+version
-        charge_str = '? CHARGE = '+str(self.species[species_name].total_charge)
-        size_str = '? SIZE = '+str(len(X))
-        clmns_str = '? COLUMNS X PX Y PY T P'
-        
-        f = open(file_name, 'w')
-        f.write(vers_str+'\n')
-        f.write(charge_str+'\n')
-        f.write(size_str+'\n')
-        f.write(clmns_str+'\n')
-        
-        f.close()
+        species = self.species[species_name]
+        with GenesisDistributionWriter(file_name, len(species), species.total_charge, version=version) as writer:
+            self._write_genesis_blocks(writer, species, chunk_rows)
+                
+        return 0
+
+    def write_genesis4(self, file_name, species_name, chunk_rows=default_chunk_rows):
+        """Write a Genesis 4 HDF5 particle distribution.
+        :file_name: name of file to write to
+        :chunk_rows: number of particles converted and written at a time
+        """
         
-        df = pd.DataFrame([X, PX, Y, PY, T, P]).T
+        species = self.species[species_name]
+        with Genesis4Writer(file_name, len(species), species.total_charge, chunk_rows=chunk_rows) as writer:
+            self._write_genesis_blocks(writer, species, chunk_rows)
         
-        df.to_csv(file_name, mode='a', sep=' ', header=None, index=None)
-                
         return 0
 
+    def _write_genesis_blocks(self, writer, species, chunk_rows):
+        if _has_varying_weights(species.weights):
+            _weights_dropped(writer.file_name, 'Genesis')
+        # Convert through one reusable block-sized buffer so no full-size temporary is made
+        t_offset = np.average(species.ct) / constants.c
+        buffer = np.empty((min(chunk_rows, len(species)), 6))
+        for block in species.iter_blocks(chunk_rows):
+            writer.write(block.to_genesis(out=buffer[:len(block)], t_offset=t_offset))
+
+    @staticmethod
+    def convert(input_file, input_format, output_file, output_format, chunk_rows=default_chunk_rows,
+                reader_options=None, writer_options=None):
+        """
+        Convert a particle file from one code format to another without loading it into memory.
+        Row blocks are streamed from the reader through the unit transforms into the writer, so peak memory is
+        set by `chunk_rows` rather than by the number of particles.
+        :param input_file: (str) Name of the file to read.
+        :param input_format: (str) Code format of the input file. One of `supported_codes`.
+        :param output_file: (str) Name of the file to write.
+        :param output_format: (str) Code format to write, e.g. 'elegant', 'genesis', 'genesis4', 'opal', 'openpmd'.
+        :param chunk_rows: (int) Number of particles held in memory at a time.
+        :param reader_options: (dict) Additional options for the reader, e.g. {'step_number': 3} for OPAL.
+        :param writer_options: (dict) Additional options for the writer, e.g. {'compression': 'gzip'} for OPAL.
+        :return: output_file
+        """
+        assert input_format in supported_codes, "{} is not supported".format(input_format)
+        assert output_format in _stream_writers, "{} is not supported".format(output_format)
+
+        with _stream_readers[input_format](input_file, chunk_rows, **(reader_options or {})) as stream:
+            buffer = np.empty((min(chunk_rows, stream.size), 6))
+            write, close = _stream_writers[output_format](output_file, stream, buffer, **(writer_options or {}))
+            try:
+                for species in stream:
+                    write(species)
+            finally:
+                close()
+
+        return output_file
+
     def write(self, filename, code, species_name='Species_0', **kwargs):
         """
         Write output file.
@@ -0,0 +1,77 @@
+import numpy as np
+from rsbeams.rsdata.SDDS import readSDDS
+from rsbeams.rsstats import stats6d
+
+# Phase space coordinates taken from each page: elegant columns, with p replaced by the relative momentum deviation
+history_coordinates = ['x', 'xp', 'y', 'yp', 't', 'delta']
+history_planes = ['x', 'y', 'z']
+
+
+def _history_dtype():
+    fields = [('page', np.int64), ('Pass', np.int64), ('s', np.float64), ('Particles', np.int64),
+              ('pCentral', np.float64), ('p_avg', np.float64)]
+    for coord in history_coordinates:
+        fields += [(coord + '_avg', np.float64), (coord + '_rms', np.float64)]
+    for plane in history_planes:
+        fields += [('emit_' + plane, np.float64), ('beta_' + plane, np.float64), ('alpha_' + plane, np.float64)]
+
+    return np.dtype(fields)
+
+
+def _page_array6d(columns):
+    # (6, N) array in the layout used by stats6d
+    array6D = np.empty((6, columns.shape[0]))
+    for i, name in enumerate(['x', 'xp', 'y', 'yp', 't', 'p']):
+        array6D[i] = columns[name]
+    p_avg = np.average(array6D[5])
+    array6D[5] -= p_avg
+    array6D[5] /= p_avg
+
+    return array6D, p_avg
+
+
+def moment_history(file_name, pages=None):
+    """
+    Table of beam moments for every page of an elegant multipage particle file (a watch point in coordinate mode,
+    or an &run output/final distribution). Pages are read and reduced one at a time, so only a single page of
+    particles is ever in memory.
+
+    Moments are computed with the rsstats.stats6d definitions (population averages and correlations) on
+    x, xp, y, yp, t and delta = (p - <p>) / <p>. Emittances and Twiss parameters are the RMS values from the 2x2
+    blocks of the correlation matrix, so emit_x is in m-rad and emit_z in s.
+
+    :param file_name: (str) Name of the SDDS file to read.
+    :param pages: Optional iterable of page numbers to read, indexed to 0. Defaults to all pages.
+    :return: (ndarray) Structured array with one row per page. Fields are page, Pass, s, Particles, pCentral,
+        p_avg, <coord>_avg and <coord>_rms for each coordinate, and emit_<plane>, beta_<plane>, alpha_<plane> for
+        planes x, y and z. Pass and s come from the page parameters and are -1 and nan if the file has none.
+    """
+    reader = readSDDS(file_name, buffer=False)
+    rows = []
+    for page, parameters, columns in reader.iter_pages(pages=pages):
+        row = np.zeros(1, dtype=_history_dtype())[0]
+        for name in row.dtype.names[4:]:
+            row[name] = np.nan
+        row['page'] = page
+        row['Pass'] = -1
+        row['s'] = np.nan
+        if parameters is not None:
+            for name in ['Pass', 's', 'pCentral']:
+                if name in parameters.dtype.names:
+                    row[name] = parameters[name]
+        if columns is not None and columns.shape[0] > 0:
+            array6D, row['p_avg'] = _page_array6d(columns)
+            avg6d = stats6d.calc_avg6d(array6D)
+            sigma6D = stats6d.calc_correlations6d(array6D)
+            rms6d = np.sqrt(np.diag(sigma6D))
+            for i, coord in enumerate(history_coordinates):
+                row[coord + '_avg'] = avg6d[i]
+                row[coord + '_rms'] = rms6d[i]
+            for i, (alpha, beta, emit) in enumerate(zip(*stats6d.calc_twiss_params6d(sigma6D))):
+                row['emit_' + history_planes[i]] = emit
+                row['beta_' + history_planes[i]] = beta
+                row['alpha_' + history_planes[i]] = alpha
+            row['Particles'] = columns.shape[0]
+        rows.append(row)
+
+    return np.array(rows, dtype=_history_dtype())
@@ -12,10 +12,14 @@ Subsequent mods are due to RadiaSoft,
 from __future__ import absolute_import, division, print_function, unicode_literals
 import math
 import numpy
+from scipy import special
 from rsbeams.rsptcls import RsTwiss2D
 from rsbeams.rsptcls import RsPhaseSpace6D
 from rsbeams.rsstats import stats6d
 
+# Upper bound on the number of random points drawn at once during rejection sampling
+max_batch_size = 2**20
+
 class RsDistrib6D:
     """Generate a Gaussian or uniformly-filled 6D distribution."""
 
@@ -61,45 +65,43 @@ class RsDistrib6D:
     def make_unif_distrib(self):
         array6d = self.phase_space_6d.get_array_6d()
         num_ptcls = self.phase_space_6d.get_num_ptcls()
-        num_inside_circle = 0
-        while (num_inside_circle < num_ptcls):
-            test_x = 2. * numpy.random.uniform(0.0,1.0,1) - 1.
-            test_y = 2. * numpy.random.uniform(0.0,1.0,1) - 1.
-            test_z = 2. * numpy.random.uniform(0.0,1.0,1) - 1.
-            test_sum = test_x**2 + test_y**2 + test_z**2
-
-            if (test_sum < 1.):
-                array6d[0, num_inside_circle] = test_x
-                array6d[2, num_inside_circle] = test_y
-                array6d[4, num_inside_circle] = test_z
-                num_inside_circle += 1
-
-        num_inside_circle = 0
-        while (num_inside_circle < num_ptcls):
-            test_px = 2. * numpy.random.uniform(0.0,1.0,1) - 1.
-            test_py = 2. * numpy.random.uniform(0.0,1.0,1) - 1.
-            test_pz = 2. * numpy.random.uniform(0.0,1.0,1) - 1.
-            test_sum = test_px**2 + test_py**2 + test_pz**2
-
-            if (test_sum < 1.):
-                array6d[1, num_inside_circle] = test_px
-                array6d[3, num_inside_circle] = test_py
-                array6d[5, num_inside_circle] = test_pz
-                num_inside_circle += 1
+
+        # Positions (x, y, z) and momenta (px, py, pz) are each uniform inside the unit sphere.
+        #  Points are sampled directly, as an isotropic direction times a radius distributed as u**(1/3),
+        #  and written into the strided views of array6d one batch at a time.
+        for offset in range(2):
+            for n_start in range(0, num_ptcls, max_batch_size):
+                n_stop = min(n_start + max_batch_size, num_ptcls)
+                points = array6d[offset::2, n_start:n_stop]
+                points[:, :] = numpy.random.normal(0.0, 1.0, points.shape)
+                radius = numpy.cbrt(numpy.random.uniform(0.0, 1.0, n_stop - n_start))
+                radius /= numpy.sqrt(numpy.sum(points*points, axis=0))
+                points *= radius
 
         return
 
     def make_gauss_distrib(self):
         array6d = self.phase_space_6d.get_array_6d()
         num_ptcls = self.phase_space_6d.get_num_ptcls()
+
+        # Points are drawn in batches, oversampled by the expected acceptance of test_point**2 < max_rms_fac.
+        #  For tight cuts the truncated Gaussian is instead sampled exactly by inverting its CDF.
+        accept_frac = math.erf(math.sqrt(0.5 * self.max_rms_fac))
         for nLoop in range(6):
             num_inside_circle = 0
             while (num_inside_circle < num_ptcls):
-                test_point = numpy.random.normal(0.0, 1.0, 1)
-
-                if (test_point*test_point < self.max_rms_fac):
-                    array6d[nLoop, num_inside_circle] = test_point
-                    num_inside_circle += 1
+                num_needed = num_ptcls - num_inside_circle
+                if accept_frac < 0.5:
+                    num_draws = min(num_needed + 16, max_batch_size)
+                    test_points = math.sqrt(2.) * special.erfinv(
+                        numpy.random.uniform(-accept_frac, accept_frac, num_draws))
+                else:
+                    num_draws = min(int(1.1 * num_needed / accept_frac) + 16, max_batch_size)
+                    test_points = numpy.random.normal(0.0, 1.0, num_draws)
+                test_points = test_points[test_points*test_points < self.max_rms_fac][:num_needed]
+
+                array6d[nLoop, num_inside_circle:num_inside_circle+test_points.size] = test_points
+                num_inside_circle += test_points.size
         return
 
     def clean_phase_space_6d(self):
@@ -109,20 +111,22 @@ class RsDistrib6D:
         stats6d.normalize_rms6d(self.phase_space_6d.get_array_6d())
         return
 
-    def calc_averages_6d(self):
-        averages = stats6d.calc_avg6d(self.phase_space_6d.get_array_6d())
+    def calc_averages_6d(self, weights=None):
+        averages = stats6d.calc_avg6d(self.phase_space_6d.get_array_6d(), weights)
         return averages
 
-    def calc_rms_values_6d(self):
-        rmsValues = stats6d.calc_rms6d(self.phase_space_6d.get_array_6d())
+    def calc_rms_values_6d(self, weights=None):
+        rmsValues = stats6d.calc_rms6d(self.phase_space_6d.get_array_6d(), weights)
         return rmsValues
 
-    def calc_twiss6d(self,twiss6d):
+    def calc_twiss6d(self,twiss6d, weights=None):
+        """Fill twiss6d with the RMS Twiss parameters of the distribution, optionally with
+        per-particle weights (see stats6d)."""
         alpha_rms = numpy.zeros(3)
         beta_rms  = numpy.zeros(3)
         emit_rms  = numpy.zeros(3)
 
-        sigma = stats6d.calc_correlations6d(self.phase_space_6d.get_array_6d())
+        sigma = stats6d.calc_correlations6d(self.phase_space_6d.get_array_6d(), weights)
         for i_loop in range(3):
             ii = 2 * i_loop
             emitSQ = sigma[ii,ii]*sigma[ii+1,ii+1] - sigma[ii,ii+1]*sigma[ii+1,ii]
@@ -160,9 +164,35 @@ class RsDistrib6D:
         return
 
     def make_twiss_dist_6d(self,twiss6d, mean_p_ev):
+        """Transform the normalized distribution to the target Twiss parameters.
 
-        array6d = self.phase_space_6d.get_array_6d()
-        temp6D = array6d.copy()
+        twiss6d is either a dict of RsTwiss2D objects keyed 'twiss_x', 'twiss_y' and 'twiss_z',
+        or a general 6x6 sigma matrix (see make_sigma_dist_6d)."""
+
+        if isinstance(twiss6d, numpy.ndarray):
+            self.make_sigma_dist_6d(twiss6d)
+        else:
+            self.apply_map_6d(self.calc_twiss_map_6d(twiss6d))
+#        self.multiply_component(mean_p_ev, 5)
+#        self.offset_component(mean_p_ev, 5)
+
+        return
+
+    def make_sigma_dist_6d(self, sigma6d):
+        """Transform the normalized (zero mean, unit covariance) distribution so its correlation matrix
+        is the symmetric positive-definite 6x6 matrix sigma6d, which may couple any of the planes."""
+        sigma6d = numpy.asarray(sigma6d, dtype=float)
+        if sigma6d.shape != (6,6):
+            message = 'ERROR!  sigma6d must be 6x6, not ' + str(sigma6d.shape)
+            raise Exception(message)
+
+        # sigma6d = L L^T, so L maps unit covariance onto sigma6d
+        self.apply_map_6d(numpy.linalg.cholesky(sigma6d))
+        return
+
+    def calc_twiss_map_6d(self, twiss6d):
+        """Block-diagonal 6x6 map taking the normalized distribution to the Twiss parameters in twiss6d."""
+        map6d = numpy.zeros((6,6))
 
         ii = -1
         for i_loop in range(0,5,2):
@@ -179,15 +209,9 @@ class RsDistrib6D:
             betaII  = twissObject.get_beta_rms()
             gammaII = (1.0 + alphaII**2) / betaII
 
-            if 0:
-                print('\n alpha, beta, gamma[', ii, '] = ', alphaII, betaII, gammaII)
-
             gMinusB = gammaII - betaII
             rt_fac = math.sqrt(gMinusB**2 + 4.0*alphaII**2)
 
-            if 0:
-                print(' gMinusB, rt_fac[', ii, '] = ', gMinusB, rt_fac)
-
             if gMinusB >= 0.0:
                 fac  = math.sqrt(0.5*(gammaII+betaII-rt_fac))
                 f_inv = math.sqrt(0.5*(gammaII+betaII+rt_fac))
@@ -195,9 +219,6 @@ class RsDistrib6D:
                 fac  = math.sqrt(0.5*(gammaII+betaII+rt_fac))
                 f_inv = math.sqrt(0.5*(gammaII+betaII-rt_fac))
 
-            if 0:
-                print(' fac, f_inv[', ii, '] = ', fac, f_inv)
-
             if alphaII == 0.0:
                 sin_phi = 0.0
                 cos_phi = 1.0
@@ -209,17 +230,21 @@ class RsDistrib6D:
 
             rt_fac = math.sqrt(twissObject.get_emit_rms())
 
-            if 0:
-                print(' sin_phi, cos_phi, rt_fac[', ii, '] = ', sin_phi, cos_phi, rt_fac)
+            map6d[i_loop,  i_loop]   =  rt_fac*fac  *cos_phi
+            map6d[i_loop,  i_loop+1] = -rt_fac*f_inv*sin_phi
+            map6d[i_loop+1,i_loop]   =  rt_fac*fac  *sin_phi
+            map6d[i_loop+1,i_loop+1] =  rt_fac*f_inv*cos_phi
 
-            for nLoop in range(self.phase_space_6d.get_num_ptcls()):
-                array6d[i_loop  ,nLoop] = rt_fac*(fac * cos_phi*temp6D[i_loop,  nLoop] - \
-                                                  f_inv*sin_phi*temp6D[i_loop+1,nLoop])
-                array6d[i_loop+1,nLoop] = rt_fac*(fac * sin_phi*temp6D[i_loop,  nLoop] + \
-                                                  f_inv*cos_phi*temp6D[i_loop+1,nLoop])
-#        self.multiply_component(mean_p_ev, 5)
-#        self.offset_component(mean_p_ev, 5)
+        return map6d
 
+    def apply_map_6d(self, map6d):
+        """Apply a 6x6 linear map to every particle, in place.
+        Particles are transformed in batches of max_batch_size, so temporaries stay bounded."""
+        array6d = self.phase_space_6d.get_array_6d()
+        num_ptcls = self.phase_space_6d.get_num_ptcls()
+        for n_start in range(0, num_ptcls, max_batch_size):
+            n_stop = min(n_start + max_batch_size, num_ptcls)
+            array6d[:, n_start:n_stop] = map6d @ array6d[:, n_start:n_stop]
         return
 
     def offset_component(self,offset,index):
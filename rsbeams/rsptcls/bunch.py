@@ -24,9 +24,141 @@ Last Updated: 6/25/2018
 """
 
 
+import copy
+import warnings
+from collections import deque
 import numpy as np
-import random
+from functools import lru_cache
+from pathos.multiprocessing import Pool, cpu_count
 from scipy.optimize import newton
+from rsbeams.rsdata.SDDS import writeSDDS
+
+# Upper limit on the number of trial points drawn at once when sampling a distribution
+max_trial_block = 2**20
+
+# Particles are sampled in chunks of this size, each with its own random stream spawned from the bunch seed.
+# The chunking does not depend on the number of workers, so a seeded bunch is the same however it is generated.
+stream_chunk_size = 2**18
+
+# Independent random streams of a bunch, one per set of coordinates
+random_streams = ['transverse', 'longitudinal']
+
+# Columns of the particles array, and their units, used when writing a bunch to file
+particle_columns = [('x', 'm'), ('xp', ''), ('y', 'm'), ('yp', ''), ('z', 'm'), ('zp', ''), ('particleID', '')]
+
+# Sign flips giving the three mirror images of a particle added for a quiet start: (-x, xp, -y, yp),
+# (-x, -xp, -y, -yp) and (x, -xp, y, -yp). Each group of four then has zero centroid in every coordinate.
+quiet_reflections = np.array([[1, 1, 1, 1], [-1, 1, -1, 1], [-1, -1, -1, -1], [1, -1, 1, -1]])
+
+# Maximum relative interpolation error of the yMax(H) tables, the largest y/c they cover, and the most intervals
+# a table is refined to
+yMax_rtol = 1e-10
+yMax_table_range = 10.
+yMax_max_points = 2**22
+
+
+class YMaxTable(object):
+
+    """
+    Interpolation table of the largest vertical coordinate, yMax, reachable with invariant H in the elliptic
+    potential of strength t: the root of whatsleft for NonlinearBunch.
+
+    On the y axis the potential is V(0, y) = c**2 * (y'**2/2 - t y' asinh(y') / sqrt(1 + y'**2)) with y' = y/c, so
+    one table in normalized units serves every aperture c. yMax/c is tabulated against sqrt(H)/c, which is
+    close to linear, on a uniform grid in y/c that is refined until linear interpolation is within `rtol` at
+    every midpoint.
+
+    Tables are plain arrays, so they can be pickled to worker processes. Use yMax_table to share them.
+
+    Attributes:
+        t (float): nonlinear strength parameter
+        yN (ndarray): grid of y/c
+        sN (ndarray): sqrt(V(0, y))/c on the grid
+    """
+
+    def __init__(self, t, rtol=yMax_rtol, yN_max=yMax_table_range):
+        """
+        Args:
+            t (float): nonlinear strength parameter, below 0.5 so the potential increases along y
+            rtol (float): maximum relative interpolation error
+            yN_max (float): largest y/c in the table
+        """
+
+        self.t = t
+        nPoints = 1024
+        while True:
+            yN = np.linspace(0., yN_max, nPoints + 1)
+            sN = np.sqrt(self.axis_potential(yN))
+            if not np.all(np.diff(sN) > 0.):
+                raise ValueError("The elliptic potential must increase along y; t = {} is too large".format(t))
+
+            yMid = 0.5*(yN[1:] + yN[:-1])
+            error = np.abs(np.interp(np.sqrt(self.axis_potential(yMid)), sN, yN) - yMid) / yMid
+            if np.max(error) < rtol:
+                break
+            if nPoints >= yMax_max_points:
+                warnings.warn("yMax table for t = {} stopped at {} points with relative error {:.3g}, above "
+                              "rtol = {:.3g}".format(t, nPoints, np.max(error), rtol))
+                break
+            nPoints *= 2
+
+        self.yN = yN
+        self.sN = sN
+
+    def axis_potential(self, yN):
+        """Normalized potential V(0, y)/c**2 on the y axis"""
+
+        return 0.5*yN**2 - self.t*yN*np.arcsinh(yN)/np.sqrt(1. + yN**2)
+
+    def __call__(self, H, c):
+        """yMax for an array of invariants H and aperture c. Values of H beyond the table are returned as nan."""
+
+        return c * np.interp(np.sqrt(H)/c, self.sN, self.yN, right=np.nan)
+
+
+@lru_cache(maxsize=32)
+def yMax_table(t):
+    """YMaxTable for strength t, cached so every bunch with the same t shares it"""
+
+    return YMaxTable(t)
+
+
+def _sample_chunk(task):
+    # Runs in the worker: sample one chunk of particles with its own generator
+    bunch, method, seedSequence, nChunk = task
+    return getattr(bunch, method)(np.random.default_rng(seedSequence), nChunk)
+
+
+def _imap_bounded(pool, function, tasks, window):
+    # pool.imap, but with at most `window` tasks submitted ahead of the consumer, so results never pile up in
+    # memory and several streams can share one pool
+    pending = deque()
+    for task in tasks:
+        if len(pending) == window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(function, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def _rechunk(blocks, size):
+    # Regroup an iterator of arrays into arrays of `size` rows (the last may be shorter). Views of the input are
+    # collected until they fill a chunk, so each row is copied at most once.
+    pieces = []
+    count = 0
+    for block in blocks:
+        start = 0
+        while block.shape[0] - start >= size - count:
+            pieces.append(block[start:start + size - count])
+            start += size - count
+            yield np.concatenate(pieces)
+            pieces = []
+            count = 0
+        if start < block.shape[0]:
+            pieces.append(block[start:])
+            count += block.shape[0] - start
+    if count:
+        yield np.concatenate(pieces)
 
 class StandardBunch(object):
 
@@ -45,13 +177,18 @@ class StandardBunch(object):
         alphay (float): one-half the derivative of the beta function, defaults to 0
         stdz (float): standard deviation in z-coordinate, defautls to 0
         dpop (float): standard deviation in delta-p/p0 coordinate, defaults to 0
-        seed (float): seed for psuedorandom generator. Defaults to None, and is generate during initialization.
+        seed (int): entropy for the np.random.SeedSequence of the bunch. Defaults to None, and fresh entropy is
+            drawn during initialization.
         quiet (Boolean): boolean describing whether to use exact centroid injection, defaults to false.
+        workers (int): number of processes used to generate coordinates, defaults to cpu_count. 1 runs in this process.
+        allocate (Boolean): whether to allocate the particles array, defaults to true. Bunches too large for
+            memory can be generated in blocks with iter_blocks or written to file with write_sdds,
+            write_memmap or write_hdf5 without it.
 
     """
 
     def __init__(self, npart, dist = 'Gaussian', emitx = 1e-6, emity = 1e-6, betax=1., alphax = 0.,
-                 betay =1., alphay=0., stdz=1., dpop=0, seed = None, quiet=False):
+                 betay =1., alphay=0., stdz=1., dpop=0, seed = None, quiet=False, workers=None, allocate=True):
         """
 
         Args:
@@ -65,8 +202,12 @@ class StandardBunch(object):
             alphay (float): one-half the derivative of the beta function, defaults to 0
             stdz (float): standard deviation in z-coordinate, defautls to 0
             dpop (float): standard deviation in delta-p/p0 coordinate, defaults to 0
-            seed (float): seed for psuedorandom generator. Defaults to None, and is generate during initialization.
+            seed (int): entropy for the np.random.SeedSequence of the bunch. Defaults to None, and fresh entropy is
+                drawn during initialization.
             quiet (Boolean): boolean describing whether to use exact centroid injection, defaults to false.
+            workers (int): number of processes used to generate coordinates, defaults to cpu_count. 1 runs in this
+                process.
+            allocate (Boolean): whether to allocate the particles array, defaults to true.
         """
 
         self.npart = npart
@@ -93,17 +234,18 @@ class StandardBunch(object):
         self.stdz = stdz
         self.dpop = dpop
 
-        #define seed
-        if seed is not None:
-            self.seed = seed
-        else:
-            self.seed = random.seed()
+        #define seed, keeping the entropy so a bunch generated without a seed can be reproduced
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.workers = workers
 
         #create particles array
-        self.particles = np.zeros((npart,7))
+        if allocate:
+            self.particles = np.zeros((npart,7))
 
-        #define particle IDs
-        self.particles[:,6] = np.arange(npart)
+            #define particle IDs
+            self.particles[:,6] = np.arange(npart)
+        else:
+            self.particles = None
 
         #define quiet injection attribute
         self.quiet = quiet
@@ -159,8 +301,7 @@ class StandardBunch(object):
         if dpop is not None:
             self.dpop = dpop
 
-        self.particles[:,4] = np.random.randn(self.npart)*self.stdz #set z coordinate
-        self.particles[:,5] = np.random.randn(self.npart)*self.dpop #set dpop coordinate
+        self.particles[:,4:6] = self.generate('sample_longitudinal', self.npart, 'longitudinal')
 
     def set_transverse_coordinates(self, emitx = None, emity = None, betax = None, alphax = None, betay = None, alphay = None):
         """Define the arrays describing the longitudinal coordinates z, dpop"""
@@ -188,16 +329,7 @@ class StandardBunch(object):
     def distribute_Gaussian(self):
         """ Generates an uncorrelated Gaussian distribution in 4D phase space using known bunch attributes"""
 
-        sigma_x = np.sqrt(self.emitx*self._betax)
-        sigma_xp = np.sqrt(self.emitx*self._gammax)
-
-        sigma_y = np.sqrt(self.emity*self._betay)
-        sigma_yp = np.sqrt(self.emity*self._gammay)
-
-        self.particles[:,0] = np.random.randn(self.npart)*sigma_x #set x-coordinates
-        self.particles[:,1] = np.random.randn(self.npart)*sigma_xp #set xp-coordinates
-        self.particles[:,2] = np.random.randn(self.npart)*sigma_y #set y-coordinates
-        self.particles[:,3] = np.random.randn(self.npart)*sigma_yp #set yp-coordinates
+        self.particles[:,:4] = self.generate('sample_Gaussian', self.npart)
 
 
     def distribute_KV(self):
@@ -212,6 +344,197 @@ class StandardBunch(object):
         emit = 4.*self.emitx
         self.emit = emit
 
+        self.particles[:,:4] = self.quiet_start(self.generate('sample_KV', self.num_sampled()))
+
+    def generate(self, method, nSampled, stream='transverse'):
+        """
+        Sample particles in chunks of stream_chunk_size, running the chunks on a pool of self.workers processes.
+
+        Each chunk draws from its own np.random.Generator, seeded by a child of the bunch's SeedSequence spawned
+        for the given stream, so the result depends only on the seed and not on the number of workers.
+
+        Args:
+            method (string): name of the method sampling one chunk, called as method(rng, n)
+            nSampled (int): total number of particles to sample
+            stream (string): one of random_streams
+
+        Returns:
+            ptclCoords (ndarray): the concatenated chunks
+        """
+
+        return np.concatenate(list(self.iter_generate(method, nSampled, stream)))
+
+    def iter_generate(self, method, nSampled, stream='transverse', pool=None):
+        """
+        Yield the chunks of generate one at a time, in order. An empty sample is a single empty chunk.
+
+        Args:
+            pool (Pool): pool from start_pool to sample on, left open. If not given, one is started if needed and
+                closed once the chunks are consumed.
+        """
+
+        streamSequence = np.random.SeedSequence(self.seed).spawn(len(random_streams))[random_streams.index(stream)]
+        sizes = [min(stream_chunk_size, nSampled - start) for start in range(0, nSampled, stream_chunk_size)] or [0]
+        seeds = streamSequence.spawn(len(sizes))
+
+        ownPool = pool is None
+        if ownPool:
+            pool = self.start_pool(nSampled)
+        if pool is None:
+            for seed, size in zip(seeds, sizes):
+                yield getattr(self, method)(np.random.default_rng(seed), size)
+            return
+
+        #workers get a copy of the bunch without its particle array
+        sampler = copy.copy(self)
+        sampler.particles = None
+        tasks = ((sampler, method, seed, size) for seed, size in zip(seeds, sizes))
+        try:
+            for chunk in _imap_bounded(pool, _sample_chunk, tasks, 2 * (self.workers or cpu_count())):
+                yield chunk
+        finally:
+            if ownPool:
+                pool.close()
+                pool.join()
+
+    def start_pool(self, nSampled):
+        """
+        Start a pool of self.workers processes (cpu_count if None) for sampling nSampled particles, or return None
+        if they are sampled in this process: with a single worker, or when they fit in one chunk.
+        """
+
+        workers = self.workers or cpu_count()
+        if workers == 1 or nSampled <= stream_chunk_size:
+            return None
+        return Pool(workers)
+
+    def transverse_sampler(self):
+        """
+        Prepare the bunch attributes for its distribution, as set_transverse_coordinates does, and return the name
+        of the method sampling it and whether a quiet start applies.
+        """
+
+        if self.dist == 'KV':
+            assert (self.emitx == self.emity), "For a KV distribution, the planar emittances must be equal"
+            self.emit = 4.*self.emitx
+            return 'sample_KV', True
+
+        if self.dist != 'Gaussian':
+            raise ValueError("dist must be 'Gaussian' or 'KV', not {}".format(self.dist))
+        return 'sample_Gaussian', False
+
+    def iter_blocks(self):
+        """
+        Generate the bunch in blocks of stream_chunk_size particles without holding it in memory. Blocks have the
+        same layout as the particles array (x, xp, y, yp, z, zp, particle ID) and, for a given seed, the same
+        values as set_transverse_coordinates followed by set_longitudinal_coordinates.
+
+        A quiet start keeps each particle's mirror images in its block, since stream_chunk_size is a multiple of 4,
+        so every block, and hence the whole bunch, has an exactly zero transverse centroid.
+
+        Yields:
+            block (ndarray): (n, 7) array of particle coordinates
+        """
+
+        method, quiet = self.transverse_sampler()
+        if self.npart == 0:
+            return
+
+        # Both streams share one pool, closed when the blocks are consumed or the generator is closed
+        pool = self.start_pool(self.npart)
+        try:
+            if quiet:
+                transverse = (self.quiet_start(chunk)
+                              for chunk in self.iter_generate(method, self.num_sampled(), pool=pool))
+            else:
+                transverse = self.iter_generate(method, self.npart, pool=pool)
+            longitudinal = self.iter_generate('sample_longitudinal', self.npart, 'longitudinal', pool=pool)
+
+            transverse = _rechunk(transverse, stream_chunk_size)
+            start = 0
+            for longitudinalBlock in longitudinal:
+                transverseBlock = next(transverse)
+                block = np.empty((transverseBlock.shape[0], 7))
+                block[:,:4] = transverseBlock
+                block[:,4:6] = longitudinalBlock
+                block[:,6] = np.arange(start, start + block.shape[0])
+                start += block.shape[0]
+                yield block
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def write_sdds(self, fileName, dataMode='binary'):
+        """Generate the bunch block by block into an SDDS file with one column per coordinate (see iter_blocks)"""
+
+        fileOut = writeSDDS()
+        for name, units in particle_columns:
+            fileOut.create_column(name, None, 'double', colUnits=units)
+        fileOut.open_stream(fileName, self.npart, dataMode=dataMode)
+        try:
+            for block in self.iter_blocks():
+                fileOut.write_rows(block)
+        finally:
+            fileOut.close_stream()
+
+    def write_memmap(self, fileName):
+        """
+        Generate the bunch block by block into a raw (npart, 7) float64 file (see iter_blocks).
+
+        Returns:
+            particles (np.memmap): the file, mapped read-only. An empty bunch, which cannot be mapped, gives an
+                empty file and an empty array.
+        """
+
+        if self.npart == 0:
+            open(fileName, 'wb').close()
+            return np.empty((0, 7))
+        particles = np.memmap(fileName, dtype=np.float64, mode='w+', shape=(self.npart, 7))
+        start = 0
+        for block in self.iter_blocks():
+            particles[start:start + block.shape[0]] = block
+            start += block.shape[0]
+        particles.flush()
+        del particles
+
+        return np.memmap(fileName, dtype=np.float64, mode='r', shape=(self.npart, 7))
+
+    def write_hdf5(self, fileName, datasetName='particles'):
+        """
+        Generate the bunch block by block into an (npart, 7) dataset of an HDF5 file (see iter_blocks). The
+        column names are stored in the 'columns' attribute of the dataset.
+        """
+        import h5py as h5
+
+        with h5.File(fileName, 'w') as fileOut:
+            dataset = fileOut.create_dataset(datasetName, shape=(self.npart, 7), dtype=np.float64,
+                                             chunks=(min(self.npart, 2**16), 7) if self.npart else None)
+            dataset.attrs['columns'] = [name for name, units in particle_columns]
+            start = 0
+            for block in self.iter_blocks():
+                dataset[start:start + block.shape[0]] = block
+                start += block.shape[0]
+
+    def sample_longitudinal(self, rng, n):
+        """Sample n Gaussian z and dpop coordinates"""
+
+        return rng.standard_normal((n, 2)) * [self.stdz, self.dpop]
+
+    def sample_Gaussian(self, rng, n):
+        """Sample n particles of the uncorrelated Gaussian distribution"""
+
+        sigma_x = np.sqrt(self.emitx*self._betax)
+        sigma_xp = np.sqrt(self.emitx*self._gammax)
+
+        sigma_y = np.sqrt(self.emity*self._betay)
+        sigma_yp = np.sqrt(self.emity*self._gammay)
+
+        return rng.standard_normal((n, 4)) * [sigma_x, sigma_xp, sigma_y, sigma_yp]
+
+    def sample_KV(self, rng, n):
+        """Sample n particles of the KV distribution with total emittance self.emit"""
+
         # Generate some bounds on the transverse size to reduce waste in generating the bunch
         # Use the lemming method to find the maximum y
         y0 = np.sqrt(self.emit)
@@ -221,40 +544,90 @@ class StandardBunch(object):
 
         # Generate particles by creating trials and finding particles with potential less than emittance,
         # then assign the rest to momentum
-        ptclsMade = 0
-        phaseSpaceList = []
+        return self.sample_invariant(rng, np.full(n, self.emit), xMax, yMax)
 
-        while ptclsMade < self.npart:
-            #Note that the particle coordinates here are distributed in normal coordinates
-            xTrial = 2.*(0.5 - random.random())*xMax
-            yTrial = 2.*(0.5 - random.random())*yMax
-            trialValue = self.compute_potential(xTrial, yTrial)
-            if trialValue < self.emit:
+    def num_sampled(self):
+        """Number of particles to sample: all of them, or one in four for a quiet start."""
 
-                pMag = np.sqrt(2.*(self.emit - trialValue))
-                pDir = 2.*np.pi * random.random()
-                pxHat = pMag * np.cos(pDir)
-                pyHat = pMag * np.sin(pDir)
+        if not self.quiet:
+            return self.npart
+        if self.npart % 4:
+            raise ValueError("A quiet start needs a number of particles divisible by 4, not {}".format(self.npart))
+        return self.npart // 4
 
-                xReal = xTrial * np.sqrt(self.betax)
-                yReal = yTrial * np.sqrt(self.betay)
+    def quiet_start(self, ptclCoords):
+        """
+        Follow each particle by its three mirror images (see exact_centroids) if creating a quiet start.
 
-                #We want to provide the user with standard (non-normal) coordinates
-                pxReal = (pxHat - self.alphax*xTrial)/np.sqrt(self.betax)
-                pyReal = (pyHat - self.alphay*yTrial)/np.sqrt(self.betay)
+        Args:
+            ptclCoords (ndarray): (n, 4) array of particle coordinates
 
-                ptclCoords = np.array([xReal, pxReal, yReal, pyReal])
-                phaseSpaceList.append(ptclCoords)
-                ptclsMade += 1
+        Returns:
+            ptclCoords, or the (4n, 4) array with the mirror images interleaved
+        """
 
-                #Add 3 more particles if creating a quiet start
-                if self.quiet:
-                    self.exact_centroids(ptclCoords, phaseSpaceList)
-                    ptclsMade += 3
+        if not self.quiet:
+            return ptclCoords
+        return (ptclCoords[:, np.newaxis, :] * quiet_reflections).reshape(-1, 4)
 
-        self.particles[:,:4] = np.asarray(phaseSpaceList)
+    def sample_invariant(self, rng, H, xMax, yMax):
+        """
+        Sample particles with given values of the invariant. Positions are drawn uniformly within the bounds in
+        normalized coordinates and accepted where the potential is below H; the remainder of H is assigned to
+        the momentum, in a uniformly distributed direction. All particles are handled as arrays: each round
+        draws trials for every particle still pending, several per particle when acceptance is low.
+
+        Args:
+            rng (Generator): random number generator
+            H (ndarray): invariant of each particle
+            xMax (float): bound on the normalized horizontal coordinate
+            yMax (float or ndarray): bound on the normalized vertical coordinate, for all or for each particle
 
+        Returns:
+            ptclCoords (ndarray): (len(H), 4) array of x, xp, y, yp in standard (non-normal) coordinates
+        """
 
+        yMax = np.broadcast_to(yMax, H.shape)
+        xHat = np.empty(H.shape[0])
+        yHat = np.empty(H.shape[0])
+        for start in range(0, H.shape[0], max_trial_block):
+            pending = np.arange(start, min(start + max_trial_block, H.shape[0]))
+            #trials per pending particle, adapted to the acceptance of the previous round
+            perParticle = 1
+            while pending.shape[0]:
+                perParticle = min(perParticle, max(max_trial_block // pending.shape[0], 1))
+                shape = (pending.shape[0], perParticle)
+                xTrial = rng.uniform(-1., 1., shape) * xMax
+                yTrial = rng.uniform(-1., 1., shape) * yMax[pending, np.newaxis]
+                accepted = self.compute_potential(xTrial, yTrial) < H[pending, np.newaxis]
+
+                #first accepted trial of each particle
+                done = accepted.any(axis=1)
+                first = np.argmax(accepted[done], axis=1)
+                xHat[pending[done]] = xTrial[done, first]
+                yHat[pending[done]] = yTrial[done, first]
+
+                acceptance = np.mean(accepted)
+                perParticle = int(np.clip(2. / acceptance, 1, 256)) if acceptance > 0 else 256
+                pending = pending[~done]
+
+        pMag = np.sqrt(2.*(H - self.compute_potential(xHat, yHat)))
+        pDir = 2.*np.pi * rng.random(H.shape[0])
+        pxHat = pMag * np.cos(pDir)
+        pyHat = pMag * np.sin(pDir)
+
+        return self.normal_to_real(xHat, pxHat, yHat, pyHat)
+
+    def normal_to_real(self, xHat, pxHat, yHat, pyHat):
+        """Convert arrays of normalized coordinates to an (n, 4) array of standard (non-normal) coordinates"""
+
+        ptclCoords = np.empty((xHat.shape[0], 4))
+        ptclCoords[:,0] = xHat * np.sqrt(self.betax)
+        ptclCoords[:,1] = (pxHat - self.alphax*xHat)/np.sqrt(self.betax)
+        ptclCoords[:,2] = yHat * np.sqrt(self.betay)
+        ptclCoords[:,3] = (pyHat - self.alphay*yHat)/np.sqrt(self.betay)
+
+        return ptclCoords
 
 
     def print_Twiss(self):
@@ -319,8 +692,11 @@ class NonlinearBunch(StandardBunch):
         alphay (float): one-half the derivative of the beta function, defaults to 0
         stdz (float): standard deviation in z-coordinate, defautls to 0
         dpop (float): standard deviation in delta-p/p0 coordinate, defaults to 0
-        seed (float): seed for psuedorandom generator. Defaults to None, and is generate during initialization.
+        seed (int): entropy for the np.random.SeedSequence of the bunch. Defaults to None, and fresh entropy is
+            drawn during initialization.
         quiet (Boolean): boolean describing whether to use exact centroid injection, defaults to false.
+        workers (int): number of processes used to generate coordinates, defaults to cpu_count. 1 runs in this process.
+        allocate (Boolean): whether to allocate the particles array, defaults to true.
         t (float): nonlinear strength parameter for the insert. Defaults to 0.1 (unitless).
         c (float): the nonlinear aperture parameter (m^-1/2), defining poles in the x-axis. Defaults to 0.01.
         cutoff (float): cutoff parameter for the nonlinear Gaussian distributoin, defaults to 4.
@@ -328,7 +704,8 @@ class NonlinearBunch(StandardBunch):
     """
 
     def __init__(self, npart, dist = 'KV', emitx = 1e-6, emity = 1e-6, betax=1., alphax = 0.,
-                 betay =1., alphay=0., stdz=1., dpop=0, seed = None, queit=False, t = 0.1, c = 0.01, cutoff = 4):
+                 betay =1., alphay=0., stdz=1., dpop=0, seed = None, queit=False, t = 0.1, c = 0.01, cutoff = 4,
+                 workers=None, allocate=True):
         """
 
         Args:
@@ -342,14 +719,19 @@ class NonlinearBunch(StandardBunch):
             alphay (float): one-half the derivative of the beta function, defaults to 0
             stdz (float): standard deviation in z-coordinate, defautls to 0
             dpop (float): standard deviation in delta-p/p0 coordinate, defaults to 0
-            seed (float): seed for psuedorandom generator. Defaults to None, and is generate during initialization.
+            seed (int): entropy for the np.random.SeedSequence of the bunch. Defaults to None, and fresh entropy is
+                drawn during initialization.
             quiet (Boolean): boolean describing whether to use exact centroid injection, defaults to false.
             t (float): nonlinear strength parameter for the insert. Defaults to 0.1 (unitless).
             c (float): the nonlinear aperture parameter (m^-1/2), defining poles in the x-axis. Defaults to 0.01.
             cutoff (float): cutoff parameter for the nonlinear Gaussian distributoin, defaults to 4.
+            workers (int): number of processes used to generate coordinates, defaults to cpu_count. 1 runs in this
+                process.
+            allocate (Boolean): whether to allocate the particles array, defaults to true.
         """
 
-        super(NonlinearBunch,self).__init__(npart, dist, emitx, emity, betax, alphax, betay, alphay, stdz, dpop, seed)
+        super(NonlinearBunch,self).__init__(npart, dist, emitx, emity, betax, alphax, betay, alphay, stdz, dpop, seed,
+                                            queit, workers, allocate)
 
         self._t = t
         self._c = c
@@ -480,49 +862,32 @@ class NonlinearBunch(StandardBunch):
         emit = self.emitx
         self.emit = emit
 
-        # Generate some bounds on the transverse size to reduce waste in generating the bunch
-        # Use the lemming method to find the maximum y
-        y0 = np.sqrt(self.emit)
-
-        yMax = newton(self.whatsleft, y0)
-
-        #bounding the horizontal coordinate is difficult, but it should not exceed the pole
-        xMax = self.c
-
-        # Generate particles by creating trials and finding particles with potential less than emittance,
-        # then assign the rest to momentum
-        ptclsMade = 0
-        phaseSpaceList = []
+        self.particles[:,:4] = self.quiet_start(self.generate('sample_KV', self.num_sampled()))
 
-        while ptclsMade < self.npart:
-            #Note that the particle coordinates here are distributed in normal coordinates
-            xTrial = 2.*(0.5 - random.random())*xMax
-            yTrial = 2.*(0.5 - random.random())*yMax
-            trialValue = self.compute_potential(xTrial, yTrial)
-            if trialValue < self.emit:
+    def transverse_sampler(self):
+        """See StandardBunch.transverse_sampler. A quiet start applies to every nonlinear distribution."""
 
-                pMag = np.sqrt(2.*(self.emit - trialValue))
-                pDir = 2.*np.pi * random.random()
-                pxHat = pMag * np.cos(pDir)
-                pyHat = pMag * np.sin(pDir)
+        if self.dist == 'KV':
+            assert (self.emitx == self.emity), "For a KV distribution, the planar emittances must be equal"
+            self.emit = self.emitx
+            return 'sample_KV', True
 
-                xReal = xTrial * np.sqrt(self.betax)
-                yReal = yTrial * np.sqrt(self.betay)
+        if self.dist not in ['waterbag', 'Gaussian']:
+            raise ValueError("dist must be 'KV', 'waterbag' or 'Gaussian', not {}".format(self.dist))
+        return 'sample_' + self.dist, True
 
-                #We want to provide the user with standard (non-normal) coordinates
-                pxReal = (pxHat - self.alphax*xTrial)/np.sqrt(self.betax)
-                pyReal = (pyHat - self.alphay*yTrial)/np.sqrt(self.betay)
+    def sample_KV(self, rng, n):
+        """Sample n particles of the generalized KV distribution with total emittance self.emit"""
 
-                ptclCoords = np.array([xReal, pxReal, yReal, pyReal])
-                phaseSpaceList.append(ptclCoords)
-                ptclsMade += 1
+        # Generate some bounds on the transverse size to reduce waste in generating the bunch
+        yMax = self.compute_yMax(self.emit)
 
-                #Add 3 more particles if creating a quiet start
-                if self.quiet:
-                    self.exact_centroids(ptclCoords, phaseSpaceList)
-                    ptclsMade += 3
+        #bounding the horizontal coordinate is difficult, but it should not exceed the pole
+        xMax = self.c
 
-        self.particles[:,:4] = np.asarray(phaseSpaceList)
+        # Generate particles by creating trials and finding particles with potential less than emittance,
+        # then assign the rest to momentum
+        return self.sample_invariant(rng, np.full(n, self.emit), xMax, yMax)
 
 
     def distribute_waterbag(self):
@@ -534,54 +899,15 @@ class NonlinearBunch(StandardBunch):
         The method of generating particle coordinates remains simular to that used for the K-V distribution.
 
         """
-        # Generate particles by creating trials and finding particles with potential less than emittance, then assign the rest to momentum
-        ptclsMade = 0
-        phaseSpaceList = []
-        while ptclsMade < self.npart:
-            ranU = 0.0
-            while ranU <= 0:
-                ranU = random.random()
-
-            # Generate some bounds on the transverse size to reduce waste in generating the bunch
-            # Use the lemming method to find the maximum y
-            trialH = np.sqrt(ranU)
-            newH = self.emit*trialH
-            y0 = np.sqrt(newH)
-            #self.emittance = newH
-            yMax = newton(self.whatsleft, y0)
-
-            #bounding the horizontal coordinate is difficult, but it should not exceed the pole
-            xMax = self.c
-            #xMax = yMax
-
-            trialValue = 1e10
-            while trialValue >= newH:
-                xTrial = 2.*(0.5 - random.random())*xMax
-                yTrial = 2.*(0.5 - random.random())*yMax
-                trialValue = self.compute_potential(xTrial, yTrial)
-
-            initialValue = trialValue
-            if initialValue < newH:
-                pMag = np.sqrt(2*(newH - initialValue))
-                pDir = 2*np.pi* random.random()
-                pxHat = pMag * np.cos(pDir)
-                pyHat = pMag * np.sin(pDir)
-                xReal = xTrial * np.sqrt(self.betax)
-                yReal = yTrial * np.sqrt(self.betay)
-                pxReal = (pxHat - self.alphax*xTrial)/np.sqrt(self.betax)
-                pyReal = (pyHat - self.alphay*yTrial)/np.sqrt(self.betay)
-                ptclCoords = np.array([xReal, pxReal, yReal, pyReal])
-                phaseSpaceList.append(ptclCoords)
-                ptclsMade += 1
-
-                #Add 3 more particles if creating a quiet start
-                if self.quiet:
-                    self.exact_centroids(ptclCoords, phaseSpaceList)
-                    ptclsMade += 3
-            else:
-                print("Initial value generated exceeds limiting H. Sampling new value.")
+        self.particles[:,:4] = self.quiet_start(self.generate('sample_waterbag', self.num_sampled()))
 
-        self.particles[:,:4] = np.asarray(phaseSpaceList)
+    def sample_waterbag(self, rng, n):
+        """Sample n particles of the nonlinear waterbag distribution"""
+
+        # Draw the invariant of every particle at once: H = emit*sqrt(u) with u uniform on (0, 1]
+        newH = self.emit * np.sqrt(1. - rng.random(n))
+
+        return self.sample_invariant(rng, newH, self.c, self.compute_yMax(newH))
 
 
     def distribute_Gaussian(self):
@@ -595,66 +921,48 @@ class NonlinearBunch(StandardBunch):
         The method of generating particle coordinates remains simular to that used for the K-V distribution.
 
         """
-        # Copy the emittance value temporarily. It will be needed to reset the bunch attribute after fitting.
-        bunch_emittance = self.emit
-
-        # Generate particles by creating trials and finding particles with potential less than emittance, then assign the rest to momentum
-        ptclsMade = 0
-        phaseSpaceList = []
-        while ptclsMade < self.npart:
-            trialH = 1e10 #1.0e10
-            while trialH > self.cutoff:        #Test against cutoff value
-                ranU1 = 0.0
-                ranU2 = 0.0
-                while ranU1*ranU2 <= 0:
-                    ranU1 = random.random()
-                    ranU2 = random.random()
-                trialH = -1.0*np.log(ranU1*ranU2)   #Generate an Erlang distribution in h
-
-
-            # Generate some bounds on the transverse size to reduce waste in generating the bunch
-            # Use the lemming method to find the maximum y
-            newH = bunch_emittance*trialH #must modify the original bunch emtitance here
-            y0 = np.sqrt(newH)
-
-            self.emit = newH #temporarily reset emittance for computing ymax on a particle by particle basis
-
-            yMax = newton(self.whatsleft, y0)
-
-            #bounding the horizontal coordinate is difficult, but it should not exceed the pole
-            xMax = self.c
-            #xMax = yMax
-
-            trialValue = 1e10
-            while trialValue >= newH:
-                xTrial = 2.*(0.5 - random.random())*xMax
-                yTrial = 2.*(0.5 - random.random())*yMax
-                trialValue = self.compute_potential(xTrial, yTrial)
-            initialValue = trialValue
-            if initialValue < newH:
-                pMag = np.sqrt(2*(newH - initialValue))
-                pDir = 2*np.pi* random.random()
-                pxHat = pMag * np.cos(pDir)
-                pyHat = pMag * np.sin(pDir)
-                xReal = xTrial * np.sqrt(self.betax)
-                yReal = yTrial * np.sqrt(self.betay)
-                pxReal = (pxHat - self.alphax*xTrial)/np.sqrt(self.betax)
-                pyReal = (pyHat - self.alphay*yTrial)/np.sqrt(self.betay)
-                ptclCoords = np.array([xReal, pxReal, yReal, pyReal])
-                phaseSpaceList.append(ptclCoords)
-                ptclsMade += 1
-
-                #Add 3 more particles if creating a quiet start
-                if self.quiet:
-                    self.exact_centroids(ptclCoords, phaseSpaceList)
-                    ptclsMade += 3
-            else:
-                print("Initial value generated exceeds limiting H. Sampling new value.")
+        self.particles[:,:4] = self.quiet_start(self.generate('sample_Gaussian', self.num_sampled()))
+
+    def sample_Gaussian(self, rng, n):
+        """Sample n particles of the truncated nonlinear Gaussian distribution"""
+
+        # Generate an Erlang distribution in h for every particle, in blocks, keeping values within the cutoff
+        trialH = np.empty(n)
+        hMade = 0
+        while hMade < n:
+            nTrial = min(2*(n - hMade) + 16, max_trial_block)
+            ranU = 1. - rng.random((2, nTrial))
+            h = -1.0*np.log(ranU[0]*ranU[1])
+            h = h[h <= self.cutoff][:n - hMade]
+            trialH[hMade:hMade + h.shape[0]] = h
+            hMade += h.shape[0]
+
+        newH = self.emit*trialH
+
+        # Generate some bounds on the transverse size to reduce waste in generating the bunch
+        yMax = self.compute_yMax(newH)
+
+        #bounding the horizontal coordinate is difficult, but it should not exceed the pole
+        xMax = self.c
+
+        # Find positions with potential less than H for each particle, then assign the rest to momentum
+        return self.sample_invariant(rng, newH, xMax, yMax)
+
+    def compute_yMax(self, H):
+        """
+        Solve whatsleft for the largest normalized y reachable with invariant H, for an array of H values at once.
+        Values come from the cached yMax_table for this t; any beyond the table use the lemming method (secant
+        iteration from y = sqrt(H)) on all of them together.
+        """
 
-        #Completed distribution, so reset emittance
-        self.emit = bunch_emittance
+        H = np.asarray(H, dtype=float)
+        yMax = np.atleast_1d(yMax_table(float(self._t))(H, self._c))
+        beyond = ~np.isfinite(yMax)
+        if beyond.any():
+            HBeyond = np.atleast_1d(H)[beyond]
+            yMax[beyond] = newton(lambda yHat: HBeyond - self.compute_potential(0., yHat), np.sqrt(HBeyond))
 
-        self.particles[:,:4] = np.asarray(phaseSpaceList)
+        return yMax.reshape(H.shape)
 
 
     def compute_Hamiltonian(self, xHat, pxHat, yHat, pyHat):
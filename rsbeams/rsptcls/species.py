@@ -1,19 +1,148 @@
-from scipy.constants import c
+import numpy as np
+from scipy.constants import c, e
+
+# Column order of the Species particle array
+coordinate_names = ['x', 'ux', 'y', 'uy', 'ct', 'pt']
+
+
+def _column_property(index):
+    def getter(self):
+        return self.coordinates[:, index]
+
+    def setter(self, value):
+        self.coordinates[:, index] = value
+
+    return property(getter, setter)
 
 
 class Species:
-    def __init__(self, coordinates, charge=None, mass=None, total_charge=None):
-        self.x = coordinates[:, 0]
-        self.ux = coordinates[:, 1]
-        self.y = coordinates[:, 2]
-        self.uy = coordinates[:, 3]
-        self.ct = coordinates[:, 4]
-        self.pt = coordinates[:, 5]
+    """
+    Particle species backed by a single (N, 6) array of coordinates.
+    Columns are x, ux, y, uy, ct, pt (see Switchyard for units). The named attributes are views into the
+    array, and unit-convention transforms are applied in place, so no per-column copies are ever made.
+
+    Macroparticles may optionally carry a weight (the number of physical particles each one represents) and an
+    integer ID. Without weights every macroparticle carries an equal share of `total_charge`.
+    """
+    x = _column_property(0)
+    ux = _column_property(1)
+    y = _column_property(2)
+    uy = _column_property(3)
+    ct = _column_property(4)
+    pt = _column_property(5)
+
+    def __init__(self, coordinates, charge=None, mass=None, total_charge=None, weights=None, ids=None):
+        """
+        :param coordinates: (ndarray) (N, 6) array of x, ux, y, uy, ct, pt.
+        :param charge: (float) Particle charge in units of e.
+        :param mass: (float) Particle rest mass in eV/c^2.
+        :param total_charge: (float) Total bunch charge in C. Computed from `weights` and `charge` if not given.
+        :param weights: (ndarray) Optional (N,) number of physical particles represented by each macroparticle.
+        :param ids: (ndarray) Optional (N,) integer particle IDs.
+        """
+        # Only copies if `coordinates` is not already a writeable, C-ordered float64 array
+        self.coordinates = np.require(coordinates, dtype=np.float64, requirements=['C', 'W'])
+        if self.coordinates.ndim != 2 or self.coordinates.shape[1] != 6:
+            raise ValueError("coordinates must have shape (N, 6), not {}".format(self.coordinates.shape))
+        self.weights = self._get_particle_array(weights, np.float64)
+        self.ids = self._get_particle_array(ids, np.int64)
         self.charge = charge
         self.mass = mass
+        if total_charge is None and self.weights is not None and charge is not None:
+            total_charge = abs(charge * e * np.sum(self.weights))
         self.total_charge = total_charge
 
+    def __len__(self):
+        return self.coordinates.shape[0]
+
+    def _get_particle_array(self, values, dtype):
+        if values is None:
+            return None
+        values = np.require(values, dtype=dtype, requirements=['C', 'W'])
+        if values.shape != (len(self),):
+            raise ValueError("per-particle arrays must have shape ({},), not {}".format(len(self), values.shape))
+        return values
+
+    def macroparticle_charges(self):
+        """
+        Charge of each macroparticle in C, signed by the particle charge.
+        :return: (ndarray) (N,) array
+        """
+        charge = -1. if self.charge is None else self.charge
+        if self.weights is None:
+            if self.total_charge is None:
+                raise ValueError("Macroparticle charges need either weights or the total charge of the Species")
+            return np.full(len(self), np.sign(charge) * abs(self.total_charge) / len(self))
+        return self.weights * (charge * e)
+
     def convert_from_elegant(self):
-        self.ux = self.ux * self.pt
-        self.uy = self.uy * self.pt
-        self.ct = self.ct * c
\ No newline at end of file
+        """Convert in place from elegant (x, xp, y, yp, t, p) to Species conventions."""
+        self.coordinates[:, 1] *= self.coordinates[:, 5]
+        self.coordinates[:, 3] *= self.coordinates[:, 5]
+        self.coordinates[:, 4] *= c
+
+    def convert_to_elegant(self):
+        """Convert in place from Species conventions to elegant (x, xp, y, yp, t, p)."""
+        self.coordinates[:, 1] /= self.coordinates[:, 5]
+        self.coordinates[:, 3] /= self.coordinates[:, 5]
+        self.coordinates[:, 4] /= c
+
+    def convert_from_genesis(self):
+        """Convert in place from Genesis (X, PX, Y, PY, T, P) to Species conventions."""
+        self.coordinates[:, 4] *= c
+
+    def to_elegant(self, out=None):
+        """
+        Return coordinates in elegant conventions (x, xp, y, yp, t, p) without modifying the Species.
+        :param out: (ndarray) Optional (N, 6) array to write into. Allocated if not given.
+        :return: (ndarray) (N, 6) array
+        """
+        out = self._get_out(out)
+        out[:, 0] = self.x
+        np.divide(self.ux, self.pt, out=out[:, 1])
+        out[:, 2] = self.y
+        np.divide(self.uy, self.pt, out=out[:, 3])
+        np.divide(self.ct, c, out=out[:, 4])
+        out[:, 5] = self.pt
+
+        return out
+
+    def to_genesis(self, out=None, t_offset=None):
+        """
+        Return coordinates in Genesis conventions (X, PX, Y, PY, T, P) without modifying the Species.
+        :param out: (ndarray) Optional (N, 6) array to write into. Allocated if not given.
+        :param t_offset: (float) Time in s subtracted from T. Defaults to the average arrival time.
+        :return: (ndarray) (N, 6) array
+        """
+        out = self._get_out(out)
+        out[:] = self.coordinates
+        out[:, 4] /= c
+        if t_offset is None:
+            t_offset = np.average(out[:, 4])
+        out[:, 4] -= t_offset
+
+        return out
+
+    def iter_blocks(self, chunk_rows):
+        """
+        Iterate over consecutive row blocks as Species that are views into this Species' array. Blocks without
+        weights carry their share of `total_charge`; weighted blocks compute theirs from the weights.
+        :param chunk_rows: (int) Rows per block.
+        :return: Generator of Species
+        """
+        for start in range(0, len(self), chunk_rows):
+            stop = min(start + chunk_rows, len(self))
+            total_charge = None
+            if self.weights is None and self.total_charge is not None:
+                total_charge = self.total_charge * (stop - start) / len(self)
+            yield Species(self.coordinates[start:stop], charge=self.charge, mass=self.mass,
+                          total_charge=total_charge,
+                          weights=None if self.weights is None else self.weights[start:stop],
+                          ids=None if self.ids is None else self.ids[start:stop])
+
+    def _get_out(self, out):
+        if out is None:
+            return np.empty_like(self.coordinates)
+        if out.shape != self.coordinates.shape:
+            raise ValueError("out must have shape {}, not {}".format(self.coordinates.shape, out.shape))
+        return out
@@ -0,0 +1,170 @@
+import numpy as np
+from rsbeams.rsstats import stats6d
+from rsbeams.rsptcls import RsTwiss2D
+
+
+class MomentAccumulator6D:
+    """
+    Streaming, mergeable first and second moments of a 6D particle distribution.
+
+    Particle chunks are reduced as they arrive: each chunk's mean and co-moment matrix are computed in two passes
+    and combined with the running totals using the pairwise update of Chan, Golub and LeVeque. Accumulators built
+    from different SDDS pages, Switchyard blocks or parallel workers can be combined with `merge` without ever
+    concatenating the particle arrays.
+
+    Chunks use the stats6d layout, (6, n). Pass `block.T` for (n, 6) blocks such as Species coordinates.
+    Chunks may carry per-particle weights; moments are then normalized by `weight_sum`, as in stats6d.
+
+    Usage:
+        acc = MomentAccumulator6D()
+        for block in blocks:
+            acc.add(block.T)
+        emit = acc.calc_twiss_params6d()[2]
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.weight_sum = 0.
+        self.mean = np.zeros(6)
+        self.comoments = np.zeros((6, 6))
+        self.min = np.full(6, np.inf)
+        self.max = np.full(6, -np.inf)
+
+    def add(self, array6D, weights=None):
+        """
+        Add a chunk of particles.
+
+        Args:
+            array6D: (ndarray) (6, n) array of particle coordinates.
+            weights: (ndarray) Optional (n,) array of per-particle weights.
+
+        Returns:
+            self
+        """
+        return self.merge(self._reduce(array6D, weights))
+
+    def remove(self, array6D, weights=None):
+        """
+        Remove a chunk of particles that was previously added, e.g. to refit on a shrinking subset of the beam
+        without reducing the remaining particles again. min and max are not updated.
+
+        Args:
+            array6D: (ndarray) (6, n) array of particle coordinates.
+            weights: (ndarray) Optional (n,) array of per-particle weights.
+
+        Returns:
+            self
+        """
+        return self.subtract(self._reduce(array6D, weights))
+
+    @staticmethod
+    def _reduce(array6D, weights):
+        chunk = MomentAccumulator6D()
+        weight_sum = stats6d.calc_weight_sum(array6D, weights)
+        if array6D.shape[1] == 0 or not weight_sum > 0.:
+            return chunk
+        chunk.count = array6D.shape[1]
+        chunk.weight_sum = weight_sum
+        chunk.mean = stats6d.calc_avg6d(array6D, weights)
+        chunk.comoments = stats6d.calc_comoments6d(array6D, chunk.mean, weights)
+        chunk.min = stats6d.calc_min6d(array6D, weights)
+        chunk.max = stats6d.calc_max6d(array6D, weights)
+
+        return chunk
+
+    def merge(self, other):
+        """
+        Combine the moments of another accumulator into this one (Chan et al. pairwise update).
+
+        Args:
+            other: (MomentAccumulator6D) Partial result to merge. It is not modified.
+
+        Returns:
+            self
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count = other.count
+            self.weight_sum = other.weight_sum
+            self.mean = other.mean.copy()
+            self.comoments = other.comoments.copy()
+            self.min = other.min.copy()
+            self.max = other.max.copy()
+            return self
+
+        weight_sum = self.weight_sum + other.weight_sum
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.weight_sum / weight_sum)
+        self.comoments = self.comoments + other.comoments + \
+            np.outer(delta, delta) * (self.weight_sum * other.weight_sum / weight_sum)
+        self.count += other.count
+        self.weight_sum = weight_sum
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+
+        return self
+
+    def subtract(self, other):
+        """
+        Inverse of `merge`: remove the moments of a subset of the accumulated particles.
+
+        Args:
+            other: (MomentAccumulator6D) Moments of particles contained in this accumulator. It is not modified.
+
+        Returns:
+            self
+        """
+        if other.count == 0:
+            return self
+        if other.count >= self.count:
+            self.__init__()
+            return self
+
+        weight_sum = self.weight_sum - other.weight_sum
+        mean = (self.mean * self.weight_sum - other.mean * other.weight_sum) / weight_sum
+        delta = other.mean - mean
+        self.comoments = self.comoments - other.comoments - \
+            np.outer(delta, delta) * (weight_sum * other.weight_sum / self.weight_sum)
+        self.mean = mean
+        self.count -= other.count
+        self.weight_sum = weight_sum
+
+        return self
+
+    # Equivalents of the stats6d functions for the accumulated particles
+
+    def calc_avg6d(self):
+        return self.mean.copy()
+
+    def calc_variance6d(self):
+        return np.diag(self.comoments) / self.weight_sum
+
+    def calc_rms6d(self):
+        return np.sqrt(self.calc_variance6d())
+
+    def calc_min6d(self):
+        return self.min.copy()
+
+    def calc_max6d(self):
+        return self.max.copy()
+
+    def calc_correlations6d(self):
+        correlations6D = self.comoments / self.weight_sum
+        return 0.5 * (correlations6D + correlations6D.T)
+
+    def calc_twiss_params6d(self):
+        """RMS alpha, beta and emittance of the x, y and z planes (see stats6d.calc_twiss_params6d)."""
+        return stats6d.calc_twiss_params6d(self.calc_correlations6d())
+
+    def calc_twiss6d(self, twiss6d):
+        """
+        Fill `twiss6d` with RsTwiss2D objects for 'twiss_x', 'twiss_y' and 'twiss_z', as
+        RsDistrib6D.calc_twiss6d does.
+        """
+        alpha_rms, beta_rms, emit_rms = self.calc_twiss_params6d()
+        for i_loop, name in enumerate(['twiss_x', 'twiss_y', 'twiss_z']):
+            if not emit_rms[i_loop] > 0.:
+                raise Exception('Emittance of {} is not > zero'.format(name))
+            twiss6d[name] = RsTwiss2D.RsTwiss2D(alpha_rms[i_loop], beta_rms[i_loop], emit_rms[i_loop])
+        return twiss6d
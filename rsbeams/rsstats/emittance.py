@@ -0,0 +1,147 @@
+import warnings
+import numpy as np
+from rsbeams.rsstats.accumulator import MomentAccumulator6D
+
+# Refits of the core Twiss parameters stop once the selected particles no longer change, or after this many
+max_refit_iterations = 50
+
+
+def calc_invariants6d(array6D, sigma6D, avg6d):
+    """
+    Single-particle Courant-Snyder invariants, J = gamma x^2 + 2 alpha x x' + beta x'^2, of the (0,1), (2,3) and
+    (4,5) planes, with the Twiss parameters and centroid given by a correlation matrix and average.
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        sigma6D: (ndarray) 6x6 correlation matrix defining the Twiss parameters, e.g. from stats6d.calc_correlations6d.
+        avg6d: (ndarray) Centroid the coordinates are measured from.
+
+    Returns:
+        (ndarray) (3, N) array of invariants. Their average over the beam that defines `sigma6D` is twice the RMS
+        emittance.
+    """
+    invariants = np.empty((3, array6D.shape[1]))
+    for plane in range(3):
+        invariants[plane] = _plane_invariants(array6D, sigma6D, avg6d, plane)
+
+    return invariants
+
+
+def _plane_invariants(array6D, sigma6D, avg6d, plane):
+    i = 2 * plane
+    emitSQ = sigma6D[i, i] * sigma6D[i + 1, i + 1] - sigma6D[i, i + 1] ** 2
+    q = array6D[i] - avg6d[i]
+    p = array6D[i + 1] - avg6d[i + 1]
+    # gamma, alpha and beta times the emittance are sigma[i+1,i+1], -sigma[i,i+1] and sigma[i,i]
+    return (sigma6D[i + 1, i + 1] * q * q - 2. * sigma6D[i, i + 1] * q * p + sigma6D[i, i] * p * p) / np.sqrt(emitSQ)
+
+
+def _select_core(invariants, fraction, weights):
+    # Mask of the particles with the smallest invariants that together hold `fraction` of the beam
+    npoints = invariants.shape[0]
+    core = np.zeros(npoints, dtype=bool)
+    if weights is None:
+        keep = max(int(np.ceil(fraction * npoints)), 1)
+        if keep >= npoints:
+            core[:] = True
+        else:
+            core[np.argpartition(invariants, keep - 1)[:keep]] = True
+        return core
+
+    # A weighted fraction needs the cumulative weight in order of amplitude, so this path sorts
+    order = np.argsort(invariants)
+    cumulative = np.cumsum(weights[order])
+    keep = np.searchsorted(cumulative, fraction * cumulative[-1]) + 1
+    core[order[:keep]] = True
+    return core
+
+
+def calc_core_twiss2d(array6D, plane, fraction, weights=None, max_iterations=None):
+    """
+    RMS Twiss parameters of the `fraction` of the beam with the smallest invariants in one plane.
+
+    The invariants depend on the Twiss parameters of the core being selected, so the selection is refit until it
+    no longer changes. Each refit removes the particles that left the core from a MomentAccumulator6D and adds the
+    ones that joined it, so only the changes are reduced, never the whole core. A UserWarning is issued if the
+    selection is still changing after `max_iterations` refits.
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        plane: (int) 0, 1 or 2 for the (0,1), (2,3) or (4,5) plane.
+        fraction: (float) Fraction of the particles (of the total weight if `weights` is given) in the core.
+        weights: (ndarray) Optional (N,) array of per-particle weights.
+        max_iterations: (int) Maximum number of refits. Defaults to `max_refit_iterations`.
+
+    Returns:
+        (float, float, float, ndarray, MomentAccumulator6D) alpha, beta and emittance of the core, the (N,) mask of
+        core particles, and the accumulator holding the moments of the core.
+    """
+    max_iterations = max_iterations or max_refit_iterations
+    accumulator = MomentAccumulator6D().add(array6D, weights)
+    core = np.ones(array6D.shape[1], dtype=bool)
+    for iteration in range(max_iterations):
+        invariants = _plane_invariants(array6D, accumulator.calc_correlations6d(), accumulator.mean, plane)
+        selected = _select_core(invariants, fraction, weights)
+        left = core & ~selected
+        joined = selected & ~core
+        if not left.any() and not joined.any():
+            break
+        accumulator.remove(array6D[:, left], None if weights is None else weights[left])
+        accumulator.add(array6D[:, joined], None if weights is None else weights[joined])
+        core = selected
+    else:
+        warnings.warn("Core of fraction {} in plane {} did not converge in {} refits; {} particles changed in the "
+                      "last one".format(fraction, plane, max_iterations, np.count_nonzero(left | joined)))
+
+    alpha, beta, emit = accumulator.calc_twiss_params6d()
+    return alpha[plane], beta[plane], emit[plane], core, accumulator
+
+
+def calc_emittance_fractions6d(array6D, fractions=(0.9, 0.95), weights=None, max_iterations=None):
+    """
+    Fractional RMS emittances: the RMS emittance, in each plane, of the given fractions of the beam with the
+    smallest Courant-Snyder invariants (see `calc_core_twiss2d`).
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        fractions: (iterable) Fractions of the beam, e.g. (0.9, 0.95) for the 90% and 95% emittances.
+        weights: (ndarray) Optional (N,) array of per-particle weights.
+        max_iterations: (int) Maximum number of refits of each core.
+
+    Returns:
+        (ndarray) Array of shape (len(fractions), 3) with the emittances of the (0,1), (2,3) and (4,5) planes.
+    """
+    emittances = np.empty((len(fractions), 3))
+    for n, fraction in enumerate(fractions):
+        for plane in range(3):
+            emittances[n, plane] = calc_core_twiss2d(array6D, plane, fraction, weights, max_iterations)[2]
+
+    return emittances
+
+
+def calc_core_emittance6d(array6D, core_fraction=0.05, weights=None, max_iterations=None):
+    """
+    Core emittance of each plane, defined from the peak phase space density rho_0 as 1 / (4 pi rho_0), which is
+    the limit of the fractional emittance divided by the fraction as the fraction goes to zero. For a Gaussian
+    beam it is half the RMS emittance; for a uniformly filled ellipse it is the RMS emittance.
+
+    The density is estimated from the invariant J_f enclosing `core_fraction` of the beam, measured with the Twiss
+    parameters refit on that core: core emittance = J_f / (4 core_fraction).
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        core_fraction: (float) Fraction of the beam used to estimate the peak density. Smaller values reduce the
+            bias from density variation over the core but increase the statistical error.
+        weights: (ndarray) Optional (N,) array of per-particle weights.
+        max_iterations: (int) Maximum number of refits of each core.
+
+    Returns:
+        (ndarray) Core emittances of the (0,1), (2,3) and (4,5) planes.
+    """
+    core_emittance = np.empty(3)
+    for plane in range(3):
+        core, accumulator = calc_core_twiss2d(array6D, plane, core_fraction, weights, max_iterations)[3:]
+        invariants = _plane_invariants(array6D[:, core], accumulator.calc_correlations6d(), accumulator.mean, plane)
+        core_emittance[plane] = np.max(invariants) / (4. * core_fraction)
+
+    return core_emittance
@@ -0,0 +1,126 @@
+import mmap
+import numpy as np
+from multiprocessing import shared_memory
+from pathos.multiprocessing import Pool, cpu_count
+from rsbeams.rsstats.accumulator import MomentAccumulator6D
+
+# Each worker's share of the particles is split into this many tasks, to even out the load
+tasks_per_worker = 4
+
+
+def _mapped_file(array6D):
+    # The file backing a memmap that workers can map again themselves: only the original mapping or its
+    # transpose qualify, since views into it do not record where they start in the file.
+    if isinstance(array6D, np.memmap) and isinstance(array6D.base, mmap.mmap):
+        return array6D.filename, array6D.offset, array6D.shape, array6D.dtype.str, 'C'
+    if isinstance(array6D.base, np.memmap) and isinstance(array6D.base.base, mmap.mmap) \
+            and array6D.base.flags.c_contiguous and array6D.shape == array6D.base.shape[::-1] \
+            and array6D.strides == array6D.base.strides[::-1]:
+        base = array6D.base
+        return base.filename, base.offset, array6D.shape, array6D.dtype.str, 'F'
+    return None
+
+
+def share_array(array):
+    """
+    Make an array available to worker processes without pickling it. A memmap (or the transpose of one) is passed
+    as its file, which the workers map again themselves; any other array is copied once into a shared memory block.
+
+    Args:
+        array: (ndarray) Array to share.
+
+    Returns:
+        (tuple, SharedMemory) A picklable source to pass to the workers, for `attach_array`, and the shared memory
+        block created for the array (None for a memmap), to be freed with `release_array` once the workers finish.
+    """
+    mapped = _mapped_file(array)
+    if mapped is not None:
+        return ('memmap', mapped), None
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    del shared
+    return ('shm', (shm.name, array.shape, array.dtype.str)), shm
+
+
+def release_array(shm):
+    """Free a shared memory block created by `share_array`. Does nothing for None."""
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+
+
+def attach_array(source):
+    """
+    Access an array shared with `share_array`, in a worker process.
+
+    Args:
+        source: Source returned by `share_array`.
+
+    Returns:
+        (ndarray, SharedMemory) The array, and the shared memory block it lives in (None for a memmap), which the
+        worker closes once it no longer uses the array.
+    """
+    kind, location = source
+    if kind == 'memmap':
+        file_name, offset, shape, dtype, order = location
+        return np.memmap(file_name, dtype=dtype, mode='r', offset=offset, shape=shape, order=order), None
+    name, shape, dtype = location
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+def _reduce_range(task):
+    # Runs in the worker: attach to the particle data and reduce columns [start, stop)
+    source, start, stop = task
+    array6D, shm = attach_array(source)
+    try:
+        return MomentAccumulator6D().add(array6D[:, start:stop])
+    finally:
+        del array6D
+        if shm is not None:
+            shm.close()
+
+
+def calc_moments6d(array6D, workers=None):
+    """
+    Moments of a 6D distribution reduced in parallel over the particle axis.
+
+    Workers never receive particle data through pickling. If `array6D` is an `np.memmap` (or the transpose of one,
+    e.g. an (N, 6) file viewed as (6, N)) each worker maps the file itself; any other array is copied once into a
+    shared memory block that the workers attach to. Each worker reduces its columns with MomentAccumulator6D and
+    the partial results are merged.
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        workers: (int) Number of processes. Defaults to `cpu_count`. With 1 the reduction runs in this process.
+
+    Returns:
+        (MomentAccumulator6D) with the moments of all N particles.
+    """
+    workers = workers or cpu_count()
+    npoints = array6D.shape[1]
+    if workers == 1 or npoints == 0:
+        return MomentAccumulator6D().add(array6D)
+
+    source, shm = share_array(array6D)
+    bounds = np.linspace(0, npoints, workers * tasks_per_worker + 1).astype(int)
+    tasks = [(source, start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+    pool = Pool(workers)
+    try:
+        partials = pool.map(_reduce_range, tasks)
+    finally:
+        pool.close()
+        pool.join()
+        release_array(shm)
+
+    result = MomentAccumulator6D()
+    for partial in partials:
+        result.merge(partial)
+
+    return result
+
+
+def calc_correlations6d(array6D, workers=None):
+    """Parallel equivalent of stats6d.calc_correlations6d. See calc_moments6d."""
+    return calc_moments6d(array6D, workers=workers).calc_correlations6d()
@@ -0,0 +1,181 @@
+import numpy as np
+from collections import namedtuple
+from pathos.multiprocessing import Pool, cpu_count
+from rsbeams.rsstats import stats6d
+from rsbeams.rsstats.accumulator import MomentAccumulator6D
+from rsbeams.rsstats.parallel import share_array, release_array, attach_array
+from rsbeams.rsstats.slices import calc_slice_correlations6d
+
+# Statistics estimated by the resampling functions. Each field has any leading axes of the input followed by
+#  6 values (avg, rms) or 3 values, one per plane (alpha, beta, emit).
+BeamStatistics = namedtuple('BeamStatistics', ['avg', 'rms', 'alpha', 'beta', 'emit'])
+
+# Resample counts are built as (resamples, N) int32 matrices with at most this many elements
+max_counts_size = 2**22
+
+
+def calc_statistics6d(avg6d, sigma6D):
+    """
+    BeamStatistics from averages and correlation matrices. Works on a single beam, (6,) and (6, 6), or on a stack
+    of them, (..., 6) and (..., 6, 6).
+    """
+    sigma = np.moveaxis(sigma6D, (-2, -1), (0, 1))
+    with np.errstate(invalid='ignore'):
+        alpha, beta, emit = stats6d.calc_twiss_params6d(sigma)
+    rms = np.sqrt(np.diagonal(sigma6D, axis1=-2, axis2=-1))
+    return BeamStatistics(np.asarray(avg6d), rms, np.moveaxis(alpha, 0, -1), np.moveaxis(beta, 0, -1),
+                          np.moveaxis(emit, 0, -1))
+
+
+def calc_resampled_moments6d(array6D, counts, weights=None):
+    """
+    Averages and correlation matrices of many resampled beams at once, without building any of them. Resample b
+    holds particle n counts[b, n] times, so all the moments come from one matrix product of the counts with the
+    per-particle first and second moments, taken in particle batches of stats6d.batch_size.
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        counts: (ndarray) (B, N) array with the number of times each particle appears in each resample.
+        weights: (ndarray) Optional (N,) array of per-particle weights, multiplied with the counts.
+
+    Returns:
+        (ndarray, ndarray) Averages, shape (B, 6), and correlation matrices, shape (B, 6, 6).
+    """
+    npoints = array6D.shape[1]
+    upper = np.triu_indices(6)
+    # Moments are taken about the full beam average to avoid cancellation in the variances
+    center = stats6d.calc_avg6d(array6D, weights)
+    sums = np.zeros((counts.shape[0], 1 + 6 + upper[0].shape[0]))
+    for nStart in range(0, npoints, stats6d.batch_size):
+        centered = array6D[:, nStart:nStart+stats6d.batch_size] - center[:, np.newaxis]
+        moments = np.vstack([np.ones((1, centered.shape[1])), centered, centered[upper[0]] * centered[upper[1]]])
+        batch_counts = counts[:, nStart:nStart+stats6d.batch_size]
+        if weights is not None:
+            batch_counts = batch_counts * weights[nStart:nStart+stats6d.batch_size]
+        sums += batch_counts @ moments.T
+
+    weight_sum = sums[:, :1]
+    offset = sums[:, 1:7] / weight_sum
+    sigma = np.empty((counts.shape[0], 6, 6))
+    sigma[:, upper[0], upper[1]] = sums[:, 7:] / weight_sum
+    sigma[:, upper[1], upper[0]] = sigma[:, upper[0], upper[1]]
+    sigma -= offset[:, :, np.newaxis] * offset[:, np.newaxis, :]
+
+    return center + offset, sigma
+
+
+def _bootstrap_counts(rng, n_resamples, npoints):
+    # Each resample draws N indices with replacement, turned into per-particle counts one resample at a time so
+    # the indices never take more than N elements
+    counts = np.empty((n_resamples, npoints), dtype=np.int32)
+    for b in range(n_resamples):
+        counts[b] = np.bincount(rng.integers(0, npoints, size=npoints), minlength=npoints)
+    return counts
+
+
+def _bootstrap_batch(task):
+    # Runs in the worker, or in this process for a single worker
+    source, weights_source, seed, n_resamples = task
+    array6D, shm = attach_array(source) if isinstance(source, tuple) else (source, None)
+    weights, weights_shm = attach_array(weights_source) if isinstance(weights_source, tuple) \
+        else (weights_source, None)
+    try:
+        counts = _bootstrap_counts(np.random.default_rng(seed), n_resamples, array6D.shape[1])
+        return calc_resampled_moments6d(array6D, counts, weights)
+    finally:
+        del array6D, weights
+        for block in [shm, weights_shm]:
+            if block is not None:
+                block.close()
+
+
+def bootstrap6d(array6D, n_resamples=200, weights=None, seed=None, workers=None):
+    """
+    Bootstrap uncertainties of the stats6d statistics: average, RMS, and the alpha, beta and emittance of each
+    plane.
+
+    Resamples are drawn in batches of at most `max_counts_size` // N. Batch k always uses the k-th child of
+    `np.random.SeedSequence(seed)`, so results for a given seed are identical for any number of workers. Batches run
+    on a pathos Pool; the particle data reaches the workers through shared memory or their own mapping of a memmap
+    file (see rsstats.parallel).
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        n_resamples: (int) Number of bootstrap resamples.
+        weights: (ndarray) Optional (N,) array of per-particle weights.
+        seed: Seed for np.random.SeedSequence. Defaults to fresh entropy.
+        workers: (int) Number of processes. Defaults to `cpu_count`. With 1 the resamples run in this process.
+
+    Returns:
+        (BeamStatistics, BeamStatistics, BeamStatistics) Estimates from the full beam, their standard errors, and
+        the statistics of every resample (with a leading axis of length `n_resamples`).
+    """
+    npoints = array6D.shape[1]
+    per_batch = max(1, min(n_resamples, max_counts_size // npoints))
+    sizes = [min(per_batch, n_resamples - start) for start in range(0, n_resamples, per_batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    workers = workers or cpu_count()
+    if workers == 1:
+        batches = [_bootstrap_batch((array6D, weights, seed, size)) for seed, size in zip(seeds, sizes)]
+    else:
+        source, shm = share_array(array6D)
+        weights_source, weights_shm = (None, None) if weights is None else share_array(weights)
+        pool = Pool(workers)
+        try:
+            batches = pool.map(_bootstrap_batch, [(source, weights_source, seed, size)
+                                                  for seed, size in zip(seeds, sizes)])
+        finally:
+            pool.close()
+            pool.join()
+            release_array(shm)
+            release_array(weights_shm)
+
+    samples = calc_statistics6d(np.concatenate([avg for avg, sigma in batches]),
+                                np.concatenate([sigma for avg, sigma in batches]))
+    estimate = calc_statistics6d(stats6d.calc_avg6d(array6D, weights), stats6d.calc_correlations6d(array6D, weights))
+    error = BeamStatistics(*[np.std(values, axis=0) for values in samples])
+
+    return estimate, error, samples
+
+
+def jackknife6d(array6D, n_blocks=20, weights=None, seed=None):
+    """
+    Delete-a-group jackknife uncertainties of the stats6d statistics. Particles are assigned to `n_blocks` groups
+    at random; the moments of every group come from one segmented reduction, and the moments with each group left
+    out are the full-beam moments with that group's subtracted (MomentAccumulator6D.subtract), so the beam is
+    reduced only once.
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        n_blocks: (int) Number of groups.
+        weights: (ndarray) Optional (N,) array of per-particle weights.
+        seed: Seed for the random assignment of particles to groups.
+
+    Returns:
+        (BeamStatistics, BeamStatistics) Estimates from the full beam and their standard errors.
+    """
+    npoints = array6D.shape[1]
+    index = np.random.default_rng(seed).permutation(npoints) % n_blocks
+    count, weight, avg, sigma = calc_slice_correlations6d(array6D, index, n_blocks, weights=weights)
+
+    blocks = []
+    for n in range(n_blocks):
+        block = MomentAccumulator6D()
+        block.count = count[n]
+        block.weight_sum = weight[n]
+        block.mean = avg[n]
+        block.comoments = sigma[n] * weight[n]
+        blocks.append(block)
+    total = MomentAccumulator6D()
+    for block in blocks:
+        total.merge(block)
+
+    left_out = [MomentAccumulator6D().merge(total).subtract(block) for block in blocks]
+    samples = calc_statistics6d(np.array([acc.calc_avg6d() for acc in left_out]),
+                                np.array([acc.calc_correlations6d() for acc in left_out]))
+    estimate = calc_statistics6d(total.calc_avg6d(), total.calc_correlations6d())
+    error = BeamStatistics(*[np.sqrt((n_blocks - 1) / n_blocks * np.sum((values - np.mean(values, axis=0))**2, axis=0))
+                             for values in samples])
+
+    return estimate, error
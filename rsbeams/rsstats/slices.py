@@ -0,0 +1,177 @@
+import numpy as np
+from rsbeams.rsstats import stats6d
+
+# Default names for the coordinates of a (6, N) array and its planes, used for the fields of `slice_moments`
+slice_coordinates = ['x', 'xp', 'y', 'yp', 'z', 'delta']
+slice_planes = ['x', 'y', 'z']
+
+
+def slice_index6d(array6D, n_slices, method='width', coordinate=4, weights=None):
+    """
+    Assign every particle to a longitudinal slice.
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        n_slices: (int) Number of slices.
+        method: (str) 'width' for slices of equal width between the minimum and maximum of `coordinate`, or
+            'population' for slices holding an equal number of particles (equal total weight if `weights` is given).
+        coordinate: (int) Row of `array6D` to slice along. Defaults to 4, the longitudinal position.
+        weights: (ndarray) Optional (N,) array of per-particle weights.
+
+    Returns:
+        (ndarray, ndarray) Slice index of each particle, shape (N,), and the slice edges, shape (n_slices + 1,).
+    """
+    z = array6D[coordinate]
+    if method == 'width':
+        edges = np.linspace(np.min(z), np.max(z), n_slices + 1)
+        width = edges[-1] - edges[0]
+        if width > 0.:
+            index = ((z - edges[0]) * (n_slices / width)).astype(np.intp)
+            # Particles at the maximum belong to the last slice
+            np.minimum(index, n_slices - 1, out=index)
+        else:
+            index = np.zeros(z.shape[0], dtype=np.intp)
+        return index, edges
+
+    if method == 'population':
+        order = np.argsort(z, kind='stable')
+        if weights is None:
+            sorted_index = np.arange(z.shape[0]) * n_slices // z.shape[0]
+        else:
+            sorted_weights = weights[order]
+            preceding = np.cumsum(sorted_weights) - sorted_weights
+            sorted_index = np.floor(preceding * (n_slices / np.sum(weights))).astype(np.intp)
+            np.minimum(sorted_index, n_slices - 1, out=sorted_index)
+        index = np.empty_like(sorted_index)
+        index[order] = sorted_index
+        # Each slice starts at its first particle; empty slices collapse onto the next edge
+        z_sorted = z[order]
+        starts = np.searchsorted(sorted_index, np.arange(n_slices))
+        edges = np.append(z_sorted[np.minimum(starts, z.shape[0] - 1)], z_sorted[-1])
+        return index, edges
+
+    raise ValueError("method must be 'width' or 'population', not {}".format(method))
+
+
+def calc_slice_correlations6d(array6D, index, n_slices, weights=None):
+    """
+    Per-slice averages and correlation matrices, computed for all slices at once with segmented reductions
+    (`np.bincount` over the slice index, in particle batches) rather than a loop over slice masks. Definitions match
+    stats6d.calc_avg6d and stats6d.calc_correlations6d applied to the particles of each slice.
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates.
+        index: (ndarray) (N,) slice index of each particle, e.g. from `slice_index6d`.
+        n_slices: (int) Number of slices.
+        weights: (ndarray) Optional (N,) array of per-particle weights.
+
+    Returns:
+        (ndarray, ndarray, ndarray, ndarray) Particle count and total weight of each slice, shape (n_slices,);
+        averages, shape (n_slices, 6); and correlation matrices, shape (n_slices, 6, 6). Moments of empty slices
+        are nan.
+    """
+    npoints = array6D.shape[1]
+    count = np.bincount(index, minlength=n_slices)
+    weight = count.astype(float) if weights is None else np.bincount(index, weights=weights, minlength=n_slices)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        inv_weight = 1. / weight
+
+    # Sums are taken in particle batches of stats6d.batch_size, so the temporaries stay small for large N
+    avg = np.zeros((n_slices, 6))
+    for nStart in range(0, npoints, stats6d.batch_size):
+        batch = array6D[:, nStart:nStart+stats6d.batch_size]
+        batch_index = index[nStart:nStart+stats6d.batch_size]
+        if weights is not None:
+            batch = batch * weights[nStart:nStart+stats6d.batch_size]
+        for i in range(6):
+            avg[:, i] += np.bincount(batch_index, weights=batch[i], minlength=n_slices)
+    # Empty slices are 0 * inf = nan
+    with np.errstate(invalid='ignore'):
+        avg *= inv_weight[:, np.newaxis]
+
+    # Second moments about the slice averages, so offset beams do not lose precision
+    upper = np.triu_indices(6)
+    sums = np.zeros((n_slices, upper[0].shape[0]))
+    for nStart in range(0, npoints, stats6d.batch_size):
+        batch_index = index[nStart:nStart+stats6d.batch_size]
+        centered = array6D[:, nStart:nStart+stats6d.batch_size] - avg[batch_index].T
+        weighted = centered if weights is None else centered * weights[nStart:nStart+stats6d.batch_size]
+        for k, (i, j) in enumerate(zip(*upper)):
+            sums[:, k] += np.bincount(batch_index, weights=weighted[i] * centered[j], minlength=n_slices)
+    sigma = np.empty((n_slices, 6, 6))
+    with np.errstate(invalid='ignore'):
+        sigma[:, upper[0], upper[1]] = sums * inv_weight[:, np.newaxis]
+    sigma[:, upper[1], upper[0]] = sigma[:, upper[0], upper[1]]
+
+    return count, weight, avg, sigma
+
+
+def _slice_dtype(coordinates, planes):
+    fields = [('slice', np.int64), ('z_min', np.float64), ('z_max', np.float64), ('Particles', np.int64),
+              ('weight', np.float64), ('charge', np.float64), ('current', np.float64)]
+    for coord in coordinates:
+        fields += [(coord + '_avg', np.float64), (coord + '_rms', np.float64)]
+    for plane in planes:
+        fields += [('emit_' + plane, np.float64), ('beta_' + plane, np.float64), ('alpha_' + plane, np.float64)]
+
+    return np.dtype(fields)
+
+
+def slice_moments(array6D, n_slices, method='width', coordinate=4, weights=None, total_charge=None,
+                  time_scale=1., coordinates=None):
+    """
+    Slice analysis along the bunch: the particles are binned once and every slice moment is reduced in a single
+    vectorized pass (see `slice_index6d` and `calc_slice_correlations6d`).
+
+    Slice energy spread is `delta_rms` when the last row of `array6D` is the relative momentum deviation. The
+    current is the slice charge divided by the slice duration, (z_max - z_min) * `time_scale`.
+
+    Args:
+        array6D: (ndarray) (6, N) array of particle coordinates, in the stats6d layout.
+        n_slices: (int) Number of slices.
+        method: (str) 'width' for equal-width slices or 'population' for equal-population slices.
+        coordinate: (int) Row of `array6D` to slice along. Defaults to 4.
+        weights: (ndarray) Optional (N,) array of per-particle weights.
+        total_charge: (float) Optional bunch charge in C, shared between slices in proportion to their weight.
+            The charge and current fields are nan without it.
+        time_scale: (float) Factor converting the slice coordinate to seconds, e.g. 1 / c for ct in m.
+            Defaults to 1, for t in s.
+        coordinates: (list) Optional names of the six rows, used for the field names. Defaults to
+            `slice_coordinates`.
+
+    Returns:
+        (ndarray) Structured array with one row per slice. Fields are slice, z_min, z_max, Particles, weight,
+        charge, current, <coord>_avg and <coord>_rms for each coordinate, and emit_<plane>, beta_<plane> and
+        alpha_<plane> for planes x, y and z.
+    """
+    coordinates = coordinates or slice_coordinates
+    index, edges = slice_index6d(array6D, n_slices, method=method, coordinate=coordinate, weights=weights)
+    count, weight, avg, sigma = calc_slice_correlations6d(array6D, index, n_slices, weights=weights)
+
+    table = np.zeros(n_slices, dtype=_slice_dtype(coordinates, slice_planes))
+    table['slice'] = np.arange(n_slices)
+    table['z_min'] = edges[:-1]
+    table['z_max'] = edges[1:]
+    table['Particles'] = count
+    table['weight'] = weight
+    if total_charge is None:
+        table['charge'] = np.nan
+        table['current'] = np.nan
+    else:
+        table['charge'] = total_charge * weight / np.sum(weight)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table['current'] = table['charge'] / (np.diff(edges) * time_scale)
+
+    rms = np.sqrt(np.diagonal(sigma, axis1=1, axis2=2))
+    for i, coord in enumerate(coordinates):
+        table[coord + '_avg'] = avg[:, i]
+        table[coord + '_rms'] = rms[:, i]
+    # calc_twiss_params6d indexes the first two axes, so all slices are handled at once
+    with np.errstate(invalid='ignore'):
+        alpha, beta, emit = stats6d.calc_twiss_params6d(sigma.transpose(1, 2, 0))
+    for i, plane in enumerate(slice_planes):
+        table['emit_' + plane] = emit[i]
+        table['beta_' + plane] = beta[i]
+        table['alpha_' + plane] = alpha[i]
+
+    return table
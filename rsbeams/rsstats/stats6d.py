@@ -12,160 +12,110 @@ Subsequent mods are due to RadiaSoft,
 from __future__ import absolute_import, division, print_function, unicode_literals
 import math
 import numpy
-import scipy
 
-def calc_avg6d(array6D):
-    return scipy.average(array6D, axis=1)
+# Number of particles reduced at a time, so temporaries stay small for large distributions
+batch_size = 2**16
 
-def sub_avg6d(array6D):
-    avg6d = calc_avg6d(array6D)
-    for nLoop in range(6):
-        array6D[nLoop,:] -= avg6d[nLoop]
+# All functions taking `weights` accept an optional (N,) array of per-particle (macroparticle) weights.
+#  Weighted moments are normalized by the sum of the weights, so integer weights give the same result as
+#  repeating each particle that many times, without ever building the expanded array.
 
-def calc_variance6d(array6D):
+def calc_weight_sum(array6D, weights=None):
+    if weights is None:
+        return array6D.shape[1]
+    return numpy.sum(weights)
+
+def calc_avg6d(array6D, weights=None):
+    if weights is None:
+        return numpy.mean(array6D, axis=1)
+    # A matrix-vector product, without the (6, N) weighted temporary of numpy.average
+    return array6D @ weights / numpy.sum(weights)
+
+def sub_avg6d(array6D, weights=None):
+    avg6d = calc_avg6d(array6D, weights)
+    array6D -= avg6d[:, numpy.newaxis]
+
+def calc_comoments6d(array6D, avg6d, weights=None):
+    """Co-moment matrix: the (weighted) sum over particles of (q - avg6d)(q - avg6d)^T, accumulated batch by batch
+    with BLAS."""
     npoints = array6D.shape[1]
-    avgIter = array6D[:,0]
-    varIter = scipy.zeros(6)
-    for nLoop in range(1,npoints):
-        tmpData  = array6D[:,nLoop]
-        tmpIter  = (tmpData - avgIter)
-        avgIter += (tmpData - avgIter) / (nLoop+1)
-        varIter += (tmpData - avgIter) * tmpIter
-    return varIter / npoints
-
-def calc_rms6d(array6D):
-    return scipy.sqrt(calc_variance6d(array6D))
-
-def normalize_rms6d(array6D):
-    invRmsValues6D = 1. / calc_rms6d(array6D)
-    for nLoop in range(6):
-        array6D[nLoop,:] *= invRmsValues6D[nLoop]
-
-def calc_min6d(array6D):
-    return numpy.min(array6D, axis=1)
-
-def calc_max6d(array6D):
-    return numpy.max(array6D, axis=1)
-
-def calc_correlations6d(array6D):
+    products = numpy.zeros((6,6))
+    for nStart in range(0, npoints, batch_size):
+        centered = array6D[:, nStart:nStart+batch_size] - avg6d[:, numpy.newaxis]
+        if weights is None:
+            products += centered @ centered.T
+        else:
+            products += (centered * weights[nStart:nStart+batch_size]) @ centered.T
+    return products
+
+def calc_variance6d(array6D, weights=None):
     npoints = array6D.shape[1]
-    avg6d = calc_avg6d(array6D)
-    variance6D = calc_variance6d(array6D)
-    correlations6D = scipy.zeros(6*6).reshape(6,6)
-    for iLoop in range(6):
-        for jLoop in range(6):
-            if iLoop == jLoop:
-                correlations6D[iLoop, jLoop] = variance6D[iLoop]
-            else:
-                for nLoop in range(npoints):
-                    correlations6D[iLoop, jLoop] += \
-                        (array6D[iLoop,nLoop] - avg6d[iLoop]) * \
-                        (array6D[jLoop,nLoop] - avg6d[jLoop])
-                correlations6D[iLoop, jLoop] /= npoints
-    return correlations6D
-
-def rm_correlations6d(array6D):
+    avg6d = calc_avg6d(array6D, weights)
+    varValues = numpy.zeros(6)
+    for nStart in range(0, npoints, batch_size):
+        centered = array6D[:, nStart:nStart+batch_size] - avg6d[:, numpy.newaxis]
+        if weights is None:
+            varValues += numpy.einsum('ij,ij->i', centered, centered)
+        else:
+            varValues += numpy.einsum('ij,ij,j->i', centered, centered, weights[nStart:nStart+batch_size])
+    return varValues / calc_weight_sum(array6D, weights)
+
+def calc_rms6d(array6D, weights=None):
+    return numpy.sqrt(calc_variance6d(array6D, weights))
+
+def normalize_rms6d(array6D, weights=None):
+    invRmsValues6D = 1. / calc_rms6d(array6D, weights)
+    array6D *= invRmsValues6D[:, numpy.newaxis]
+
+def calc_min6d(array6D, weights=None):
+    # Particles with zero weight are ignored
+    if weights is None:
+        return numpy.min(array6D, axis=1)
+    return numpy.min(array6D, axis=1, where=weights != 0., initial=numpy.inf)
+
+def calc_max6d(array6D, weights=None):
+    if weights is None:
+        return numpy.max(array6D, axis=1)
+    return numpy.max(array6D, axis=1, where=weights != 0., initial=-numpy.inf)
+
+def calc_correlations6d(array6D, weights=None):
+    avg6d = calc_avg6d(array6D, weights)
+    correlations6D = calc_comoments6d(array6D, avg6d, weights) / calc_weight_sum(array6D, weights)
+    # The batched BLAS product is not guaranteed to be exactly symmetric
+    return 0.5 * (correlations6D + correlations6D.T)
+
+def calc_twiss_params6d(sigma6D):
+    """RMS alpha, beta and emittance of the (0,1), (2,3) and (4,5) planes of a 6x6 correlation matrix.
+    Planes with a non-positive emittance squared are returned as nan."""
+    ii = numpy.arange(0, 6, 2)
+    emitSQ = sigma6D[ii,ii]*sigma6D[ii+1,ii+1] - sigma6D[ii,ii+1]*sigma6D[ii+1,ii]
+    emit = numpy.sqrt(numpy.where(emitSQ > 0., emitSQ, numpy.nan))
+    beta = sigma6D[ii,ii] / emit
+    alpha = -sigma6D[ii,ii+1] / emit
+    return alpha, beta, emit
+
+def calc_emittance6d(array6D, weights=None):
+    """RMS emittances of the (0,1), (2,3) and (4,5) planes."""
+    return calc_twiss_params6d(calc_correlations6d(array6D, weights))[2]
+
+def rm_correlations6d(array6D, weights=None):
     npoints = array6D.shape[1]
-    sigmaM = calc_correlations6d(array6D)
+    sigmaM = calc_correlations6d(array6D, weights)
     eigVals, eigVecs = jacobi_eigen_solver6d(sigmaM)
 
     verboseCheck = 0
     if verboseCheck == 1:
         print('eigVals = ', eigVals)
 
-    temp6D = array6D.copy()
-    for iLoop in range(6):
-        for nLoop in range(npoints): array6D[iLoop,nLoop] = 0.0
-
-    for iLoop in range(6):
-        for jLoop in range(6):
-            for nLoop in range(npoints):
-                array6D[iLoop,nLoop] += eigVecs[jLoop,iLoop] * temp6D[jLoop,nLoop]
+    # Rotate onto the eigenvectors of the correlation matrix, in place
+    for nStart in range(0, npoints, batch_size):
+        array6D[:, nStart:nStart+batch_size] = eigVecs.T @ array6D[:, nStart:nStart+batch_size]
 
 def jacobi_eigen_solver6d(sigma6D):
-    # Setup
-    eVecs=scipy.zeros(36).reshape(6,6)
-    for ip in range(6): eVecs[ip,ip]=1.0
-
-    bTemp=scipy.zeros(6)
-    zTemp=scipy.zeros(6)
-    eVals=scipy.zeros(6)
-    for ip in range(6):
-        bTemp[ip]=sigma6D[ip,ip]
-        eVals[ip]=sigma6D[ip,ip]
-
-    # Top of the master loop
-    numRotations = 0
-    for nMaster in range(50):
-        sm = 0.0
-        for ip in range(5):
-            for iq in range(ip+1,6):
-                sm += math.fabs(sigma6D[ip,iq])
-
-        # Check for convergence
-        if sm == 0.0:
-            return eVals, eVecs   # Success!
-
-        # Convergence failed, so reset threshold
-        if nMaster<3:
-            threshold=0.2*sm/36.
-        else:
-            threshold=0.0
-
-        # Next iteration
-        for ip in range(5):
-            for iq in range(ip+1,6):
-                gScal=100.*math.fabs(sigma6D[ip,iq])
-                if nMaster>3 and math.fabs(float(eVals[ip])+gScal)==math.fabs(eVals[ip]) \
-                             and math.fabs(float(eVals[iq])+gScal)==math.fabs(eVals[iq]):
-                    sigma6D[ip,iq]=0.0
-                elif math.fabs(sigma6D[ip,iq])>threshold:
-                    hScal=float(eVals[iq])-float(eVals[ip])
-                    if math.fabs(hScal)+gScal==math.fabs(hScal):
-                        tScal=float(sigma6D[ip,iq])/hScal
-                    else:
-                        theta=0.5*hScal/float(sigma6D[ip,iq])
-                        tScal=1.0/(math.fabs(theta)+math.sqrt(1.0+theta**2))
-                        if theta<0.: tScal*=-1.0
-                    cTemp=1.0/math.sqrt(1.0+tScal**2)
-                    sTemp=tScal*cTemp
-                    tau=sTemp/(1.0+cTemp)
-                    hScal=tScal*float(sigma6D[ip,iq])
-                    zTemp[ip]-=hScal
-                    zTemp[iq]+=hScal
-                    eVals[ip]-=hScal
-                    eVals[iq]+=hScal
-                    sigma6D[ip,iq]=0.0
-                    for jLoop in range(ip):
-                        gScal=sigma6D[jLoop,ip]
-                        hScal=sigma6D[jLoop,iq]
-                        sigma6D[jLoop,ip]=gScal-sTemp*(hScal+gScal*tau)
-                        sigma6D[jLoop,iq]=hScal+sTemp*(gScal-hScal*tau)
-                    for jLoop in range(ip+1,iq):
-                        gScal=sigma6D[ip,jLoop]
-                        hScal=sigma6D[jLoop,iq]
-                        sigma6D[ip,jLoop]=gScal-sTemp*(hScal+gScal*tau)
-                        sigma6D[jLoop,iq]=hScal+sTemp*(gScal-hScal*tau)
-                    for jLoop in range(iq+1,6):
-                        gScal=sigma6D[ip,jLoop]
-                        hScal=sigma6D[iq,jLoop]
-                        sigma6D[ip,jLoop]=gScal-sTemp*(hScal+gScal*tau)
-                        sigma6D[iq,jLoop]=hScal+sTemp*(gScal-hScal*tau)
-                    for jLoop in range(6):
-                        gScal=eVecs[jLoop,ip]
-                        hScal=eVecs[jLoop,iq]
-                        eVecs[jLoop,ip]=gScal-sTemp*(hScal+gScal*tau)
-                        eVecs[jLoop,iq]=hScal+sTemp*(gScal-hScal*tau)
-                    numRotations+=1
-
-        # Collect results before checking again for convergence
-        for ip in range(6):
-            bTemp[ip]+=zTemp[ip]
-            eVals[ip] =bTemp[ip]
-            zTemp[ip] =0.0
-
-    # No convergence after 50 iterations, so give up!
-    raise Exception("Too many iterations in routine jacobi_eigen_solver6d")
+    """Eigenvalues and eigenvectors (as columns) of a symmetric 6x6 matrix.
+    Solved with LAPACK; the name is kept from the original Jacobi rotation implementation."""
+    eVals, eVecs = numpy.linalg.eigh(sigma6D)
+    return eVals, eVecs
 
 def specify_significant_figures(float_value, num_sig_figs):
     """Round float_value to num_sig_figs significant figures."""
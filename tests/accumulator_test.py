@@ -0,0 +1,62 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import pytest
+import numpy
+from rsbeams.rsstats import stats6d
+from rsbeams.rsstats.accumulator import MomentAccumulator6D
+
+
+def test_accumulator_merge():
+    array_6d = numpy.random.normal(0., 1., (6, 10000))
+    array_6d[1,:] += 0.5 * array_6d[0,:]
+    array_6d[0,:] += 1.e4
+
+    # chunks of uneven size, reduced by two independent accumulators and merged
+    acc_a = MomentAccumulator6D()
+    acc_b = MomentAccumulator6D()
+    for start, stop in [(0, 17), (17, 4000), (4000, 4000)]:
+        acc_a.add(array_6d[:, start:stop])
+    acc_b.add(array_6d[:, 4000:7000]).add(array_6d[:, 7000:])
+    acc = MomentAccumulator6D().merge(acc_a).merge(acc_b)
+
+    assert acc.count == 10000
+    assert numpy.allclose(acc.calc_avg6d(), stats6d.calc_avg6d(array_6d))
+    assert numpy.allclose(acc.calc_correlations6d(), stats6d.calc_correlations6d(array_6d))
+    assert numpy.allclose(acc.calc_rms6d(), stats6d.calc_rms6d(array_6d))
+    assert numpy.all(acc.calc_min6d() == stats6d.calc_min6d(array_6d))
+    assert numpy.all(acc.calc_max6d() == stats6d.calc_max6d(array_6d))
+
+    twiss6d = acc.calc_twiss6d({})
+    alpha, beta, emit = stats6d.calc_twiss_params6d(stats6d.calc_correlations6d(array_6d))
+    assert twiss6d['twiss_x'].get_emit_rms() == pytest.approx(emit[0])
+    assert twiss6d['twiss_x'].get_alpha_rms() == pytest.approx(alpha[0])
+    assert twiss6d['twiss_y'].get_beta_rms() == pytest.approx(beta[1])
+
+
+def test_parallel_moments(tmpdir):
+    from rsbeams.rsstats import parallel
+
+    array_6d = numpy.random.normal(0., 1., (6, 5000))
+    expected = stats6d.calc_correlations6d(array_6d)
+    assert numpy.allclose(parallel.calc_correlations6d(array_6d, workers=2), expected)
+
+    # (N, 6) file, viewed in the stats6d layout
+    file_name = str(tmpdir.join('beam.dat'))
+    mapped = numpy.memmap(file_name, dtype=numpy.float64, mode='w+', shape=(5000, 6))
+    mapped[:] = array_6d.T
+    mapped.flush()
+    mapped = numpy.memmap(file_name, dtype=numpy.float64, mode='r', shape=(5000, 6))
+    assert parallel._mapped_file(mapped.T) is not None
+    acc = parallel.calc_moments6d(mapped.T, workers=2)
+    assert acc.count == 5000
+    assert numpy.allclose(acc.calc_correlations6d(), expected)
+
+
+def test_accumulator_weighted():
+    array_6d = numpy.random.normal(0., 1., (6, 3000))
+    weights = numpy.random.uniform(0., 2., 3000)
+    acc = MomentAccumulator6D().add(array_6d[:, :1000], weights[:1000]).add(array_6d[:, 1000:], weights[1000:])
+
+    assert acc.count == 3000
+    assert acc.weight_sum == pytest.approx(numpy.sum(weights))
+    assert numpy.allclose(acc.calc_avg6d(), stats6d.calc_avg6d(array_6d, weights))
+    assert numpy.allclose(acc.calc_correlations6d(), stats6d.calc_correlations6d(array_6d, weights))
@@ -0,0 +1,143 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import pytest
+import numpy
+from rsbeams.rsptcls.bunch import StandardBunch, NonlinearBunch
+
+
+def test_KV():
+    bunch = StandardBunch(40000, dist='KV', emitx=1e-6, emity=1e-6, betax=2., alphax=0.5)
+    bunch.set_transverse_coordinates()
+    coords = bunch.particles[:, :4]
+
+    # a KV beam fills the shell H = emit in normalized coordinates
+    xHat = coords[:, 0] / numpy.sqrt(bunch.betax)
+    pxHat = coords[:, 1] * numpy.sqrt(bunch.betax) + bunch.alphax * xHat
+    yHat = coords[:, 2] / numpy.sqrt(bunch.betay)
+    pyHat = coords[:, 3] * numpy.sqrt(bunch.betay) + bunch.alphay * yHat
+    assert numpy.allclose(bunch.compute_Hamiltonian(xHat, pxHat, yHat, pyHat), bunch.emit)
+    assert numpy.all(bunch.particles[:, 6] == numpy.arange(40000))
+
+    quiet = StandardBunch(40000, dist='KV', quiet=True)
+    quiet.set_transverse_coordinates()
+    assert numpy.allclose(numpy.mean(quiet.particles[:, :4], axis=0), 0., atol=1e-18)
+    assert numpy.all(quiet.particles[1::4, :4] == quiet.particles[::4, :4] * [-1, 1, -1, 1])
+
+    with pytest.raises(ValueError):
+        StandardBunch(10, dist='KV', quiet=True).set_transverse_coordinates()
+
+
+def test_nonlinear_KV():
+    bunch = NonlinearBunch(20000, dist='KV', t=0.4, c=0.01)
+    bunch.set_transverse_coordinates()
+    coords = bunch.particles[:, :4]
+    assert numpy.allclose(bunch.compute_Hamiltonian(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]),
+                          bunch.emit)
+
+
+@pytest.mark.parametrize('dist, max_H, mean_H', [('waterbag', 1., 2./3.), ('Gaussian', 4., 1.68)])
+def test_nonlinear_distributions(dist, max_H, mean_H):
+    bunch = NonlinearBunch(40000, dist=dist, t=0.4, c=0.01)
+    bunch.set_transverse_coordinates()
+    coords = bunch.particles[:, :4]
+    H = bunch.compute_Hamiltonian(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]) / bunch.emit
+    assert numpy.all(H <= max_H * (1. + 1e-12))
+    assert numpy.mean(H) == pytest.approx(mean_H, rel=0.02)
+
+    yHat = numpy.linspace(1e-4, 2e-3, 5)
+    assert numpy.allclose(bunch.compute_yMax(bunch.compute_potential(0., yHat)), yHat)
+
+
+def test_yMax_table():
+    from rsbeams.rsptcls.bunch import yMax_table
+
+    bunch = NonlinearBunch(10, t=0.4, c=0.01)
+    H = numpy.random.uniform(0., 4e-6, 1000)
+    yMax = bunch.compute_yMax(H)
+    assert numpy.allclose(bunch.compute_potential(0., yMax), H, rtol=1e-9, atol=0.)
+    assert yMax_table(0.4) is yMax_table(0.4)
+
+    # beyond the table
+    assert bunch.compute_potential(0., bunch.compute_yMax(1.)) == pytest.approx(1.)
+
+
+def test_yMax_table_cap(monkeypatch):
+    from rsbeams.rsptcls import bunch
+    monkeypatch.setattr(bunch, 'yMax_max_points', 2**10)
+
+    with pytest.warns(UserWarning, match='relative error'):
+        bunch.YMaxTable(0.49)
+
+
+def test_reproducible_workers(monkeypatch):
+    from rsbeams.rsptcls import bunch
+
+    # several random streams
+    monkeypatch.setattr(bunch, 'stream_chunk_size', 1000)
+    particles = []
+    for workers in [1, 2]:
+        nonlinear = NonlinearBunch(4800, dist='waterbag', seed=1234, workers=workers)
+        nonlinear.set_transverse_coordinates()
+        nonlinear.set_longitudinal_coordinates(stdz=1e-3, dpop=1e-4)
+        particles.append(nonlinear.particles)
+        # both streams of iter_blocks share one pool
+        streamed = NonlinearBunch(4800, dist='waterbag', seed=1234, workers=workers, allocate=False)
+        streamed.stdz, streamed.dpop = 1e-3, 1e-4
+        particles.append(numpy.concatenate(list(streamed.iter_blocks())))
+    for result in particles[1:]:
+        assert numpy.array_equal(particles[0], result)
+
+    # without a seed, the entropy drawn is kept
+    standard = StandardBunch(3000)
+    standard.set_transverse_coordinates()
+    again = StandardBunch(3000, seed=standard.seed)
+    again.set_transverse_coordinates()
+    assert numpy.array_equal(standard.particles, again.particles)
+
+
+def test_empty_bunch(tmpdir):
+    for bunch in [StandardBunch(0, dist='KV', quiet=True), NonlinearBunch(0, dist='Gaussian')]:
+        bunch.set_transverse_coordinates()
+        bunch.set_longitudinal_coordinates()
+        assert bunch.particles.shape == (0, 7)
+        assert list(bunch.iter_blocks()) == []
+    assert bunch.write_memmap(str(tmpdir.join('empty.dat'))).shape == (0, 7)
+
+
+def test_streaming(monkeypatch, tmpdir):
+    import h5py
+    from rsbeams.rsptcls import bunch
+    from rsbeams.rsdata.SDDS import readSDDS
+
+    monkeypatch.setattr(bunch, 'stream_chunk_size', 1000)
+    inMemory = NonlinearBunch(4800, dist='waterbag', seed=99, queit=True)
+    inMemory.set_transverse_coordinates()
+    inMemory.set_longitudinal_coordinates(stdz=1e-3, dpop=1e-4)
+
+    streamed = NonlinearBunch(4800, dist='waterbag', seed=99, queit=True, allocate=False)
+    streamed.stdz, streamed.dpop = 1e-3, 1e-4
+    blocks = list(streamed.iter_blocks())
+    assert [block.shape[0] for block in blocks] == [1000] * 4 + [800]
+    for block in blocks:
+        assert numpy.allclose(numpy.mean(block[:, :4], axis=0), 0., atol=1e-18)
+    assert numpy.array_equal(numpy.concatenate(blocks), inMemory.particles)
+
+    mapped = streamed.write_memmap(str(tmpdir.join('bunch.dat')))
+    assert numpy.array_equal(mapped, inMemory.particles)
+
+    streamed.write_hdf5(str(tmpdir.join('bunch.h5')))
+    with h5py.File(str(tmpdir.join('bunch.h5')), 'r') as f:
+        assert numpy.array_equal(f['particles'][()], inMemory.particles)
+
+    streamed.write_sdds(str(tmpdir.join('bunch.sdds')))
+    reader = readSDDS(str(tmpdir.join('bunch.sdds')))
+    reader.read()
+    assert numpy.array_equal(reader.columns['zp'][0], inMemory.particles[:, 5])
+
+    # regrouping blocks of any size keeps every row in order
+    rows = numpy.arange(50.)[:, numpy.newaxis]
+    chunks = list(bunch._rechunk([rows[:3], rows[3:4], rows[4:30], rows[30:30], rows[30:]], 7))
+    assert [chunk.shape[0] for chunk in chunks] == [7] * 7 + [1]
+    assert numpy.array_equal(numpy.concatenate(chunks), rows)
+
+    with pytest.raises(ValueError):
+        StandardBunch(100, dist='waterbag', allocate=False).transverse_sampler()
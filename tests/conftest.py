@@ -1,3 +1,32 @@
+import struct
+import numpy
+import pytest
+
 # This avoids a plugin dependency issue with pytest-forked/xdist:
 # https://github.com/pytest-dev/pytest/issues/935
 pytest_plugins = ['pykern.pytest_plugin']
+
+
+@pytest.fixture
+def write_multipage_sdds():
+    """
+    Writer of binary SDDS files with a long `Pass` parameter and double columns. writeSDDS only writes one page;
+    the following pages of a binary file are just the row count, parameter values and column data.
+    The returned function takes the file name, the column names and a list of (n, len(columns)) arrays, one per
+    page. Pass is numbered from 1.
+    """
+    from rsbeams.rsdata.SDDS import writeSDDS
+
+    def write(file_name, columns, pages):
+        file_out = writeSDDS()
+        file_out.create_parameter('Pass', 1, 'long')
+        for i, name in enumerate(columns):
+            file_out.create_column(name, pages[0][:, i], 'double')
+        file_out.save_sdds(file_name, dataMode='binary')
+        with open(file_name, 'ab') as f:
+            for n, block in enumerate(pages[1:]):
+                f.write(struct.pack('I', block.shape[0]))
+                f.write(struct.pack('i', n + 2))
+                numpy.ascontiguousarray(block, dtype=numpy.float64).tofile(f)
+
+    return write
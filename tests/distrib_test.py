@@ -25,3 +25,31 @@ def test_unif_sphere():
         assert(stats6d.specify_significant_figures(my_rms[i], 3) == 1.0)
 
 # test_unif_sphere()
+
+def test_gauss_truncation():
+    for my_rms_fac in [4.7, 0.2]:
+        my_distrib = RsDistrib6D.RsDistrib6D(20000, 'gaussian', my_rms_fac)
+        # the constructor rescales to unit rms; redraw to test the raw truncated sample
+        my_distrib.make_gauss_distrib()
+        my_array = my_distrib.get_phase_space_6d().get_array_6d()
+
+        # every coordinate is drawn and satisfies test_point**2 < max_rms_fac
+        assert numpy.all(my_array**2 < my_rms_fac)
+        assert numpy.count_nonzero(my_array == 0.) == 0
+        # rms of a unit Gaussian truncated at |x| < sqrt(max_rms_fac)
+        my_rms = stats6d.calc_rms6d(my_array)
+        if my_rms_fac > 1.:
+            assert numpy.all(numpy.abs(my_rms - 0.9112) < 0.02)
+        else:
+            assert numpy.all(numpy.abs(my_rms - 0.2548) < 0.005)
+
+def test_sigma_target():
+    my_distrib = RsDistrib6D.RsDistrib6D(2000, 'gaussian', 9.)
+    # coupled target: random symmetric positive-definite matrix
+    my_map = numpy.random.normal(0., 1., (6, 6))
+    my_sigma = my_map @ my_map.T + 0.1 * numpy.identity(6)
+    my_distrib.make_twiss_dist_6d(my_sigma, 1.)
+
+    # the cleaned distribution has unit covariance, so the target is reproduced exactly
+    my_corr = stats6d.calc_correlations6d(my_distrib.get_phase_space_6d().get_array_6d())
+    assert numpy.allclose(my_corr, my_sigma)
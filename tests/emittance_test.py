@@ -0,0 +1,55 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import pytest
+import numpy
+from rsbeams.rsstats import stats6d
+from rsbeams.rsstats.accumulator import MomentAccumulator6D
+from rsbeams.rsstats.emittance import calc_invariants6d, calc_emittance_fractions6d, calc_core_emittance6d, \
+    calc_core_twiss2d
+
+
+def _gaussian_beam(npoints):
+    array_6d = numpy.random.normal(0., 1., (6, npoints))
+    # correlated planes, so the invariants need the fitted alpha
+    array_6d[1,:] += 0.8 * array_6d[0,:]
+    array_6d[2,:] *= 3.
+    return array_6d
+
+
+def test_invariants():
+    array_6d = _gaussian_beam(10000)
+    sigma = stats6d.calc_correlations6d(array_6d)
+    invariants = calc_invariants6d(array_6d, sigma, stats6d.calc_avg6d(array_6d))
+    emit = stats6d.calc_twiss_params6d(sigma)[2]
+    assert numpy.allclose(numpy.mean(invariants, axis=1), 2. * emit)
+
+
+def test_emittance_fractions():
+    array_6d = _gaussian_beam(200000)
+    emit = stats6d.calc_emittance6d(array_6d)
+
+    # for a Gaussian, the RMS emittance of the fraction f with the smallest invariants is
+    #  emit * (1 + (1 - f) ln(1 - f) / f)
+    fractions = numpy.array([0.9, 0.95])
+    expected = 1. + (1. - fractions) * numpy.log(1. - fractions) / fractions
+    emit_fractions = calc_emittance_fractions6d(array_6d, fractions)
+    assert numpy.allclose(emit_fractions / emit, expected[:, numpy.newaxis], rtol=0.02)
+
+    # weights equal to one match the unweighted result
+    weighted = calc_emittance_fractions6d(array_6d[:, :20000], [0.9], weights=numpy.ones(20000))
+    assert numpy.allclose(weighted, calc_emittance_fractions6d(array_6d[:, :20000], [0.9]), rtol=1.e-3)
+
+    # half of the RMS emittance for a Gaussian
+    assert numpy.allclose(calc_core_emittance6d(array_6d) / emit, 0.5, rtol=0.06)
+
+
+def test_accumulator_remove():
+    array_6d = numpy.random.normal(0., 1., (6, 1000))
+    acc = MomentAccumulator6D().add(array_6d).remove(array_6d[:, 700:])
+    assert acc.count == 700
+    assert numpy.allclose(acc.calc_correlations6d(), stats6d.calc_correlations6d(array_6d[:, :700]))
+
+
+def test_core_refit_not_converged():
+    array_6d = _gaussian_beam(2000)
+    with pytest.warns(UserWarning, match='did not converge'):
+        calc_core_twiss2d(array_6d, 0, 0.5, max_iterations=1)
@@ -0,0 +1,65 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import pytest
+import numpy
+from rsbeams.rsdata.SDDS import readSDDS, writeSDDS
+from rsbeams.rsdata.particle_join import ParticleIndex, iter_page_joins
+
+_bunch_file = os.path.join(os.path.dirname(__file__), 'bunch_5001.sdds')
+
+
+def test_particle_index_join():
+    reference = numpy.random.permutation(1000) + 1
+    other = numpy.random.permutation(numpy.concatenate([reference[:600], [5000, 5001]]))
+    match = ParticleIndex(reference).join(other)
+
+    assert numpy.all(other[match.index] == reference[match.reference_index])
+    assert numpy.all(match.survived == numpy.sort(reference[:600]))
+    assert numpy.all(match.lost == numpy.sort(reference[600:]))
+    assert numpy.all(match.unmatched == [5000, 5001])
+
+    with pytest.raises(ValueError):
+        ParticleIndex([1, 2, 2])
+
+
+def test_iter_page_joins(tmpdir):
+    reader = readSDDS(_bunch_file)
+    reader.read()
+    ids = reader.columns['particleID'][0]
+    x = reader.columns['x'][0]
+
+    # A shuffled subset of the bunch, as seen at a downstream watch point
+    keep = numpy.random.permutation(ids.shape[0])[:5000]
+    watch_file = str(tmpdir.join('watch.sdds'))
+    file_out = writeSDDS()
+    file_out.create_column('x', x[keep], 'double')
+    file_out.create_column('particleID', ids[keep].astype(float), 'double')
+    file_out.save_sdds(watch_file, dataMode='binary')
+
+    joins = list(iter_page_joins(_bunch_file, watch_file))
+    assert len(joins) == 1
+    page, columns, match = joins[0]
+    assert numpy.all(columns['x'][match.index] == x[match.reference_index])
+    assert match.survived.shape[0] == 5000
+    assert match.lost.shape[0] == ids.shape[0] - 5000
+    assert numpy.all(numpy.isin(match.lost, ids[keep], invert=True))
+
+
+def test_iter_page_joins_multipage(tmpdir, write_multipage_sdds):
+    # Each pass loses particles from a shuffled beam
+    ids = numpy.random.permutation(500) + 1.
+    kept = [ids, ids[:400], ids[:250]]
+    pages = [numpy.column_stack([ids * 1e-3, ids]) for ids in kept]
+    watch_file = str(tmpdir.join('watch.sdds'))
+    write_multipage_sdds(watch_file, ['x', 'particleID'], pages)
+
+    joins = list(iter_page_joins(watch_file, watch_file))
+    assert [page for page, _, _ in joins] == [0, 1, 2]
+    for (page, columns, match), ids in zip(joins, kept):
+        assert numpy.all(columns['x'][match.index] == columns['particleID'][match.index] * 1e-3)
+        assert numpy.all(match.survived == numpy.sort(ids))
+        assert match.lost.shape[0] == 500 - ids.shape[0]
+        assert match.unmatched.shape[0] == 0
+
+    joins = list(iter_page_joins(watch_file, watch_file, pages=[2]))
+    assert len(joins) == 1 and joins[0][0] == 2
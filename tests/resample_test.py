@@ -0,0 +1,40 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import pytest
+import numpy
+from rsbeams.rsstats import stats6d
+from rsbeams.rsstats import resample
+from rsbeams.rsstats.resample import bootstrap6d, jackknife6d, calc_resampled_moments6d
+
+
+def test_resampled_moments():
+    array_6d = numpy.random.normal(0., 1., (6, 500)) + 10.
+    weights = numpy.random.uniform(0.5, 2., 500)
+    counts = numpy.random.randint(0, 3, (4, 500))
+    avg, sigma = calc_resampled_moments6d(array_6d, counts, weights)
+    for b in range(4):
+        expanded = numpy.repeat(array_6d, counts[b], axis=1)
+        expanded_weights = numpy.repeat(weights, counts[b])
+        assert numpy.allclose(avg[b], stats6d.calc_avg6d(expanded, expanded_weights))
+        assert numpy.allclose(sigma[b], stats6d.calc_correlations6d(expanded, expanded_weights))
+
+
+def test_bootstrap_jackknife(monkeypatch):
+    # several resample batches
+    monkeypatch.setattr(resample, 'max_counts_size', 4000 * 64)
+    array_6d = numpy.random.normal(0., 1., (6, 4000))
+    array_6d[1,:] += 0.5 * array_6d[0,:]
+
+    estimate, error, samples = bootstrap6d(array_6d, n_resamples=300, seed=42, workers=1)
+    assert samples.emit.shape == (300, 3)
+    assert estimate.emit == pytest.approx(stats6d.calc_emittance6d(array_6d))
+    # standard error of the mean
+    assert numpy.allclose(error.avg, stats6d.calc_rms6d(array_6d) / numpy.sqrt(4000), rtol=0.2)
+
+    # seeded results do not depend on the number of workers
+    parallel = bootstrap6d(array_6d, n_resamples=300, seed=42, workers=2)[1]
+    assert numpy.allclose(parallel.emit, error.emit)
+
+    estimate, jack_error = jackknife6d(array_6d, seed=1)
+    assert estimate.rms == pytest.approx(stats6d.calc_rms6d(array_6d))
+    assert numpy.allclose(jack_error.avg, stats6d.calc_rms6d(array_6d) / numpy.sqrt(4000), rtol=0.5)
+    assert numpy.allclose(jack_error.emit, error.emit, rtol=0.5)
@@ -0,0 +1,47 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import pytest
+import numpy
+from rsbeams.rsstats import stats6d
+from rsbeams.rsstats.slices import slice_index6d, slice_moments, calc_slice_correlations6d
+
+
+def test_slice_moments():
+    array_6d = numpy.random.normal(0., 1., (6, 20000))
+    array_6d[1,:] += 0.3 * array_6d[4,:] * array_6d[0,:]
+    weights = numpy.random.uniform(0.5, 1.5, 20000)
+
+    for method in ['width', 'population']:
+        table = slice_moments(array_6d, 8, method=method, weights=weights, total_charge=1.e-9)
+        index, edges = slice_index6d(array_6d, 8, method=method, weights=weights)
+        assert numpy.all(numpy.diff(edges) >= 0.)
+        assert numpy.sum(table['Particles']) == 20000
+        assert numpy.sum(table['charge']) == pytest.approx(1.e-9)
+        for n in [0, 5]:
+            mask = index == n
+            assert numpy.all(array_6d[4, mask] >= edges[n]) and numpy.all(array_6d[4, mask] <= edges[n + 1])
+            sigma = stats6d.calc_correlations6d(array_6d[:, mask], weights[mask])
+            alpha, beta, emit = stats6d.calc_twiss_params6d(sigma)
+            assert table['x_avg'][n] == pytest.approx(stats6d.calc_avg6d(array_6d[:, mask], weights[mask])[0])
+            assert table['delta_rms'][n] == pytest.approx(numpy.sqrt(sigma[5, 5]))
+            assert table['emit_x'][n] == pytest.approx(emit[0])
+            assert table['alpha_y'][n] == pytest.approx(alpha[1])
+            assert table['current'][n] == pytest.approx(table['charge'][n] / (edges[n + 1] - edges[n]))
+
+    # equal population slices
+    index, edges = slice_index6d(array_6d, 8, method='population')
+    assert numpy.all(numpy.bincount(index) == 2500)
+
+
+def test_slice_correlations_batches(monkeypatch):
+    array_6d = numpy.random.normal(0., 1., (6, 5000))
+    weights = numpy.random.uniform(0.5, 1.5, 5000)
+    index = numpy.random.randint(0, 7, 5000)
+    # slice 3 is empty
+    index[index == 3] = 4
+    full = calc_slice_correlations6d(array_6d, index, 7, weights=weights)
+
+    monkeypatch.setattr(stats6d, 'batch_size', 700)
+    batched = calc_slice_correlations6d(array_6d, index, 7, weights=weights)
+    for values, expected in zip(batched, full):
+        assert numpy.allclose(values, expected, equal_nan=True)
+    assert numpy.all(numpy.isnan(batched[3][3]))
@@ -33,3 +33,40 @@ def test_stats_01():
             stats6d.specify_significant_figures(avg_test[i], 4)
 
 #test_stats_01()
+
+def test_stats_vectorized():
+    array_6d = numpy.random.normal(0., 1., (6, 3 * stats6d.batch_size + 17))
+    array_6d[1,:] += 0.7 * array_6d[0,:]
+    array_6d[5,:] -= 0.3 * array_6d[2,:]
+    array_6d += 1.e3
+
+    corr = stats6d.calc_correlations6d(array_6d)
+    assert numpy.allclose(corr, numpy.cov(array_6d, bias=True))
+    assert numpy.allclose(stats6d.calc_variance6d(array_6d), numpy.var(array_6d, axis=1))
+
+    stats6d.rm_correlations6d(array_6d)
+    corr = stats6d.calc_correlations6d(array_6d)
+    assert numpy.allclose(corr - numpy.diag(numpy.diag(corr)), 0.)
+
+    eig_vals, eig_vecs = stats6d.jacobi_eigen_solver6d(numpy.cov(array_6d))
+    assert numpy.allclose(eig_vecs @ numpy.diag(eig_vals) @ eig_vecs.T, numpy.cov(array_6d))
+
+def test_stats_weighted():
+    array_6d = numpy.random.normal(0., 1., (6, stats6d.batch_size + 101))
+    array_6d[3,:] += 0.4 * array_6d[2,:]
+    weights = numpy.random.randint(0, 4, array_6d.shape[1]).astype(float)
+    # integer weights are equivalent to repeating each particle
+    expanded = numpy.repeat(array_6d, weights.astype(int), axis=1)
+
+    assert numpy.allclose(stats6d.calc_avg6d(array_6d, weights), stats6d.calc_avg6d(expanded))
+    assert numpy.allclose(stats6d.calc_rms6d(array_6d, weights), stats6d.calc_rms6d(expanded))
+    assert numpy.allclose(stats6d.calc_correlations6d(array_6d, weights), stats6d.calc_correlations6d(expanded))
+    assert numpy.allclose(stats6d.calc_emittance6d(array_6d, weights), stats6d.calc_emittance6d(expanded))
+    assert numpy.all(stats6d.calc_min6d(array_6d, weights) == stats6d.calc_min6d(expanded))
+    assert numpy.all(stats6d.calc_max6d(array_6d, weights) == stats6d.calc_max6d(expanded))
+    assert numpy.allclose(stats6d.calc_emittance6d(array_6d, numpy.ones(array_6d.shape[1])),
+                          stats6d.calc_emittance6d(array_6d))
+
+    stats6d.rm_correlations6d(array_6d, weights)
+    corr = stats6d.calc_correlations6d(array_6d, weights)
+    assert numpy.allclose(corr - numpy.diag(numpy.diag(corr)), 0.)
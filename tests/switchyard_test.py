@@ -0,0 +1,339 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import pytest
+import numpy
+import h5py
+import scipy.constants
+from rsbeams.rsdata.opal import OpalReader
+from rsbeams.rsdata.switchyard import Switchyard
+from rsbeams.rsptcls.species import Species
+from rsbeams.rsdata.SDDS import readSDDS
+
+
+def _make_opal_file(file_name, steps=3, num_ptcls=1000, chunk=64):
+    data = {}
+    with h5py.File(file_name, 'w') as f:
+        for step in range(steps):
+            grp = f.create_group('Step#{}'.format(step))
+            grp.attrs['CHARGE'] = 1e-9 * (step + 1)
+            coords = numpy.random.normal(size=(num_ptcls, 6))
+            for i, name in enumerate(['x', 'px', 'y', 'py', 'z', 'pz']):
+                grp.create_dataset(name, data=coords[:, i], chunks=(chunk,))
+            data[step] = coords
+    return data
+
+
+def test_opal_reader_steps(tmpdir):
+    file_name = str(tmpdir.join('opal.h5'))
+    data = _make_opal_file(file_name)
+    with OpalReader(file_name) as reader:
+        assert reader.steps == [0, 1, 2]
+        assert reader.particle_count(1) == 1000
+        assert reader.chunk_rows(0, target_rows=200) == 192
+        for step, blocks in reader.iter_steps(chunk_rows=300):
+            blocks = list(blocks)
+            assert [b.shape[0] for b in blocks] == [300, 300, 300, 100]
+            assert numpy.array_equal(numpy.concatenate(blocks), data[step])
+        assert numpy.array_equal(reader.read_step(0), data[0])
+        assert numpy.array_equal(reader.read_step(), data[2])
+
+
+def test_switchyard_read_opal(tmpdir):
+    file_name = str(tmpdir.join('opal.h5'))
+    data = _make_opal_file(file_name)
+    sy = Switchyard(file_name, 'opal')
+    species = sy.species['Species_0']
+    assert numpy.array_equal(species.x, data[2][:, 0])
+    assert species.total_charge == pytest.approx(3e-9)
+
+
+def test_species_views_and_conversion():
+    elegant = numpy.random.uniform(1., 2., size=(100, 6))
+    buffer = elegant.copy()
+    species = Species(buffer, charge=-1, mass=0.511e6, total_charge=1e-9)
+    assert species.coordinates is buffer
+    species.convert_from_elegant()
+    assert numpy.shares_memory(species.ux, buffer)
+    assert numpy.allclose(species.ux, elegant[:, 1] * elegant[:, 5])
+    assert numpy.allclose(species.to_elegant(), elegant)
+    species.convert_to_elegant()
+    assert numpy.allclose(buffer, elegant)
+
+
+def test_write_genesis(tmpdir):
+    opal_file = str(tmpdir.join('opal.h5'))
+    data = _make_opal_file(opal_file)[2]
+    sy = Switchyard(opal_file, 'opal')
+    expected = data.copy()
+    expected[:, 4] = (data[:, 4] - numpy.average(data[:, 4])) / scipy.constants.c
+
+    ascii_file = str(tmpdir.join('dist.txt'))
+    sy.write_genesis(ascii_file, 'Species_0', chunk_rows=300)
+    with open(ascii_file) as f:
+        header = [f.readline() for _ in range(4)]
+    assert header[2] == '? SIZE = 1000\n'
+    assert header[3] == '? COLUMNS X PX Y PY T P\n'
+    assert numpy.allclose(numpy.loadtxt(ascii_file, comments='?'), expected, rtol=1e-12, atol=1e-20)
+
+    h5_file = str(tmpdir.join('dist.h5'))
+    sy.write_genesis4(h5_file, 'Species_0', chunk_rows=300)
+    with h5py.File(h5_file, 'r') as f:
+        for i, name in enumerate(['x', 'px', 'y', 'py', 't', 'p']):
+            assert numpy.allclose(f[name][()], expected[:, i], rtol=1e-12, atol=1e-20)
+
+
+def test_round_trips(tmpdir):
+    opal_file = str(tmpdir.join('opal.h5'))
+    data = _make_opal_file(opal_file)[2]
+    sy = Switchyard(opal_file, 'opal')
+
+    opal_out = str(tmpdir.join('out.h5'))
+    sy.write_opal(opal_out, 'Species_0', chunk_rows=128, compression='gzip')
+    with OpalReader(opal_out) as reader:
+        assert reader.steps == [0]
+        assert numpy.array_equal(reader.read_step(), data)
+        assert reader.total_charge() == sy.species['Species_0'].total_charge
+
+    genesis_out = str(tmpdir.join('dist.txt'))
+    sy.write_genesis(genesis_out, 'Species_0')
+    genesis = Switchyard(genesis_out, 'genesis').species['Species_0']
+    genesis4_out = str(tmpdir.join('dist.h5'))
+    sy.write_genesis4(genesis4_out, 'Species_0')
+    genesis4 = Switchyard(genesis4_out, 'genesis').species['Species_0']
+    for species in [genesis, genesis4]:
+        assert len(species) == 1000
+        assert species.total_charge == pytest.approx(3e-9)
+        assert numpy.allclose(species.ux, data[:, 1])
+        assert numpy.allclose(species.ct, data[:, 4] - numpy.average(data[:, 4]))
+
+
+def test_read_genesis_alternate_columns(tmpdir):
+    file_name = str(tmpdir.join('dist.txt'))
+    with open(file_name, 'w') as f:
+        f.write('? VERSION = 1.0\n? SIZE = 2\n? COLUMNS X XPRIME Y YPRIME Z GAMMA\n')
+        f.write('1 0.5 2 0.25 0.3 3\n-1 -0.5 -2 -0.25 -0.3 3\n')
+    species = Switchyard(file_name, 'genesis').species['Species_0']
+    p = numpy.sqrt(8.)
+    assert numpy.allclose(species.pt, p)
+    assert numpy.allclose(species.ux, [0.5 * p, -0.5 * p])
+    assert numpy.allclose(species.ct, [-0.3, 0.3])
+
+
+def test_openpmd_round_trip(tmpdir):
+    opal_file = str(tmpdir.join('opal.h5'))
+    _make_opal_file(opal_file)
+    sy = Switchyard(opal_file, 'opal')
+    species = sy.species['Species_0']
+    # openPMD stores the longitudinal momentum, so the total momentum must exceed the transverse
+    species.pt = numpy.sqrt(species.ux**2 + species.uy**2) + 1.
+
+    file_name = str(tmpdir.join('openpmd.h5'))
+    sy.write_openpmd(file_name, 'Species_0', chunk_rows=300)
+    with h5py.File(file_name, 'r') as f:
+        assert f.attrs['openPMD'] == b'1.1.0'
+        assert f['data/0/particles/electrons/momentum/z'].attrs['unitSI'] == pytest.approx(0.511e6 * 5.344286e-28)
+    result = Switchyard(file_name, 'openpmd').species['Species_0']
+    assert result.mass == pytest.approx(0.511e6)
+    assert result.charge == pytest.approx(-1)
+    assert result.total_charge == pytest.approx(3e-9)
+    assert numpy.allclose(result.coordinates, species.coordinates)
+
+
+def test_streaming_convert(tmpdir):
+    opal_file = str(tmpdir.join('opal.h5'))
+    data = _make_opal_file(opal_file)[2]
+    sy = Switchyard(opal_file, 'opal')
+
+    for code in ['genesis', 'genesis4', 'opal']:
+        expected = str(tmpdir.join('expected_' + code))
+        streamed = str(tmpdir.join('streamed_' + code))
+        sy.write(expected, code)
+        assert Switchyard.convert(opal_file, 'opal', streamed, code, chunk_rows=128) == streamed
+        result = Switchyard(streamed, 'opal' if code == 'opal' else 'genesis').species['Species_0']
+        reference = Switchyard(expected, 'opal' if code == 'opal' else 'genesis').species['Species_0']
+        assert numpy.allclose(result.coordinates, reference.coordinates, rtol=1e-12, atol=1e-20)
+        assert result.total_charge == pytest.approx(reference.total_charge)
+
+    elegant_file = str(tmpdir.join('streamed.sdds'))
+    Switchyard.convert(opal_file, 'opal', elegant_file, 'elegant', chunk_rows=300)
+    reader = readSDDS(elegant_file)
+    reader.read()
+    assert numpy.allclose(reader.columns['xp'][0], data[:, 1] / data[:, 5])
+    assert reader.parameters['Charge'][0] == pytest.approx(3e-9)
+
+    genesis_file = str(tmpdir.join('physical_genesis'))
+    openpmd_file = str(tmpdir.join('streamed.h5'))
+    species = sy.species['Species_0']
+    species.pt = numpy.sqrt(species.ux**2 + species.uy**2) + 1.
+    sy.write(genesis_file, 'genesis')
+    Switchyard.convert(genesis_file, 'genesis', openpmd_file, 'openpmd', chunk_rows=128)
+    result = Switchyard(openpmd_file, 'openpmd').species['Species_0']
+    reference = Switchyard(genesis_file, 'genesis').species['Species_0']
+    assert numpy.allclose(result.coordinates, reference.coordinates)
+
+
+def test_pkcli_batch_convert(tmpdir, capsys):
+    from rsbeams.pkcli import particles
+
+    for i in range(2):
+        _make_opal_file(str(tmpdir.join('run{}.h5'.format(i))), steps=1)
+    pattern = str(tmpdir.join('run*.h5'))
+    particles.convert(pattern, 'genesis4', workers=1)
+    output = tmpdir.join('run0.genesis4.h5')
+    assert output.check()
+    mtime = output.mtime()
+
+    # Up to date outputs (and outputs matching the pattern) are not converted again
+    particles.convert(pattern, 'genesis4', workers=1)
+    assert output.mtime() == mtime
+    assert not tmpdir.join('run0.genesis4.genesis4.h5').check()
+    result = Switchyard(str(output), 'genesis').species['Species_0']
+    assert len(result) == 1000
+
+    capsys.readouterr()
+    particles.convert(pattern, 'genesis4', workers=2, force=True)
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and lines[-1].startswith('Converted 2 files')
+    with pytest.raises(ValueError):
+        particles.convert(pattern, 'bogus')
+
+
+def test_weights_and_ids(tmpdir):
+    opal_file = str(tmpdir.join('weighted.h5'))
+    data = _make_opal_file(opal_file, steps=1)[0]
+    weights = numpy.random.uniform(1e3, 2e3, data.shape[0])
+    ids = numpy.arange(data.shape[0]) * 7 + 1
+    with h5py.File(opal_file, 'a') as f:
+        f['Step#0'].create_dataset('q', data=-weights * scipy.constants.e)
+        f['Step#0'].create_dataset('id', data=ids)
+
+    species = Switchyard(opal_file, 'opal').species['Species_0']
+    assert numpy.allclose(species.weights, weights)
+    assert numpy.all(species.ids == ids)
+    assert numpy.allclose(species.macroparticle_charges(), -weights * scipy.constants.e)
+
+    sy = Switchyard(opal_file, 'opal')
+    for code in ['opal', 'openpmd']:
+        written = str(tmpdir.join('written_' + code))
+        streamed = str(tmpdir.join('streamed_' + code))
+        sy.write(written, code, chunk_rows=300)
+        Switchyard.convert(opal_file, 'opal', streamed, code, chunk_rows=128)
+        for file_name in [written, streamed]:
+            result = Switchyard(file_name, code).species['Species_0']
+            assert numpy.allclose(result.weights, weights)
+            assert numpy.all(result.ids == ids)
+
+    blocks = list(species.iter_blocks(300))
+    assert numpy.all(blocks[-1].ids == ids[900:])
+    assert numpy.sum([b.total_charge for b in blocks]) == pytest.approx(numpy.sum(weights) * scipy.constants.e)
+
+
+def test_openpmd_macro_weighted(tmpdir):
+    from rsbeams.rsdata.openpmd import OpenPMDReader, OpenPMDWriter
+
+    block = numpy.random.normal(0., 1., (500, 6))
+    block[:, 5] = numpy.sqrt(block[:, 1]**2 + block[:, 3]**2) + 1.
+    # One particle moving backwards, one with the transverse momentum rounded above the total
+    block[0, 5] *= -1.
+    block[1, 5] = numpy.sqrt(block[1, 1]**2 + block[1, 3]**2) * (1. - 1e-16)
+    weights = numpy.random.uniform(1e3, 2e3, block.shape[0])
+    file_name = str(tmpdir.join('weighted.h5'))
+    with OpenPMDWriter(file_name, block.shape[0], 1e-9, weights=True) as writer:
+        writer.write(block, weights=weights)
+
+    # Store the momentum and charge of each macroparticle rather than of one real particle
+    with h5py.File(file_name, 'a') as f:
+        group = f['data/0/particles/electrons']
+        for axis in ['x', 'y', 'z']:
+            group['momentum/' + axis][:] *= weights
+        group['momentum'].attrs['macroWeighted'] = numpy.uint32(1)
+        del group['charge']
+        charge = group.create_dataset('charge', data=-weights)
+        charge.attrs['unitSI'] = scipy.constants.e
+        charge.attrs['macroWeighted'] = numpy.uint32(1)
+        charge.attrs['weightingPower'] = 1.
+
+    with OpenPMDReader(file_name) as reader:
+        result = reader.read(chunk_rows=128)
+        assert numpy.allclose(reader.read_record('charge'), -scipy.constants.e)
+        assert numpy.allclose(reader.read_record('weighting'), weights)
+        assert reader.charge() == pytest.approx(-1)
+        assert reader.total_charge() == pytest.approx(numpy.sum(weights) * scipy.constants.e)
+    assert result[0, 5] < 0.
+    assert numpy.allclose(result[:, 5], block[:, 5])
+    assert numpy.allclose(result[:, [0, 1, 2, 3]], block[:, [0, 1, 2, 3]])
+    assert numpy.allclose(result[:, 4], block[:, 4])
+
+    with pytest.raises(ValueError):
+        OpenPMDWriter(str(tmpdir.join('no_charge.h5')), 10, 1e-9, charge=None)
+
+
+def test_weights_dropped_warning(tmpdir):
+    import warnings
+
+    opal_file = str(tmpdir.join('weighted.h5'))
+    data = _make_opal_file(opal_file, steps=1)[0]
+    with h5py.File(opal_file, 'a') as f:
+        f['Step#0'].create_dataset('q', data=numpy.full(data.shape[0], -1e3 * scipy.constants.e))
+
+    # uniform weights are written without loss
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        Switchyard(opal_file, 'opal').write(str(tmpdir.join('uniform.sdds')), 'elegant')
+        Switchyard.convert(opal_file, 'opal', str(tmpdir.join('uniform_streamed.sdds')), 'elegant', chunk_rows=128)
+
+    with h5py.File(opal_file, 'a') as f:
+        f['Step#0/q'][900:] *= 2.
+    for code in ['elegant', 'genesis']:
+        with pytest.warns(UserWarning, match='uniform weights'):
+            Switchyard(opal_file, 'opal').write(str(tmpdir.join('varying_' + code)), code)
+        with pytest.warns(UserWarning, match='uniform weights'):
+            Switchyard.convert(opal_file, 'opal', str(tmpdir.join('varying_streamed_' + code)), code,
+                               chunk_rows=128)
+
+
+def test_writers_check_row_count(tmpdir):
+    from rsbeams.rsdata.genesis import GenesisDistributionWriter, Genesis4Writer
+    from rsbeams.rsdata.opal import OpalWriter
+    from rsbeams.rsdata.openpmd import OpenPMDWriter
+
+    block = numpy.random.normal(0., 1., (10, 6))
+    block[:, 5] = 10.
+    for n, writer_class in enumerate([GenesisDistributionWriter, Genesis4Writer, OpalWriter, OpenPMDWriter]):
+        with writer_class(str(tmpdir.join('complete_{}'.format(n))), 10, 1e-9) as writer:
+            writer.write(block[:4])
+            writer.write(block[4:])
+        writer = writer_class(str(tmpdir.join('short_{}'.format(n))), 10, 1e-9)
+        writer.write(block[:4])
+        with pytest.raises(ValueError, match='declares 10 particles but 4 rows'):
+            writer.close()
+
+
+def test_unweighted_block_charges():
+    from rsbeams.rsptcls.species import Species
+
+    species = Species(numpy.random.normal(0., 1., (1000, 6)), charge=-1, mass=0.511e6, total_charge=2e-9)
+    blocks = list(species.iter_blocks(300))
+    assert [b.total_charge for b in blocks] == pytest.approx([6e-10] * 3 + [2e-10])
+    charges = numpy.concatenate([b.macroparticle_charges() for b in blocks])
+    assert numpy.allclose(charges, species.macroparticle_charges())
+    assert numpy.allclose(charges, -2e-12)
+
+    with pytest.raises(ValueError):
+        Species(numpy.zeros((10, 6))).macroparticle_charges()
+
+
+def test_shape_validation(tmpdir):
+    from rsbeams.rsptcls.species import Species
+
+    with pytest.raises(ValueError):
+        Species(numpy.zeros((10, 5)))
+    with pytest.raises(ValueError):
+        Species(numpy.zeros((10, 6)), weights=numpy.ones(9))
+    with pytest.raises(ValueError):
+        Species(numpy.zeros((10, 6))).to_elegant(out=numpy.empty((9, 6)))
+
+    opal_file = str(tmpdir.join('opal.h5'))
+    data = _make_opal_file(opal_file, steps=1)[0]
+    with OpalReader(opal_file) as reader:
+        with pytest.raises(ValueError):
+            reader.read_step(out=numpy.empty((data.shape[0] + 1, 6)))
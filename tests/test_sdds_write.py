@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 from rsbeams.rsdata.SDDS import writeSDDS, readSDDS
 from subprocess import Popen, PIPE
@@ -93,5 +96,38 @@ class TestWriteAscii(unittest.TestCase):
 #         self.assertEqual(self.status, 'ok\n')
 
 
+class TestWriteStream(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'stream.sdds')
+        self.stream = writeSDDS()
+        self.stream.create_column('col1', None, 'double')
+        self.stream.create_column('col2', None, 'double')
+        self.stream.open_stream(self.file_name, 5, dataMode='binary')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_rows_written(self):
+        rows = np.arange(10.).reshape(5, 2)
+        self.stream.write_rows(rows[:3])
+        self.stream.write_rows(rows[3:])
+        self.stream.close_stream()
+        reader = readSDDS(self.file_name)
+        reader.read()
+        self.assertTrue(np.all(reader.columns['col2'][0] == rows[:, 1]))
+
+    def test_too_few_rows(self):
+        self.stream.write_rows(np.zeros((4, 2)))
+        self.assertRaises(ValueError, self.stream.close_stream)
+
+    def test_too_many_rows(self):
+        self.stream.write_rows(np.zeros((4, 2)))
+        self.assertRaises(ValueError, self.stream.write_rows, np.zeros((2, 2)))
+        self.stream.write_rows(np.zeros((1, 2)))
+        self.stream.close_stream()
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,47 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+import os
+import pytest
+import numpy
+from rsbeams.rsdata.SDDS import readSDDS
+from rsbeams.rsdata.watch import moment_history
+
+_bunch_file = os.path.join(os.path.dirname(__file__), 'bunch_5001.sdds')
+
+
+def test_moment_history():
+    history = moment_history(_bunch_file)
+    reader = readSDDS(_bunch_file)
+    reader.read()
+    x = reader.columns['x'][0]
+    xp = reader.columns['xp'][0]
+
+    assert history.shape == (1,)
+    assert history['Particles'][0] == x.shape[0]
+    assert history['s'][0] == pytest.approx(reader.parameters['s'][0])
+    assert history['x_avg'][0] == pytest.approx(numpy.mean(x))
+    assert history['x_rms'][0] == pytest.approx(numpy.std(x))
+    sigma = numpy.cov(x, xp, bias=True)
+    emit = numpy.sqrt(numpy.linalg.det(sigma))
+    assert history['emit_x'][0] == pytest.approx(emit)
+    assert history['beta_x'][0] == pytest.approx(sigma[0, 0] / emit)
+    assert history['alpha_x'][0] == pytest.approx(-sigma[0, 1] / emit)
+
+
+def test_moment_history_multipage(tmpdir, capsys, write_multipage_sdds):
+    pages = [numpy.random.normal(1., 0.1, (n, 6)) for n in [100, 200, 150]]
+    file_name = str(tmpdir.join('watch.sdds'))
+    write_multipage_sdds(file_name, ['x', 'xp', 'y', 'yp', 't', 'p'], pages)
+
+    history = moment_history(file_name)
+    assert numpy.all(history['page'] == [0, 1, 2])
+    assert numpy.all(history['Pass'] == [1, 2, 3])
+    assert numpy.all(history['Particles'] == [100, 200, 150])
+    for page, block in zip(history, pages):
+        assert page['x_rms'] == pytest.approx(numpy.std(block[:, 0]))
+        assert page['y_avg'] == pytest.approx(numpy.mean(block[:, 2]))
+
+    # only the requested pages are read, without output
+    capsys.readouterr()
+    history = moment_history(file_name, pages=[1])
+    assert numpy.all(history['Pass'] == [2])
+    assert capsys.readouterr().out == ''